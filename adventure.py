@@ -0,0 +1,121 @@
+# adventure.py
+# Reglas de la aventura espacial: botín, mejoras y resolución de combates.
+# No depende de Discord ni de la base de datos, así que lo comparten bot.py y
+# simulator.py (el simulador de balance).
+import random
+
+LOOT_TABLE = {
+    'Fácil': [
+        {'name': 'Fragmento de Titanio', 'value': 5},
+        {'name': 'Cableado Básico', 'value': 3},
+        {'name': 'Chatarra Espacial', 'value': 1}
+    ],
+    'Intermedio': [
+        {'name': 'Placa de Acero Reforzado', 'value': 15},
+        {'name': 'Cristal de Kyber (Pequeño)', 'value': 20},
+        {'name': 'Procesador de Navegación', 'value': 18}
+    ],
+    'Difícil': [
+        {'name': 'Núcleo de Energía de Singularidad', 'value': 50},
+        {'name': 'Aleación de Neutronio', 'value': 60},
+        {'name': 'Mapa Estelar Antiguo', 'value': 45}
+    ]
+}
+
+UPGRADE_CATALOG = {
+    "ship": {
+        "name": "Nave",
+        "upgrades": [
+            # Nivel 2
+            {
+                "level": 2, "power_increase": 15,
+                "cost_lbucks": 60,
+                "cost_materials": {"Fragmento de Titanio": 5, "Cableado Básico": 3}
+            },
+            # Nivel 3
+            {
+                "level": 3, "power_increase": 25,
+                "cost_lbucks": 140,
+                "cost_materials": {"Placa de Acero Reforzado": 3, "Procesador de Navegación": 1}
+            },
+        ]
+    },
+    "station": {
+        "name": "Estación",
+        "upgrades": [
+            # Nivel 2
+            {
+                "level": 2, "power_increase": 10,
+                "cost_lbucks": 120,
+                "cost_materials": {"Fragmento de Titanio": 3, "Chatarra Espacial": 10}
+            },
+            # Nivel 3
+            {
+                "level": 3, "power_increase": 20,
+                "cost_lbucks": 280,
+                "cost_materials": {"Placa de Acero Reforzado": 5, "Cristal de Kyber (Pequeño)": 1}
+            },
+        ]
+    }
+}
+
+# --- COMBATE ---
+DIFFICULTY_MULTIPLIER = {'Fácil': 0.5, 'Intermedio': 1.0, 'Difícil': 1.5}
+PLANET_BASE_POWER = (5, 20)  # rango (inclusive) del poder base de un planeta
+MAX_WIN_CHANCE = 0.95
+CONQUEST_POWER_REWARD = 1  # poder que gana el jugador por cada conquista
+
+
+def get_next_upgrade(upgrade_type, current_level):
+    """Devuelve la mejora del nivel siguiente a `current_level`, o None si ya está al máximo."""
+    for upgrade in UPGRADE_CATALOG[upgrade_type]['upgrades']:
+        if upgrade['level'] == current_level + 1:
+            return upgrade
+    return None
+
+
+def win_chance(player_power, planet_power, clip=min):
+    """Probabilidad de ganar un combate.
+
+    `clip` aplica el tope MAX_WIN_CHANCE; el simulador pasa numpy.minimum para
+    evaluar la misma fórmula sobre arrays completos.
+    """
+    return clip(MAX_WIN_CHANCE, 0.5 + ((player_power - planet_power) / (player_power + 1)))
+
+
+def draw_planet_power(rng, multiplier, size=None, to_int=int):
+    """Poder de un planeta: base uniforme en PLANET_BASE_POWER por el multiplicador de dificultad.
+
+    `rng` es el módulo random o un numpy.random.Generator; con `size` y un `to_int`
+    para arrays, el simulador sortea el poder de todos los planetas a la vez.
+    """
+    low, high = PLANET_BASE_POWER
+    u = rng.random() if size is None else rng.random(size)
+    return (low + to_int(u * (high - low + 1))) * multiplier
+
+
+def draw_loot_index(rng, loot_count, size=None, to_int=int):
+    """Índice del botín, uniforme entre los `loot_count` objetos de la dificultad."""
+    u = rng.random() if size is None else rng.random(size)
+    return to_int(u * loot_count)
+
+
+def resolve_combat(player_power, planet, rng=random):
+    """Resuelve el combate de un jugador contra un planeta.
+
+    Devuelve {'won', 'chance', 'planet_power', 'reward', 'loot', 'power_reward'};
+    si el jugador pierde, reward, loot y power_reward valen 0/None.
+    """
+    planet_power = draw_planet_power(rng, DIFFICULTY_MULTIPLIER.get(planet['difficulty'], 1.0))
+    chance = win_chance(player_power, planet_power)
+    result = {'won': False, 'chance': chance, 'planet_power': planet_power,
+              'reward': 0, 'loot': None, 'power_reward': 0}
+    if rng.random() < chance:
+        loot_table = LOOT_TABLE.get(planet['difficulty'], [])
+        result.update(
+            won=True,
+            reward=planet['reward_lbucks'],
+            loot=loot_table[draw_loot_index(rng, len(loot_table))] if loot_table else None,
+            power_reward=CONQUEST_POWER_REWARD,
+        )
+    return result
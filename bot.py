@@ -6,17 +6,27 @@ from discord.ui import Button, View
 import os
 from dotenv import load_dotenv
 import datetime
-from flask import Flask
-from threading import Thread
-from waitress import serve
 import database as db
+import database_async as adb
+from redemptions import redemption_engine
+from discord_cache import UserResolver, MessageAuthorIndex
+from ranking import leaderboards, METRICS
+from adventure import UPGRADE_CATALOG, get_next_upgrade, resolve_combat
+from game_sessions import GameSessions
+from invite_tracker import InviteTracker, index_invites
+import metrics
+from loop_monitor import loop_monitor
+from db_executor import db_executor, async_db_gate, DBOverloaded, PRIORITY_BACKGROUND
+from state_snapshot import STATE_SNAPSHOT_INTERVAL, read_snapshot, write_snapshot
 from config import GUILD_ID, ADMIN_ROLE_NAME, REDEMPTION_LOG_CHANNEL_ID
 import asyncio
 import random
 import aiohttp
+from aiohttp import web
 from unidecode import unidecode
 import traceback
 import sys
+import time
 
 
 # --- 1. CONFIGURACIÓN E INICIALIZACIÓN ---
@@ -26,12 +36,179 @@ intents = discord.Intents.default()
 intents.members = True
 intents.message_content = True
 intents.reactions = True
-bot = discord.Bot(intents=intents)
+
+class LBucksBot(discord.Bot):
+    async def invoke_application_command(self, ctx):
+        # Los errores no salen de aquí (py-cord los despacha a on_application_command_error,
+        # que los cuenta); medimos la duración completa del comando.
+        command_name = ctx.command.qualified_name
+        with metrics.COMMAND_SECONDS.time(command=command_name), metrics.activity(f"/{command_name}"):
+            await super().invoke_application_command(ctx)
+
+    async def start(self, token, *, reconnect=True):
+        # El servidor web arranca primero para que los health checks respondan mientras
+        # el bot hace login y conecta (/ready devuelve 503 hasta on_ready).
+        self.web_runner = await start_web_server()
+        # Restauramos el estado guardado después del login (así la API REST ya está
+        # disponible si alguna partida caducó mientras el bot estaba apagado) y antes
+        # de conectar al gateway, es decir, antes de que llegue on_ready.
+        await self.login(token)
+        restore_runtime_snapshot()
+        loop_monitor.start()
+        await self.connect(reconnect=reconnect)
+
+    async def close(self):
+        # Cerramos el servidor web, guardamos el estado en memoria, escribimos el progreso
+        # de misiones pendiente y cerramos el pool de conexiones async de Supabase antes
+        # de desconectar.
+        if getattr(self, 'web_runner', None) is not None:
+            await self.web_runner.cleanup()
+            self.web_runner = None
+        await save_runtime_snapshot()
+        await adb.message_progress.close()
+        await adb.close()
+        db_executor.close()
+        loop_monitor.stop()
+        await super().close()
+
+bot = LBucksBot(intents=intents)
+user_resolver = UserResolver(bot)
+message_authors = MessageAuthorIndex(bot)
 
 # --- 2. JUEGOS, LISTAS Y GESTIÓN DE ESTADO ---
-number_games = {}
-word_games = {}
+WORD_GAME_TIMEOUT = 7 * 60    # segundos
+NUMBER_GAME_TIMEOUT = 2 * 60  # segundos
+
+async def resolve_channel(channel_id):
+    """Canal desde la caché y, si no está (p. ej. antes de on_ready), desde la API."""
+    channel = bot.get_channel(channel_id)
+    if channel is None:
+        try:
+            channel = await bot.fetch_channel(channel_id)
+        except discord.HTTPException:
+            return None
+    return channel
+
+async def on_word_game_expired(channel_id, game):
+    pending_edit = game.get('edit_task')
+    if pending_edit is not None:
+        pending_edit.cancel()
+    channel = await resolve_channel(channel_id)
+    if channel:
+        await channel.send(f"¡Se acabó el tiempo para el juego de adivinar palabras! La palabra era '{game['word']}'.")
+
+async def on_number_game_expired(channel_id, game):
+    channel = await resolve_channel(channel_id)
+    if channel:
+        await channel.send(f"¡Se acabó el tiempo! El número era **{game['number']}**. Inicia un nuevo juego con `/juego numero`.")
+
+# Cada partida caduca exactamente a su hora; no hay que revisarlas periódicamente.
+number_games = GameSessions(NUMBER_GAME_TIMEOUT, on_number_game_expired)
+word_games = GameSessions(WORD_GAME_TIMEOUT, on_word_game_expired)
 voice_join_times = {}
+invites_cache = {}  # {guild_id: {código: {'uses': int, 'inviter_id': int | None}}}
+
+# --- MÉTRICAS DEL ESTADO EN MEMORIA ---
+metrics.Gauge('lbucks_gateway_latency_seconds', "Latencia del heartbeat del gateway de Discord.",
+              callback=lambda: bot.latency)
+metrics.Gauge('lbucks_cache_entries', "Entradas en las estructuras en memoria del bot.", ('cache',),
+              callback=lambda: {
+                  ('word_games',): len(word_games),
+                  ('number_games',): len(number_games),
+                  ('voice_join_times',): len(voice_join_times),
+                  ('invites_cache',): len(invites_cache),
+                  ('daily_missions',): db.daily_missions.stats()['users'],
+                  ('invite_counts',): len(db.invite_counts),
+              })
+
+# --- SNAPSHOT DEL ESTADO EN MEMORIA ---
+# Las invitaciones guardadas solo se reutilizan si el snapshot es reciente: si el bot
+# estuvo apagado más tiempo pudo haber usos que no vimos, y se vuelven a pedir.
+INVITES_SNAPSHOT_MAX_AGE = int(os.getenv("INVITES_SNAPSHOT_MAX_AGE", "300"))  # segundos
+# Igual con las sesiones de voz: tras una parada larga, el tiempo apagado contaría como
+# minutos en voz. Sin snapshot reciente, las sesiones abiertas empiezan en on_ready.
+VOICE_SNAPSHOT_MAX_AGE = int(os.getenv("VOICE_SNAPSHOT_MAX_AGE", "300"))  # segundos
+
+def build_runtime_snapshot():
+    """Copia serializable del estado en memoria. Los plazos se guardan como hora absoluta."""
+    now = time.time()
+    return {
+        'word_games': {
+            str(channel_id): {
+                'word': game['word'],
+                'guessed_letters': sorted(game['guessed_letters']),
+                'wrong_guesses': sorted(game['wrong_guesses']),
+                'mistakes': game['mistakes'],
+                'start_time': game['start_time'].isoformat(),
+                'message_id': game['message_id'],
+                'expires_at': round(now + word_games.remaining(channel_id)),
+            }
+            # Una partida sin message_id todavía no terminó de crearse.
+            for channel_id, game in word_games.items() if game['message_id'] is not None
+        },
+        'number_games': {
+            str(channel_id): {
+                'number': game['number'],
+                'start_time': game['start_time'].isoformat(),
+                'expires_at': round(now + number_games.remaining(channel_id)),
+            }
+            for channel_id, game in number_games.items()
+        },
+        'voice_join_times': {str(member_id): joined.isoformat() for member_id, joined in voice_join_times.items()},
+        'invites': {str(guild_id): dict(invites) for guild_id, invites in invites_cache.items()},
+    }
+
+def restore_runtime_snapshot():
+    state, age = read_snapshot()
+    if state is None:
+        return
+    now = time.time()
+    try:
+        for channel_id, game in state.get('word_games', {}).items():
+            # El mensaje se vuelve a pedir a la API la primera vez que haga falta editarlo.
+            word_games.start(int(channel_id), {
+                'word': game['word'],
+                'guessed_letters': set(game['guessed_letters']),
+                'wrong_guesses': set(game['wrong_guesses']),
+                'mistakes': game['mistakes'],
+                'start_time': datetime.datetime.fromisoformat(game['start_time']),
+                'message_id': game['message_id'],
+                'message': None,
+                'edit_task': None
+            }, timeout=game['expires_at'] - now)
+        for channel_id, game in state.get('number_games', {}).items():
+            number_games.start(int(channel_id), {
+                'number': game['number'],
+                'start_time': datetime.datetime.fromisoformat(game['start_time']),
+            }, timeout=game['expires_at'] - now)
+        if age <= VOICE_SNAPSHOT_MAX_AGE:
+            for member_id, joined in state.get('voice_join_times', {}).items():
+                voice_join_times[int(member_id)] = datetime.datetime.fromisoformat(joined)
+        if age <= INVITES_SNAPSHOT_MAX_AGE:
+            for guild_id, invites in state.get('invites', {}).items():
+                invites_cache[int(guild_id)] = invites
+    except (KeyError, ValueError, TypeError) as e:
+        print(f"[SNAPSHOT ERROR] No se pudo restaurar parte del estado: {e}")
+    print(f"♻️ Estado restaurado ({age:.0f}s): {len(word_games)} ahorcados, {len(number_games)} juegos de números, "
+          f"{len(voice_join_times)} sesiones de voz, {len(invites_cache)} servidores con invitaciones.")
+
+# El guardado periódico y el de close() pueden coincidir; ambos escriben el mismo
+# archivo temporal, así que las escrituras van de una en una.
+snapshot_lock = asyncio.Lock()
+
+async def save_runtime_snapshot():
+    try:
+        async with snapshot_lock:
+            # Construir el dict es rápido; la serialización y la escritura van fuera del event loop.
+            await asyncio.to_thread(write_snapshot, build_runtime_snapshot())
+    except Exception as e:
+        print(f"[SNAPSHOT ERROR] Error al guardar el estado: {e}")
+
+async def persist_runtime_state():
+    while not bot.is_closed():
+        await asyncio.sleep(STATE_SNAPSHOT_INTERVAL)
+        await save_runtime_snapshot()
+
 # --- DATOS DEL JUEGO DE AVENTURA ---
 PLANET_NAMES = [
     "Xylar", "Krypton Prime", "Nebulon-9", "Cygnus X-1", "Aethelgard",
@@ -41,23 +218,6 @@ PLANET_NAMES = [
     "Aquila-Rift", "Pegasus-Omega", "Ursa-Minor-Beta", "Hydra-Core", "Volantis",
     "Qo'noS", "Cardassia-Prime", "Vulcan", "Ryloth", "Tatooine-Secundus"
 ]
-LOOT_TABLE = {
-    'Fácil': [
-        {'name': 'Fragmento de Titanio', 'value': 5},
-        {'name': 'Cableado Básico', 'value': 3},
-        {'name': 'Chatarra Espacial', 'value': 1}
-    ],
-    'Intermedio': [
-        {'name': 'Placa de Acero Reforzado', 'value': 15},
-        {'name': 'Cristal de Kyber (Pequeño)', 'value': 20},
-        {'name': 'Procesador de Navegación', 'value': 18}
-    ],
-    'Difícil': [
-        {'name': 'Núcleo de Energía de Singularidad', 'value': 50},
-        {'name': 'Aleación de Neutronio', 'value': 60},
-        {'name': 'Mapa Estelar Antiguo', 'value': 45}
-    ]
-}
 SHOP_ITEMS = {
     'blaster_basico': {'name': 'Bláster Básico MK2', 'price': 50, 'power_increase': 5, 'type': 'ship'},
     'escudo_inicial': {'name': 'Escudo Deflector Básico', 'price': 75, 'power_increase': 8, 'type': 'ship'},
@@ -84,46 +244,6 @@ ASCII_ART = {
     """
 }
 
-# En bot.py, sección 2
-
-UPGRADE_CATALOG = {
-    "ship": {
-        "name": "Nave",
-        "upgrades": [
-            # Nivel 2
-            {
-                "level": 2, "power_increase": 15,
-                "cost_lbucks": 60,
-                "cost_materials": {"Fragmento de Titanio": 5, "Cableado Básico": 3}
-            },
-            # Nivel 3
-            {
-                "level": 3, "power_increase": 25,
-                "cost_lbucks": 140,
-                "cost_materials": {"Placa de Acero Reforzado": 3, "Procesador de Navegación": 1}
-            },
-        ]
-    },
-    "station": {
-        "name": "Estación",
-        "upgrades": [
-            # Nivel 2
-            {
-                "level": 2, "power_increase": 10,
-                "cost_lbucks": 120,
-                "cost_materials": {"Fragmento de Titanio": 3, "Chatarra Espacial": 10}
-            },
-            # Nivel 3
-            {
-                "level": 3, "power_increase": 20,
-                "cost_lbucks": 280,
-                "cost_materials": {"Placa de Acero Reforzado": 5, "Cristal de Kyber (Pequeño)": 1}
-            },
-        ]
-    }
-}
-
-
 # Puedes agregar todas las palabras que quieras a esta lista
 PALABRAS_LOCALES = [
     "computadora", "biblioteca", "desarrollo", "guitarra", "universo",
@@ -190,23 +310,126 @@ def create_hangman_embed(game_state, game_over_status=None):
     embed.add_field(name="Letras Incorrectas", value=wrong_letters, inline=True)
     return embed
 
-async def check_word_game_timeout():
+# --- CLASIFICACIONES EN MEMORIA ---
+LEADERBOARD_RESEED_SECONDS = 3600
+LEADERBOARD_STYLES = {
+    'lbucks': ("¡Los comandantes más ricos de la galaxia!", "LBucks 🪙"),
+    'power_level': ("¡Los comandantes más poderosos de la galaxia!", "de poder 💥"),
+    'invites': ("¡Los que más comandantes han traído al servidor!", "invitaciones 👥"),
+    'missions': ("¡Los comandantes más trabajadores!", "misiones 📋"),
+}
+METRIC_CHOICES = [discord.OptionChoice(name, value) for value, name in METRICS.items()]
+
+leaderboard_seed_locks = {metric: asyncio.Lock() for metric in METRICS}
+
+async def seed_leaderboard(metric):
+    """Carga (o recarga) una clasificación completa desde la base de datos.
+
+    Los cambios que llegan mientras se leen las páginas se reaplican sobre el árbol
+    nuevo, y el árbol se construye en un hilo para no bloquear el event loop.
+    """
+    board = leaderboards[metric]
+    async with leaderboard_seed_locks[metric]:
+        board.begin_reseed()
+        try:
+            values = await adb.get_metric_values(metric)
+            if values is not None:
+                board.install(await asyncio.to_thread(board.build, values))
+        finally:
+            if board.reseeding:
+                board.cancel_reseed()
+    return board.seeded
+
+async def refresh_leaderboards():
+    # Las clasificaciones se mantienen al día con cada cambio; la recarga periódica
+    # solo corrige cambios hechos fuera del bot (p. ej. desde el panel de Supabase).
     while True:
-        await asyncio.sleep(60)
-        to_delete = []
-        now = datetime.datetime.now()
-        for channel_id, game in word_games.items():
-            if now - game['start_time'] > datetime.timedelta(minutes=7):
-                channel = bot.get_channel(channel_id)
-                if channel:
-                    await channel.send(f"¡Se acabó el tiempo para el juego de adivinar palabras! La palabra era '{game['word']}'.")
-                to_delete.append(channel_id)
-        for channel_id in to_delete:
-            if channel_id in word_games:
-                del word_games[channel_id]
+        for metric in METRICS:
+            try:
+                await seed_leaderboard(metric)
+            except DBOverloaded:
+                # Recarga de fondo: si la base de datos va saturada, se intenta en la siguiente vuelta.
+                pass
+        await asyncio.sleep(LEADERBOARD_RESEED_SECONDS)
+
+# --- EDICIONES DEL MENSAJE DEL AHORCADO ---
+# Varias letras que llegan casi a la vez se reflejan en una sola edición con el
+# estado más reciente, para no chocar con el límite de ediciones por canal.
+HANGMAN_EDIT_DEBOUNCE_SECONDS = 1.5
+
+async def get_hangman_message(channel, game):
+    """Devuelve el mensaje del juego, pidiéndolo a la API solo si no lo tenemos guardado."""
+    if game.get('message') is None:
+        game['message'] = await channel.fetch_message(game['message_id'])
+    return game['message']
+
+async def edit_hangman_message(channel, game, embed):
+    try:
+        game_message = await get_hangman_message(channel, game)
+        await game_message.edit(embed=embed)
+    except discord.HTTPException as e:
+        print(f"Error al editar el mensaje del ahorcado: {e}")
+
+async def _flush_hangman_edit(channel, game):
+    await asyncio.sleep(HANGMAN_EDIT_DEBOUNCE_SECONDS)
+    game['edit_task'] = None
+    # Si el juego ya terminó, la edición final se encargó de mostrar el resultado.
+    if word_games.get(channel.id) is game:
+        await edit_hangman_message(channel, game, create_hangman_embed(game))
+
+def schedule_hangman_edit(channel, game):
+    if game.get('edit_task') is None:
+        game['edit_task'] = asyncio.create_task(_flush_hangman_edit(channel, game))
+
+async def finish_hangman_game(channel, game, game_over_status):
+    """Cancela la edición pendiente y muestra el resultado final de inmediato."""
+    pending_edit = game.get('edit_task')
+    if pending_edit is not None:
+        pending_edit.cancel()
+        game['edit_task'] = None
+    await edit_hangman_message(channel, game, create_hangman_embed(game, game_over_status=game_over_status))
 
 # --- 3. VISTAS DE BOTONES (UI) ---
-class DonateModal(discord.ui.Modal):
+DB_OVERLOADED_MESSAGE = "⏳ El bot está muy ocupado en este momento. Inténtalo de nuevo en unos segundos."
+
+async def send_db_overloaded(interaction: discord.Interaction):
+    """Avisa de que la base de datos está saturada, respondiendo o con un followup según toque."""
+    try:
+        if interaction.response.is_done():
+            await interaction.followup.send(DB_OVERLOADED_MESSAGE, ephemeral=True)
+        else:
+            await interaction.response.send_message(DB_OVERLOADED_MESSAGE, ephemeral=True)
+    except discord.HTTPException:
+        pass
+
+class LBucksView(View):
+    """Vista base. on_application_command_error solo cubre los comandos slash: aquí
+    los botones y menús avisan si la base de datos descartó la llamada (DBOverloaded)
+    y, si la vista sigue activa, reactivan sus botones para poder reintentar."""
+
+    async def on_error(self, error: Exception, item, interaction: discord.Interaction):
+        if not isinstance(error, DBOverloaded):
+            await super().on_error(error, item, interaction)
+            return
+        if not self.is_finished() and any(getattr(child, 'disabled', False) for child in self.children):
+            for child in self.children:
+                child.disabled = False
+            try:
+                await interaction.edit_original_response(view=self)
+            except discord.HTTPException:
+                pass
+        await send_db_overloaded(interaction)
+
+class LBucksModal(discord.ui.Modal):
+    """Modal base: avisa si la base de datos descartó la llamada (DBOverloaded)."""
+
+    async def on_error(self, error: Exception, interaction: discord.Interaction):
+        if isinstance(error, DBOverloaded):
+            await send_db_overloaded(interaction)
+        else:
+            await super().on_error(error, interaction)
+
+class DonateModal(LBucksModal):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs, title="Donar LBucks")
         self.amount_input = discord.ui.InputText(
@@ -230,7 +453,7 @@ class DonateModal(discord.ui.Modal):
             amount = int(self.amount_input.value)
             recipient_str = self.recipient_input.value
             if recipient_str.isdigit():
-                recipient = await bot.fetch_user(int(recipient_str))
+                recipient = await user_resolver.fetch(int(recipient_str))
             else:
                 recipient = discord.utils.get(interaction.guild.members,
                                               name=recipient_str)
@@ -247,28 +470,33 @@ class DonateModal(discord.ui.Modal):
                 await interaction.followup.send(
                     "No puedes donarte LBucks a ti mismo.", ephemeral=True)
                 return
-            doner_balance = await asyncio.to_thread(db.get_balance,
-                                                    interaction.user.id)
-            if doner_balance < amount:
+            # Débito y abono van en una sola transacción: o se aplican los dos o ninguno.
+            result = await adb.transfer_lbucks(interaction.user.id, recipient.id, amount)
+            if result is None:
+                await interaction.followup.send(
+                    "Ocurrió un error al procesar tu donación. Intenta de nuevo más tarde.",
+                    ephemeral=True)
+                return
+            if result['status'] == 'insufficient_funds':
                 await interaction.followup.send(
                     "No tienes suficientes LBucks para donar.", ephemeral=True)
                 return
-            await asyncio.to_thread(db.update_lbucks, interaction.user.id,
-                                    -amount)
-            await asyncio.to_thread(db.update_lbucks, recipient.id, amount)
             await interaction.followup.send(
-                f"Has donado **{amount} LBucks** a **{recipient.name}**. ¡Gracias por tu generosidad! 🎉",
+                f"Has donado **{amount} LBucks** a **{recipient.name}**. ¡Gracias por tu generosidad! 🎉\n"
+                f"Tu nuevo saldo es: **{result['from_balance']} LBucks** 🪙",
                 ephemeral=True)
         except ValueError:
             await interaction.followup.send(
                 "La cantidad debe ser un número válido.", ephemeral=True)
+        except DBOverloaded:
+            raise
         except Exception as e:
             print(f"Error en el modal de donación: {e}")
             await interaction.followup.send(
                 "Ocurrió un error al procesar tu donación. Intenta de nuevo más tarde.",
                 ephemeral=True)
 
-class RedeemMenuView(View):
+class RedeemMenuView(LBucksView):
     def __init__(self, items: list, user_balance: int, author_id: int):
         super().__init__(timeout=300)
         self.author_id = author_id
@@ -324,46 +552,67 @@ class RedeemMenuView(View):
         # Obtenemos el ítem seleccionado desde los datos de la interacción.
         item_id = interaction.data['values'][0]
         
-        item_data = await asyncio.to_thread(db.get_item, item_id)
+        # El ítem sale de la tienda en memoria; el stock real se vuelve a comprobar al confirmar.
+        item_data = await adb.get_item(item_id)
         
         if not item_data or item_data.get('stock', 0) <= 0:
             await interaction.followup.send("Lo sentimos, este ítem está agotado o ya no existe.", ephemeral=True)
             return
         
-        user_balance = await asyncio.to_thread(db.get_balance, interaction.user.id)
+        user_balance = await adb.get_balance(interaction.user.id)
         item_price = item_data.get('price', 0)
         if user_balance < item_price:
              await interaction.followup.send("No tienes suficientes LBucks para canjear este ítem.", ephemeral=True)
              return
 
-        view = ConfirmCancelView(user_id=interaction.user.id, item_id=item_id, price=item_price)
-        await interaction.followup.send(
-            f"¿Confirmas el canje de **{item_id.replace('_', ' ').capitalize()}** por **{item_price} LBucks**?",
-            view=view, ephemeral=True
-        )
+        # Apartamos una unidad mientras el usuario decide (se libera al cancelar o al caducar la vista).
+        reservation = redemption_engine.reserve(interaction.user.id, item_id, item_data.get('stock', 0))
+        if reservation is None:
+            await interaction.followup.send("Las últimas unidades de este ítem están reservadas por otros usuarios. Inténtalo en un minuto.", ephemeral=True)
+            return
 
-class ConfirmCancelView(View):
-    def __init__(self, user_id, item_id, price):
+        view = ConfirmCancelView(user_id=interaction.user.id, item_id=item_id, price=item_price, reservation=reservation)
+        await interaction.followup.send(view.prompt(), view=view, ephemeral=True)
+
+class ConfirmCancelView(LBucksView):
+    def __init__(self, user_id, item_id, price, reservation):
         super().__init__(timeout=60)
         self.user_id = user_id
         self.item_id = item_id
         self.price = price
+        self.reservation = reservation
+
+    def prompt(self):
+        return f"¿Confirmas el canje de **{self.item_id.replace('_', ' ').capitalize()}** por **{self.price} LBucks**?"
 
     @discord.ui.button(label="Confirmar Canjeo", style=discord.ButtonStyle.success)
     async def confirm_button(self, button: Button, interaction: discord.Interaction):
-        await interaction.response.defer(ephemeral=True)
-        balance = await asyncio.to_thread(db.get_balance, self.user_id)
-        item_data_dict = await asyncio.to_thread(db.get_item, self.item_id)
-        
-        if not item_data_dict or item_data_dict.get('stock', 0) <= 0:
+        # Desactivamos la vista antes del primer await para que un doble clic no confirme dos veces.
+        self.stop()
+        for item in self.children:
+            item.disabled = True
+        await interaction.response.edit_message(content="Procesando...", view=self)
+        # Cobro, descuento de stock y registro del canjeo en una sola transacción.
+        result = await redemption_engine.confirm(self.reservation, self.user_id, self.item_id)
+
+        if result is None:
+            await interaction.followup.send("Ocurrió un error al procesar tu canjeo. Intenta de nuevo más tarde.")
+            return
+        if result['status'] == 'overloaded':
+            # No se cobró nada y la reserva sigue en pie: ofrecemos de nuevo los botones.
+            retry_view = ConfirmCancelView(self.user_id, self.item_id, self.price, self.reservation)
+            await interaction.edit_original_response(content=retry_view.prompt(), view=retry_view)
+            await send_db_overloaded(interaction)
+            return
+        if result['status'] == 'reservation_expired':
+            await interaction.followup.send("Tu reserva caducó. Vuelve a abrir la tienda para canjear el ítem.")
+            return
+        if result['status'] in ('not_found', 'out_of_stock'):
             await interaction.followup.send("¡Justo se agotó! Alguien más fue más rápido.")
             return
-        if balance < self.price:
+        if result['status'] == 'insufficient_funds':
             await interaction.followup.send("No tienes suficientes LBucks.")
             return
-            
-        await asyncio.to_thread(db.update_lbucks, self.user_id, -self.price)
-        await asyncio.to_thread(db.update_stock, self.item_id, -1)
         
         log_channel = bot.get_channel(REDEMPTION_LOG_CHANNEL_ID)
         if log_channel:
@@ -375,18 +624,23 @@ class ConfirmCancelView(View):
             )
             embed.set_thumbnail(url=interaction.user.display_avatar.url)
             log_message = await log_channel.send(embed=embed, view=AdminActionView())
-            await asyncio.to_thread(db.create_redemption, self.user_id, self.item_id, log_message.id)
+            await adb.set_redemption_message(result['redemption_id'], log_message.id)
             
         await interaction.followup.send("¡Canjeo realizado! Un administrador revisará tu solicitud.")
         await interaction.edit_original_response(content="Procesando...", view=None)
 
     @discord.ui.button(label="Cancelar", style=discord.ButtonStyle.danger)
     async def cancel_button(self, button: Button, interaction: discord.Interaction):
+        self.stop()
+        redemption_engine.release(self.reservation)
         await interaction.response.edit_message(content="Tu canjeo ha sido cancelado.", view=None)
 
+    async def on_timeout(self):
+        redemption_engine.release(self.reservation)
+
 # En bot.py, reemplaza esta clase por completo
 
-class AdminActionView(View):
+class AdminActionView(LBucksView):
     def __init__(self):
         super().__init__(timeout=None)
 
@@ -401,12 +655,12 @@ class AdminActionView(View):
         if not admin_role or admin_role not in interaction.user.roles:
             return await interaction.followup.send("No tienes permiso.",
                                                    ephemeral=True)
-        redemption = await asyncio.to_thread(db.get_redemption_by_message,
+        redemption = await db_executor.run(db.get_redemption_by_message,
                                              interaction.message.id)
         if not redemption or redemption[4] != 'pending':
             return await interaction.edit_original_response(
                 content="Este canjeo ya fue procesado.", view=None, embed=None)
-        await asyncio.to_thread(db.update_redemption_status, redemption[0],
+        await db_executor.run(db.update_redemption_status, redemption[0],
                                 'completed')
         # Añadimos int() por seguridad, ya que los IDs de usuario deben ser enteros
         user = await bot.fetch_user(int(redemption[1]))
@@ -435,29 +689,17 @@ class AdminActionView(View):
         if not admin_role or admin_role not in interaction.user.roles:
             return await interaction.followup.send("No tienes permiso.",
                                                    ephemeral=True)
-        redemption = await asyncio.to_thread(db.get_redemption_by_message,
-                                             interaction.message.id)
-        if not redemption or redemption[4] != 'pending':
+        # Reembolso de LBucks, reposición de stock y cambio de estado en una sola transacción.
+        refund = await adb.refund_redemption(interaction.message.id, 'cancelled_by_admin')
+        if refund is None:
+            return await interaction.followup.send(
+                "Ocurrió un error al cancelar el canjeo. Inténtalo de nuevo.", ephemeral=True)
+        if refund['status'] != 'ok':
             return await interaction.edit_original_response(
                 content="Este canjeo ya fue procesado.", view=None, embed=None)
         
-        # --- INICIO DE LA CORRECCIÓN ---
-        # Ahora 'item' es un diccionario gracias a la nueva función db.get_item()
-        item = await asyncio.to_thread(db.get_item, redemption[2])
-        if item:
-            # ANTES: await asyncio.to_thread(db.update_lbucks, redemption[1], item[1])
-            # AHORA: Leemos el precio usando la clave 'price' del diccionario.
-            # También convertimos el user_id a int() para mayor seguridad.
-            await asyncio.to_thread(db.update_lbucks, int(redemption[1]), item['price'])
-            
-            await asyncio.to_thread(db.update_stock, redemption[2], 1)
-        # --- FIN DE LA CORRECCIÓN ---
-
-        await asyncio.to_thread(db.update_redemption_status, redemption[0],
-                                'cancelled_by_admin')
-        
-        user = await bot.fetch_user(int(redemption[1]))
-        item_name = redemption[2].split('_')[0] + " Robux"
+        user = await bot.fetch_user(int(refund['user_id']))
+        item_name = refund['item_id'].split('_')[0] + " Robux"
         try:
             await user.send(
                 f"❌ Tu canjeo de **{item_name}** fue cancelado. Tus LBucks han sido devueltos."
@@ -472,7 +714,7 @@ class AdminActionView(View):
                                inline=False)
         await interaction.edit_original_response(embed=edited_embed, view=None)
 
-class UpdateBalanceView(View):
+class UpdateBalanceView(LBucksView):
     def __init__(self):
         super().__init__(timeout=None) # <-- Vista Persistente
 
@@ -482,12 +724,12 @@ class UpdateBalanceView(View):
     async def update_balance_button(self, button: Button,
                                     interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True) # <-- Defer para evitar errores
-        balance = await asyncio.to_thread(db.get_balance, interaction.user.id)
+        balance = await db_executor.run(db.get_balance, interaction.user.id)
         await interaction.followup.send(
             f"Tu saldo actualizado es: **{balance} LBucks** 🪙", ephemeral=True)
 
 
-class UpdateMissionsView(View):
+class UpdateMissionsView(LBucksView):
     def __init__(self):
         super().__init__(timeout=None) # <-- Vista Persistente
 
@@ -497,7 +739,7 @@ class UpdateMissionsView(View):
     async def update_missions_button(self, button: Button,
                                      interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
-        missions = await asyncio.to_thread(db.get_daily_missions,
+        missions = await db_executor.run(db.get_daily_missions,
                                            interaction.user.id)
         embed = discord.Embed(
             title="📝 Tus Misiones Diarias",
@@ -515,7 +757,7 @@ class UpdateMissionsView(View):
                     inline=False)
         await interaction.followup.send(embed=embed, view=self, ephemeral=True)
 
-class PlanetSelectionView(discord.ui.View):
+class PlanetSelectionView(LBucksView):
     def __init__(self, planets: list, author_id: int):
         super().__init__(timeout=180)
         self.author_id = author_id
@@ -549,49 +791,39 @@ class PlanetSelectionView(discord.ui.View):
         player_id = interaction.user.id
         planet_id = int(interaction.data['custom_id'].split('_')[1])
         
-        planet = await asyncio.to_thread(db.get_planet_by_id, planet_id)
-        player = await asyncio.to_thread(db.get_player_profile, player_id)
+        # El planeta sale del catálogo en memoria; las dos lecturas van en paralelo.
+        planet, player = await asyncio.gather(adb.get_planet_by_id(planet_id), adb.get_player_profile(player_id))
 
         if not planet or not player:
             await interaction.followup.send("Hubo un error al obtener los datos del combate. Inténtalo de nuevo.", ephemeral=True)
             return
+        if planet['name'] in set(player['conquered_planets'] or []):
+            await interaction.followup.send(f"Ya conquistaste {planet['name']}. Usa `/aventura explorar` para buscar otro objetivo.", ephemeral=True)
+            return
 
-        difficulty_multiplier = {'Fácil': 0.5, 'Intermedio': 1.0, 'Difícil': 1.5}
-        planet_power = random.randint(5, 20) * difficulty_multiplier.get(planet['difficulty'], 1.0)
-        player_power = player['power_level']
-        
-        chance_to_win = min(0.95, 0.5 + ((player_power - planet_power) / (player_power + 1)))
+        combat = resolve_combat(player['power_level'], planet)
 
-        if random.random() < chance_to_win:
+        if combat['won']:
             # --- VICTORIA ---
-            reward = planet['reward_lbucks']
-            loot = random.choice(LOOT_TABLE.get(planet['difficulty'], []))
-            
-            # ▼▼▼ AÑADIDO: Recompensa de poder por ganar ▼▼▼
-            power_reward = 1 # Gana 1 de poder por cada conquista. ¡Puedes cambiar este valor!
-            
-            await asyncio.to_thread(db.update_lbucks, player_id, reward)
-            
-            current_inventory = player['inventory']
-            current_inventory.append(loot)
-            
-            conquered_planets = player['conquered_planets']
-            conquered_planets.append(planet['name'])
-            
-            # Preparamos la actualización para la base de datos
-            updates = {
-                'inventory': current_inventory,
-                'conquered_planets': conquered_planets,
-                'power_level': player['power_level'] + power_reward # <--- AÑADIDO: Sumamos el nuevo poder
-            }
-            await asyncio.to_thread(db.update_player_profile, player_id, updates)
+            reward = combat['reward']
+            loot = combat['loot']
+            power_reward = combat['power_reward']
+
+            # Recompensa, material, planeta y poder en una sola escritura
+            result = await adb.apply_conquest(player_id, planet['name'], loot['name'], reward, power_reward)
+            if result and result['status'] == 'already_conquered':
+                await interaction.followup.send(f"Ya conquistaste {planet['name']}. Usa `/aventura explorar` para buscar otro objetivo.", ephemeral=True)
+                return
+            if not result or result['status'] != 'ok':
+                await interaction.followup.send("Hubo un error al registrar la conquista. Inténtalo de nuevo.", ephemeral=True)
+                return
             
             # Actualizamos el mensaje de victoria para mostrar el nuevo poder
             embed = discord.Embed(title=f"✅ ¡Victoria en {planet['name']}!", color=discord.Color.green())
             embed.description = f"Has conquistado el planeta y tu poder ha aumentado en **+{power_reward}**."
             embed.add_field(name="Recompensa Obtenida", value=f"**{reward}** LBucks 🪙")
             embed.add_field(name="Material Recuperado", value=f"**1x {loot['name']}**")
-            embed.add_field(name="Poder de Combate Actual", value=f"**{player['power_level'] + power_reward}** 💥") # <--- AÑADIDO
+            embed.add_field(name="Poder de Combate Actual", value=f"**{result['power_level']}** 💥")
         
         else:
             # --- DERROTA ---
@@ -603,7 +835,7 @@ class PlanetSelectionView(discord.ui.View):
         
 # En bot.py, sección 3
 
-class UpgradeSelectionView(discord.ui.View):
+class UpgradeSelectionView(LBucksView):
     def __init__(self, author_id: int, player_data: dict):
         super().__init__(timeout=180)
         self.author_id = author_id
@@ -633,19 +865,15 @@ class UpgradeSelectionView(discord.ui.View):
         current_level = self.player_data[f"{upgrade_type}_level"]
         
         # Encontrar la próxima mejora disponible
-        next_upgrade = None
-        for upgrade in UPGRADE_CATALOG[upgrade_type]['upgrades']:
-            if upgrade['level'] == current_level + 1:
-                next_upgrade = upgrade
-                break
+        next_upgrade = get_next_upgrade(upgrade_type, current_level)
         
         if not next_upgrade:
             await interaction.response.send_message(f"¡Tu {UPGRADE_CATALOG[upgrade_type]['name']} ya está al máximo nivel!", ephemeral=True)
             return
 
         # Verificar si el jugador tiene suficientes recursos
-        balance = await asyncio.to_thread(db.get_balance, self.author_id)
-        inventory_summary = await asyncio.to_thread(db.summarize_inventory, self.author_id)
+        balance = await db_executor.run(db.get_balance, self.author_id)
+        inventory_summary = await db_executor.run(db.summarize_inventory, self.author_id)
 
         has_lbucks = balance >= next_upgrade['cost_lbucks']
         
@@ -679,7 +907,7 @@ class UpgradeSelectionView(discord.ui.View):
             await interaction.response.send_message(embed=embed, view=confirm_view, ephemeral=True)
 
 
-class ConfirmUpgradeView(discord.ui.View):
+class ConfirmUpgradeView(LBucksView):
     def __init__(self, author_id: int, upgrade_type: str, upgrade_details: dict):
         super().__init__(timeout=60)
         self.author_id = author_id
@@ -690,31 +918,27 @@ class ConfirmUpgradeView(discord.ui.View):
     async def confirm_button(self, button: Button, interaction: discord.Interaction):
         await interaction.response.defer()
 
-        # Doble verificación de recursos
-        balance = await asyncio.to_thread(db.get_balance, self.author_id)
-        if balance < self.upgrade_details['cost_lbucks']:
-            await interaction.followup.send("¡Error! Parece que ya no tienes suficientes LBucks.", ephemeral=True)
-            return
-        
-        # Pagar LBucks
-        await asyncio.to_thread(db.update_lbucks, self.author_id, -self.upgrade_details['cost_lbucks'])
-        
-        # Pagar materiales
-        await asyncio.to_thread(db.remove_materials_from_inventory, self.author_id, self.upgrade_details['cost_materials'])
-        
-        # Aplicar la mejora
-        player = await asyncio.to_thread(db.get_player_profile, self.author_id)
-        updates = {
-            f"{self.upgrade_type}_level": self.upgrade_details['level'],
-            "power_level": player['power_level'] + self.upgrade_details['power_increase']
+        # Cobro de LBucks y materiales, subida de nivel y de poder: todo o nada
+        result = await adb.purchase_upgrade(self.author_id, self.upgrade_type, self.upgrade_details)
+        errors = {
+            None: "Hubo un error al procesar la mejora. Inténtalo de nuevo.",
+            'not_found': "Aún no has comenzado tu aventura. Usa `/aventura iniciar` para empezar.",
+            'already_upgraded': "Esta mejora ya fue aplicada.",
+            'insufficient_lbucks': "¡Error! Parece que ya no tienes suficientes LBucks.",
+            'insufficient_materials': "¡Error! Parece que ya no tienes los materiales necesarios.",
         }
-        await asyncio.to_thread(db.update_player_profile, self.author_id, updates)
+        status = result['status'] if result else None
+        if status != 'ok':
+            await interaction.followup.send(errors.get(status, errors[None]), ephemeral=True)
+            return
 
         embed = discord.Embed(
             title=f"🎉 ¡Mejora Completada!",
             description=f"Tu **{UPGRADE_CATALOG[self.upgrade_type]['name']}** ha sido mejorada al **Nivel {self.upgrade_details['level']}**.",
             color=discord.Color.green()
         )
+        embed.add_field(name="Poder de Combate Actual", value=f"**{result['power_level']}** 💥")
+        embed.add_field(name="Saldo Restante", value=f"**{result['balance']}** LBucks 🪙")
         await interaction.followup.send(embed=embed, ephemeral=True)
         
         # Desactivar botones
@@ -730,7 +954,16 @@ class ConfirmUpgradeView(discord.ui.View):
         await interaction.response.edit_message(content="Mejora cancelada.", view=self)
 
 # --- 4. EVENTOS Y LISTENERS ---
-invites_cache = {}
+
+async def track_mission(user_id, mission_type, **kwargs):
+    """Registra progreso de misiones. Es trabajo de fondo: si la base de datos está
+    saturada, el evento se descarta (queda contado en lbucks_db_shed_calls_total).
+    Devuelve True si se registró."""
+    try:
+        await adb.update_mission_progress(user_id, mission_type, **kwargs)
+        return True
+    except DBOverloaded:
+        return False
 
 @bot.event
 async def on_ready():
@@ -739,7 +972,7 @@ async def on_ready():
     print("🔄 Comandos slash sincronizados.")
     
     try:
-        await asyncio.to_thread(db.init_db)
+        await db_executor.run(db.init_db, priority=PRIORITY_BACKGROUND)
         print("✔️ Base de datos inicializada.")
     except Exception as e:
         print(f"⚠️ Error al inicializar la base de datos: {e}")
@@ -753,38 +986,67 @@ async def on_ready():
 
     print("⏳ Caché de invitaciones...")
     for guild in bot.guilds:
+        # Los servidores restaurados desde el snapshot no necesitan volver a pedirse.
+        if guild.id in invites_cache:
+            continue
         try:
-            invites_cache[guild.id] = await guild.invites()
+            invites_cache[guild.id] = index_invites(await guild.invites())
         except discord.Forbidden:
             print(f"Error: Permisos faltantes para leer invitaciones en el servidor {guild.name}")
+
+    reconcile_voice_sessions()
     
-    bot.loop.create_task(check_word_game_timeout())
+    if not hasattr(bot, "leaderboards_task"):
+        bot.leaderboards_task = bot.loop.create_task(refresh_leaderboards())
+    if not hasattr(bot, "snapshot_task"):
+        bot.snapshot_task = bot.loop.create_task(persist_runtime_state())
+
+
+def reconcile_voice_sessions():
+    """Ajusta voice_join_times a quien está en voz ahora mismo. Las salidas y entradas
+    ocurridas con el bot desconectado no llegaron como eventos: se descartan las
+    sesiones de quien ya no está y se abren, desde ahora, las de quien entró."""
+    now = datetime.datetime.now()
+    in_voice = {
+        member.id
+        for guild in bot.guilds
+        for channel in guild.voice_channels + guild.stage_channels
+        for member in channel.members
+        if not member.bot
+    }
+    for member_id in list(voice_join_times):
+        if member_id not in in_voice:
+            del voice_join_times[member_id]
+    for member_id in in_voice:
+        voice_join_times.setdefault(member_id, now)
+
 
+async def reward_invite_uses(invite_code, inviter_id, uses):
+    # Cada uso avanza el estado de la invitación (registrada -> recompensada); a partir
+    # de ahí los usos siguientes ya no cambian nada y no hace falta llamar a la base de datos.
+    for _ in range(uses):
+        status = await adb.check_and_update_invite_reward(invite_code, inviter_id)
+        if status != 'registered':
+            break
+
+invite_tracker = InviteTracker(invites_cache, reward_invite_uses)
 
 @bot.event
+@metrics.track_listener("on_member_join")
 async def on_member_join(member):
-    await asyncio.sleep(5)
-    try:
-        new_invites = await member.guild.invites()
-        old_invites = invites_cache.get(member.guild.id, [])
-        used_invite = None
-        for new_invite in new_invites:
-            for old_invite in old_invites:
-                if new_invite.code == old_invite.code and new_invite.uses > old_invite.uses:
-                    used_invite = new_invite
-                    break
-            if used_invite:
-                break
-        if used_invite and used_invite.inviter:
-            inviter = used_invite.inviter
-            await asyncio.to_thread(db.check_and_update_invite_reward, used_invite.code, inviter.id)
-    except Exception as e:
-        print(f"Error en on_member_join: {e}")
-    finally:
-        invites_cache[member.guild.id] = await member.guild.invites()
+    invite_tracker.member_joined(member.guild)
+
+@bot.listen("on_invite_create")
+async def invite_create_tracker(invite):
+    invite_tracker.invite_created(invite)
+
+@bot.listen("on_invite_delete")
+async def invite_delete_tracker(invite):
+    invite_tracker.invite_deleted(invite)
 
 
 @bot.listen("on_raw_reaction_add")
+@metrics.track_listener("on_raw_reaction_add")
 async def mission_reaction_tracker(payload: discord.RawReactionActionEvent):
     """
     Listener que se activa cuando un usuario añade una reacción a un mensaje.
@@ -796,20 +1058,23 @@ async def mission_reaction_tracker(payload: discord.RawReactionActionEvent):
     if not user or user.bot:
         return
 
+    # Si ninguna misión pendiente del usuario cuenta reacciones, no hace falta saber quién escribió el mensaje.
+    if db.can_skip_mission_event(payload.user_id, "reaction_add"):
+        return
+
     try:
-        channel = await bot.fetch_channel(payload.channel_id)
-        message = await channel.fetch_message(payload.message_id)
+        # El autor sale del índice en memoria; solo se pide el mensaje a la API si no lo conocemos.
+        author = await message_authors.get(payload.channel_id, payload.message_id)
+        if author is None:
+            return
+        author_id, author_is_bot = author
 
         # Evitar progreso por reaccionar a mensajes de bots o a los propios
-        if message.author.bot or message.author.id == user.id:
+        if author_is_bot or author_id == user.id:
             return
             
-        await asyncio.to_thread(
-            db.update_mission_progress,
-            payload.user_id,
-            "reaction_add"
-        )
-        print(f"Misión de reacción registrada para {user.name}.")
+        if await track_mission(payload.user_id, "reaction_add"):
+            print(f"Misión de reacción registrada para {user.name}.")
 
     except (discord.NotFound, discord.Forbidden):
         pass # El mensaje o canal fue borrado o no hay permisos
@@ -826,23 +1091,36 @@ async def on_application_command_completion(ctx: discord.ApplicationContext):
         return
     
     # Enviamos el nombre específico del comando a la base de datos
-    await asyncio.to_thread(
-        db.update_mission_progress, 
-        ctx.author.id, 
-        "slash_command_use", 
+    if await track_mission(
+        ctx.author.id,
+        "slash_command_use",
         command_name=ctx.command.name
-    )
-    print(f"Misión de comando slash '{ctx.command.name}' registrada para {ctx.author.name}.")
+    ):
+        print(f"Misión de comando slash '{ctx.command.name}' registrada para {ctx.author.name}.")
+
+@bot.event
+async def on_application_command_error(ctx: discord.ApplicationContext, error: discord.DiscordException):
+    metrics.COMMAND_ERRORS.inc(command=ctx.command.qualified_name if ctx.command else "desconocido")
+    # Si la cola de la base de datos está llena, respondemos de inmediato en vez de
+    # dejar que la interacción caduque esperando.
+    if isinstance(getattr(error, 'original', error), DBOverloaded):
+        await send_db_overloaded(ctx.interaction)
+        return
+    print(f"Ignorando excepción en el comando {ctx.command}:", file=sys.stderr)
+    traceback.print_exception(type(error), error, error.__traceback__, file=sys.stderr)
 
 # ... (Aquí continúan los demás listeners que ya tienes, como on_message y on_voice_state_update)
 
 
 @bot.listen("on_message")
+@metrics.track_listener("on_message")
 async def on_message_handler(message):
+    message_authors.record(message)
     if message.author.bot:
         return
 
-    await asyncio.to_thread(db.update_mission_progress, message.author.id, "message_count")
+    # El progreso de mensajes se acumula en memoria y se escribe en lotes.
+    adb.message_progress.add(message.author.id)
 
     channel_id = message.channel.id
     if channel_id in word_games:
@@ -854,43 +1132,43 @@ async def on_message_handler(message):
         except discord.Forbidden:
             pass
 
+        # Mientras borrábamos el mensaje, otra letra pudo haber terminado el juego.
+        if word_games.get(channel_id) is not game:
+            return
+
         if not (len(guess) == 1 and guess.isalpha()):
             return
 
         if guess in game['guessed_letters'] or guess in game['wrong_guesses']:
             return
 
-        game_message = await message.channel.fetch_message(game['message_id'])
-
         if guess in game['word']:
             game['guessed_letters'].add(guess)
             word_complete = all(letter in game['guessed_letters'] for letter in game['word'])
             
             if word_complete:
+                # Quitamos el juego antes de cualquier await para que nadie más pueda ganarlo.
+                del word_games[channel_id]
                 reward = 12 # <-- RECOMPENSA ACTUALIZADA
-                await asyncio.to_thread(db.update_lbucks, message.author.id, reward)
-                win_embed = create_hangman_embed(game, game_over_status="win")
-                await game_message.edit(embed=win_embed)
+                await finish_hangman_game(message.channel, game, "win")
+                await adb.update_lbucks(message.author.id, reward)
                 await message.channel.send(f"¡{message.author.mention} ha adivinado la palabra y gana **{reward} LBucks**!")
-                del word_games[channel_id]
             else:
-                update_embed = create_hangman_embed(game)
-                await game_message.edit(embed=update_embed)
+                schedule_hangman_edit(message.channel, game)
         else:
             game['wrong_guesses'].add(guess)
             game['mistakes'] += 1
             
             if game['mistakes'] >= len(HANGMAN_PICS) - 1:
-                loss_embed = create_hangman_embed(game, game_over_status="loss")
-                await game_message.edit(embed=loss_embed)
                 del word_games[channel_id]
+                await finish_hangman_game(message.channel, game, "loss")
             else:
-                update_embed = create_hangman_embed(game)
-                await game_message.edit(embed=update_embed)
+                schedule_hangman_edit(message.channel, game)
 
 
 # Reemplaza tu listener de voz actual con este en bot.py
 @bot.listen("on_voice_state_update")
+@metrics.track_listener("on_voice_state_update")
 async def mission_voice_tracker(member, before, after):
     if member.bot:
         return
@@ -914,8 +1192,7 @@ async def mission_voice_tracker(member, before, after):
             # Solo actualizamos la misión si estuvo al menos 1 minuto para no contar entradas y salidas rápidas
             if duration_minutes > 0:
                 print(f"{member.name} salió. Duración: {duration_minutes} minuto(s). Actualizando misión.")
-                await asyncio.to_thread(
-                    db.update_mission_progress,
+                await track_mission(
                     member.id,
                     "voice_minutes",  # Asegúrate que este 'mission_type' coincida con tu DB
                     progress_increase=duration_minutes
@@ -933,7 +1210,7 @@ async def ayuda(ctx: discord.ApplicationContext):
         description="Aquí tienes todos los comandos disponibles.",
         color=discord.Color.blue())
     
-    embed.add_field(name="💰 Economía", value="`/saldo`, `/donar`, `/canjear`, `/login_diario`, `/leaderboard`", inline=False)
+    embed.add_field(name="💰 Economía", value="`/saldo`, `/donar`, `/canjear`, `/login_diario`, `/leaderboard`, `/rank`", inline=False)
     embed.add_field(name="🚀 Aventura Espacial", value="`/aventura iniciar`, `/aventura perfil`, `/aventura explorar`, `/aventura mejorar`", inline=False)
     embed.add_field(name="🕹️ Juegos", value="`/juego palabra` (Ahorcado)\n`/juego numero` (Adivinar Número)\n`/adivinar` (Para el juego de número)", inline=False)
     embed.add_field(name="👥 Social", value="`/invitaciones`", inline=False)
@@ -953,7 +1230,7 @@ async def daily_command(ctx: discord.ApplicationContext):
     try:
         user_id = ctx.user.id
         # Tu función get_user ya devuelve un objeto datetime o None en la tercera posición.
-        user_data = await asyncio.to_thread(db.get_user, user_id)
+        user_data = await db_executor.run(db.get_user, user_id)
         
         # Obtenemos directamente el objeto datetime. No hay que convertir nada.
         last_claim_time = user_data[2]
@@ -971,8 +1248,8 @@ async def daily_command(ctx: discord.ApplicationContext):
                 return
 
         # Si 'last_claim_time' es None o si ya pasaron las 15 horas, se entrega la recompensa.
-        await asyncio.to_thread(db.update_lbucks, user_id, 5)
-        await asyncio.to_thread(db.update_daily_claim, user_id)
+        await db_executor.run(db.update_lbucks, user_id, 5)
+        await db_executor.run(db.update_daily_claim, user_id)
         
         await ctx.followup.send("¡Has reclamado tu recompensa de 5 LBucks! Vuelve en 15 horas. 🪙", ephemeral=True)
 
@@ -989,9 +1266,9 @@ async def canjear(ctx: discord.ApplicationContext):
     await ctx.defer(ephemeral=True)
     
     try:
-        # --- El código de la lógica principal no cambia ---
-        items = await asyncio.to_thread(db.get_shop_items)
-        balance = await asyncio.to_thread(db.get_balance, ctx.author.id)
+        # La tienda se sirve desde memoria: la única consulta es la del saldo.
+        items = await adb.get_shop_items()
+        balance = await adb.get_balance(ctx.author.id)
         
         if items is None:
              await ctx.followup.send("Error al comunicarse con la base de datos de la tienda.", ephemeral=True)
@@ -1053,7 +1330,7 @@ async def canjear(ctx: discord.ApplicationContext):
 )
 async def saldo(ctx: discord.ApplicationContext):
     await ctx.defer(ephemeral=True)
-    balance = await asyncio.to_thread(db.get_balance, ctx.user.id)
+    balance = await db_executor.run(db.get_balance, ctx.user.id)
     await ctx.followup.send(f"Tu saldo actual es: **{balance} LBucks** 🪙",
                             view=UpdateBalanceView(),
                             ephemeral=True)
@@ -1071,7 +1348,7 @@ async def donar(ctx: discord.ApplicationContext):
 )
 async def misiones(ctx: discord.ApplicationContext):
     await ctx.defer(ephemeral=True)
-    missions = await asyncio.to_thread(db.get_daily_missions, ctx.user.id)
+    missions = await db_executor.run(db.get_daily_missions, ctx.user.id)
     embed = discord.Embed(
         title="📝 Tus Misiones Diarias",
         description="Completa estas misiones para ganar LBucks.",
@@ -1083,29 +1360,37 @@ async def misiones(ctx: discord.ApplicationContext):
 
 
 @bot.slash_command(
-    guild_ids=[GUILD_ID], name="leaderboard", description="Muestra la clasificación de LBucks del servidor."
+    guild_ids=[GUILD_ID], name="leaderboard", description="Muestra la clasificación del servidor."
 )
-async def leaderboard(ctx: discord.ApplicationContext):
+async def leaderboard(
+    ctx: discord.ApplicationContext,
+    metrica: discord.Option(str, "Qué clasificación mostrar", choices=METRIC_CHOICES, default="lbucks")
+):
     await ctx.defer()
     
-    top_users = await asyncio.to_thread(db.get_lbucks_leaderboard, 10)
+    board = leaderboards[metrica]
+    if not board.seeded and not await seed_leaderboard(metrica):
+        await ctx.followup.send("No se pudo cargar la clasificación. Inténtalo de nuevo más tarde.", ephemeral=True)
+        return
+    top_users = board.top(10)
+    tagline, unit = LEADERBOARD_STYLES[metrica]
     
     embed = discord.Embed(
-        title="🏆 Clasificación de LBucks",
-        description="¡Los comandantes más ricos de la galaxia!",
+        title=f"🏆 Clasificación de {METRICS[metrica]}",
+        description=tagline,
         color=discord.Color.gold()
     )
     
+    # Resolvemos a todos los usuarios a la vez: primero desde caché y, los que falten, en paralelo.
+    users = await user_resolver.resolve_many([int(user_id) for user_id, _ in top_users if str(user_id).isdigit()])
+    
     leaderboard_text = ""
-    for i, (user_id, lbucks) in enumerate(top_users):
-        try:
-            user = await bot.fetch_user(int(user_id))
-            user_mention = user.mention
-        except (discord.NotFound, ValueError):
-            user_mention = f"Usuario Desconocido ({user_id})"
+    for i, (user_id, value) in enumerate(top_users):
+        user = users.get(int(user_id)) if str(user_id).isdigit() else None
+        user_mention = user.mention if user else f"Usuario Desconocido ({user_id})"
         
         emoji = ["🥇", "🥈", "🥉"][i] if i < 3 else "🔹"
-        leaderboard_text += f"{emoji} **{i+1}.** {user_mention} - **{lbucks}** LBucks 🪙\n"
+        leaderboard_text += f"{emoji} **{i+1}.** {user_mention} - **{value}** {unit}\n"
         
     if not leaderboard_text:
         leaderboard_text = "Todavía no hay nadie en la clasificación. ¡Sé el primero!"
@@ -1114,6 +1399,34 @@ async def leaderboard(ctx: discord.ApplicationContext):
     await ctx.followup.send(embed=embed)
 
 
+@bot.slash_command(
+    guild_ids=[GUILD_ID], name="rank", description="Muestra tu puesto (o el de otro usuario) en una clasificación."
+)
+async def rank(
+    ctx: discord.ApplicationContext,
+    metrica: discord.Option(str, "Qué clasificación consultar", choices=METRIC_CHOICES, default="lbucks"),
+    usuario: discord.Option(discord.Member, "Usuario a consultar", required=False, default=None)
+):
+    await ctx.defer(ephemeral=True)
+    target = usuario or ctx.author
+    
+    board = leaderboards[metrica]
+    if not board.seeded and not await seed_leaderboard(metrica):
+        await ctx.followup.send("No se pudo cargar la clasificación. Inténtalo de nuevo más tarde.", ephemeral=True)
+        return
+    
+    position = board.rank(target.id)
+    if position is None:
+        await ctx.followup.send(f"{target.mention} todavía no aparece en la clasificación de **{METRICS[metrica]}**.", ephemeral=True)
+        return
+    
+    _, unit = LEADERBOARD_STYLES[metrica]
+    await ctx.followup.send(
+        f"🏅 {target.mention} está en el puesto **#{position}** de {len(board)} en **{METRICS[metrica]}** "
+        f"con **{board.get(target.id)}** {unit}.",
+        ephemeral=True)
+
+
 juegos_group = bot.create_group("juego", "Comandos para iniciar minijuegos", guild_ids=[GUILD_ID])
 
 @juegos_group.command(name="palabra", description="Inicia un juego del ahorcado.")
@@ -1132,12 +1445,15 @@ async def iniciar_juego_palabra(ctx: discord.ApplicationContext):
         'wrong_guesses': set(),
         'mistakes': 0,
         'start_time': datetime.datetime.now(),
-        'message_id': None
+        'message_id': None,
+        'message': None,
+        'edit_task': None
     }
     
     initial_embed = create_hangman_embed(word_games[channel_id])
     game_message = await ctx.followup.send(embed=initial_embed)
     word_games[channel_id]['message_id'] = game_message.id
+    word_games[channel_id]['message'] = game_message
 
 @juegos_group.command(name="numero", description="Inicia un juego de adivinar el número.")
 async def iniciar_juego_numero(ctx: discord.ApplicationContext):
@@ -1167,17 +1483,14 @@ async def adivinar_numero(ctx: discord.ApplicationContext, numero: int):
         return
 
     game = number_games[channel_id]
-    
-    if datetime.datetime.now() - game['start_time'] > datetime.timedelta(minutes=2):
-        await ctx.followup.send(f"¡Se acabó el tiempo! El número era **{game['number']}**. Inicia un nuevo juego.")
-        del number_games[channel_id]
-        return
 
     if numero == game['number']:
+        # Terminamos la partida antes de cualquier await: así ni otro acierto ni el
+        # temporizador de la sesión pueden actuar sobre ella mientras pagamos.
+        number_games.end(channel_id)
         reward = 8
-        await asyncio.to_thread(db.update_lbucks, ctx.author.id, reward)
+        await db_executor.run(db.update_lbucks, ctx.author.id, reward)
         await ctx.followup.send(f"¡Felicidades, {ctx.author.mention}! Adivinaste el número **{game['number']}** y ganaste **{reward} LBucks**. 🥳")
-        del number_games[channel_id]
     elif numero < game['number']:
         await ctx.followup.send(f"`{numero}` es muy bajo. El número es **mayor**.")
     else:
@@ -1189,12 +1502,12 @@ adventure_group = bot.create_group("aventura", "Comandos para la aventura espaci
 async def aventura_iniciar(ctx: discord.ApplicationContext):
     await ctx.defer(ephemeral=True)
     
-    player = await asyncio.to_thread(db.get_player_profile, ctx.author.id)
+    player = await db_executor.run(db.get_player_profile, ctx.author.id)
     if player:
         await ctx.followup.send("Comandante, ya has iniciado tu aventura. Usa `/aventura perfil` para ver tu estado.", ephemeral=True)
         return
         
-    await asyncio.to_thread(db.create_player_profile, ctx.author.id)
+    await db_executor.run(db.create_player_profile, ctx.author.id)
     
     intros = [
         "Tras escapar del colapso de la Supernova Kepler, tu cápsula de escape aterriza en un sector desconocido. Con los restos de tu nave, estableces una base precaria. El universo te espera.",
@@ -1216,14 +1529,14 @@ async def aventura_iniciar(ctx: discord.ApplicationContext):
 @adventure_group.command(name="perfil", description="Muestra el estado de tu nave, estación e inventario.")
 async def aventura_perfil(ctx: discord.ApplicationContext):
     await ctx.defer(ephemeral=True)
-    player = await asyncio.to_thread(db.get_player_profile, ctx.author.id)
+    player = await db_executor.run(db.get_player_profile, ctx.author.id)
 
     if not player:
         await ctx.followup.send("Aún no has comenzado tu aventura. Usa `/aventura iniciar` para empezar.", ephemeral=True)
         return
 
     inventory = player['inventory']
-    inventory_text = "\n".join([f"- {item['name']}" for item in inventory]) if inventory else "Vacío"
+    inventory_text = "\n".join(f"{count}x {name}" for name, count in sorted(inventory.items())) if inventory else "Vacío"
 
     embed = discord.Embed(title=f"Perfil del Comandante {ctx.author.name}", color=discord.Color.blue())
     embed.set_thumbnail(url=ctx.author.display_avatar.url)
@@ -1237,14 +1550,14 @@ async def aventura_perfil(ctx: discord.ApplicationContext):
 @adventure_group.command(name="explorar", description="Busca nuevos planetas para conquistar.")
 async def aventura_explorar(ctx: discord.ApplicationContext):
     await ctx.defer(ephemeral=True)
-    player = await asyncio.to_thread(db.get_player_profile, ctx.author.id)
+    player = await db_executor.run(db.get_player_profile, ctx.author.id)
 
     if not player:
         await ctx.followup.send("Debes iniciar tu aventura primero con `/aventura iniciar`.", ephemeral=True)
         return
 
-    conquered_list = player['conquered_planets']
-    planets = await asyncio.to_thread(db.get_explorable_planets, conquered_list)
+    conquered = set(player['conquered_planets'] or [])
+    planets = await adb.get_explorable_planets(conquered)
     
     if not planets:
         await ctx.followup.send("¡Felicidades, Comandante! Parece que has conquistado toda la galaxia conocida.", ephemeral=True)
@@ -1262,7 +1575,7 @@ async def aventura_explorar(ctx: discord.ApplicationContext):
 @adventure_group.command(name="mejorar", description="Mejora tu nave o estación usando LBucks y materiales.")
 async def aventura_mejorar(ctx: discord.ApplicationContext):
     await ctx.defer(ephemeral=True)
-    player = await asyncio.to_thread(db.get_player_profile, ctx.author.id)
+    player = await db_executor.run(db.get_player_profile, ctx.author.id)
 
     if not player:
         await ctx.followup.send("Debes iniciar tu aventura primero con `/aventura iniciar`.", ephemeral=True)
@@ -1287,12 +1600,86 @@ async def add_lbucks(ctx: discord.ApplicationContext, usuario: discord.Member, c
         return
         
     await ctx.defer(ephemeral=True)
-    await asyncio.to_thread(db.update_lbucks, usuario.id, cantidad)
+    await db_executor.run(db.update_lbucks, usuario.id, cantidad)
     action = "añadido" if cantidad >= 0 else "quitado"
     await ctx.followup.send(
         f"Se han **{action} {abs(cantidad)} LBucks** a {usuario.mention}.",
         ephemeral=True)
 
+@admin_commands.command(name="recargar_misiones", description="Recarga el catálogo de misiones desde la base de datos.")
+async def recargar_misiones(ctx: discord.ApplicationContext):
+    admin_role = discord.utils.get(ctx.guild.roles, name=ADMIN_ROLE_NAME)
+    if admin_role is None or admin_role not in ctx.author.roles:
+        await ctx.respond("Este comando es solo para usuarios con el rol de administrador del bot.", ephemeral=True)
+        return
+
+    await ctx.defer(ephemeral=True)
+    db.invalidate_mission_catalog()
+    catalog = await adb.get_mission_catalog()
+    await ctx.followup.send(f"Catálogo de misiones recargado: **{len(catalog)}** misiones.", ephemeral=True)
+
+@admin_commands.command(name="estadisticas_cache", description="[Diagnóstico] Muestra los aciertos y fallos de la caché de misiones.")
+async def estadisticas_cache(ctx: discord.ApplicationContext):
+    admin_role = discord.utils.get(ctx.guild.roles, name=ADMIN_ROLE_NAME)
+    if admin_role is None or admin_role not in ctx.author.roles:
+        await ctx.respond("Este comando es solo para usuarios con el rol de administrador del bot.", ephemeral=True)
+        return
+
+    stats = db.daily_missions.stats()
+    total = stats['hits'] + stats['misses']
+    hit_rate = (stats['hits'] / total * 100) if total else 0
+    await ctx.respond(
+        f"📊 **Caché de misiones diarias**\n"
+        f"Usuarios en caché: **{stats['users']}**\n"
+        f"Aciertos: **{stats['hits']}** | Fallos: **{stats['misses']}** ({hit_rate:.1f}% de aciertos)",
+        ephemeral=True)
+
+@admin_commands.command(name="estadisticas_db", description="[Diagnóstico] Muestra las colas y los tiempos de espera de la base de datos (sync y async).")
+async def estadisticas_db(ctx: discord.ApplicationContext):
+    admin_role = discord.utils.get(ctx.guild.roles, name=ADMIN_ROLE_NAME)
+    if admin_role is None or admin_role not in ctx.author.roles:
+        await ctx.respond("Este comando es solo para usuarios con el rol de administrador del bot.", ephemeral=True)
+        return
+
+    lines = []
+    for title, busy_label, stats in (("Pool de hilos (sync)", "Hilos ocupados", db_executor.stats()),
+                                     ("Cliente async", "Llamadas en vuelo", async_db_gate.stats())):
+        lines.append(f"🗄️ **{title}**")
+        lines.append(f"{busy_label}: **{stats['busy']}/{stats['workers']}** | En cola: **{stats['depth']}**")
+        for name, values in stats['priorities'].items():
+            started = values['completed'] + values['failed'] + values['cancelled']
+            avg_wait_ms = values['wait_seconds'] / started * 1000 if started else 0
+            lines.append(
+                f"**{name}**: en cola {stats['depth_by_priority'][name]}, completadas {values['completed']}, "
+                f"fallidas {values['failed']}, descartadas {values['shed']} | "
+                f"espera media {avg_wait_ms:.1f} ms, máxima {values['max_wait_seconds'] * 1000:.0f} ms"
+            )
+    await ctx.respond("\n".join(lines), ephemeral=True)
+
+@admin_commands.command(name="estado_bucle", description="[Diagnóstico] Muestra el retraso del event loop y los últimos bloqueos detectados.")
+async def estado_bucle(ctx: discord.ApplicationContext):
+    admin_role = discord.utils.get(ctx.guild.roles, name=ADMIN_ROLE_NAME)
+    if admin_role is None or admin_role not in ctx.author.roles:
+        await ctx.respond("Este comando es solo para usuarios con el rol de administrador del bot.", ephemeral=True)
+        return
+
+    stalls = loop_monitor.recent_stalls(limit=5)
+    lines = [
+        f"⏱️ **Event loop**",
+        f"Retraso actual: **{loop_monitor.last_lag * 1000:.1f} ms** | Máximo: **{loop_monitor.max_lag * 1000:.0f} ms** | "
+        f"Umbral: {loop_monitor.threshold * 1000:.0f} ms",
+    ]
+    if not stalls:
+        lines.append("No se han detectado bloqueos.")
+    for stall in reversed(stalls):
+        duration = f"{stall['duration'] * 1000:.0f} ms" if stall['duration'] is not None else "en curso"
+        # Los últimos frames son los que estaban bloqueando el loop.
+        frames = stall['stack'].strip().splitlines()[-4:]
+        lines.append(f"**{stall['at'].strftime('%H:%M:%S')}** · `{stall['activity']}` · {duration}")
+        if frames:
+            lines.append("```\n" + "\n".join(frames)[-400:] + "\n```")
+    await ctx.respond("\n".join(lines)[:2000], ephemeral=True)
+
 @admin_commands.command(name="test_tabla_shop", description="[Diagnóstico] Realiza la prueba más simple posible en la tabla 'shop'.")
 async def test_shop_table(ctx: discord.ApplicationContext):
     await ctx.defer(ephemeral=True)
@@ -1318,16 +1705,45 @@ async def test_shop_table(ctx: discord.ApplicationContext):
         await ctx.followup.send(f"❌ **El comando falló con una excepción de Python:**\n```\n{type(e).__name__}: {e}\n```")
       
 # --- 7. SERVIDOR WEB Y EJECUCIÓN ---
-app = Flask('')
-@app.route('/')
-def home():
-    return "El bot está vivo."
-
-def run_web_server():
-    port = int(os.environ.get('PORT', 8080))
-    serve(app, host="0.0.0.0", port=port)
+# El servidor HTTP corre en el mismo event loop que el bot, así que los handlers leen
+# el estado del bot y de las cachés directamente, sin hilos ni servidor aparte.
+WEB_PORT = int(os.environ.get('PORT', 8080))
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+async def home(request):
+    return web.Response(text="El bot está vivo.")
+
+async def health(request):
+    # Si el loop atiende esta petición, el proceso está vivo; el retraso ayuda a ver si va justo.
+    return web.json_response({'status': 'ok', 'loop_lag_seconds': loop_monitor.last_lag})
+
+async def ready(request):
+    is_ready = bot.is_ready() and not bot.is_closed()
+    latency = bot.latency
+    body = {
+        'ready': is_ready,
+        'guilds': len(bot.guilds),
+        'latency_seconds': latency if is_ready and latency == latency else None,  # NaN antes del primer heartbeat
+        'db_queue_depth': db_executor.stats()['depth'] + async_db_gate.stats()['depth'],
+    }
+    return web.json_response(body, status=200 if is_ready else 503)
+
+async def metrics_endpoint(request):
+    return web.Response(body=metrics.registry.render().encode('utf-8'), headers={'Content-Type': METRICS_CONTENT_TYPE})
+
+async def start_web_server():
+    app = web.Application()
+    app.add_routes([
+        web.get('/', home),
+        web.get('/health', health),
+        web.get('/ready', ready),
+        web.get('/metrics', metrics_endpoint),
+    ])
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '0.0.0.0', WEB_PORT).start()
+    print(f"🌐 Servidor web escuchando en el puerto {WEB_PORT}.")
+    return runner
 
 if __name__ == "__main__":
-    web_server_thread = Thread(target=run_web_server)
-    web_server_thread.start()
     bot.run(TOKEN)
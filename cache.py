@@ -0,0 +1,176 @@
+# cache.py
+# Cachés en memoria compartidas por database.py, database_async.py y bot.py.
+import datetime
+import random
+import threading
+import time
+from collections import OrderedDict
+
+
+class CatalogCache:
+    """Una tabla pequeña y de pocos cambios cargada completa en memoria.
+
+    Las filas se indexan por `key` y caducan pasados `ttl` segundos; `invalidate()`
+    fuerza la recarga en la siguiente consulta.
+    """
+
+    def __init__(self, key: str, ttl: float):
+        self.key = key
+        self.ttl = ttl
+        self._rows = None
+        self._loaded_at = 0.0
+
+    def get(self):
+        """Devuelve {clave: fila}, o None si el catálogo no está cargado o ha caducado."""
+        if self._rows is None or time.monotonic() - self._loaded_at > self.ttl:
+            return None
+        return self._rows
+
+    def load(self, rows: list) -> dict:
+        self._rows = {row[self.key]: row for row in rows}
+        self._loaded_at = time.monotonic()
+        return self._rows
+
+    def update(self, key, **fields):
+        """Actualiza campos de una fila ya cargada (write-through); no hace nada si no está."""
+        if self._rows is not None and key in self._rows:
+            self._rows[key] = {**self._rows[key], **fields}
+
+    def loaded_within(self, seconds: float) -> bool:
+        """True si el catálogo se cargó hace menos de `seconds` segundos."""
+        return self._rows is not None and time.monotonic() - self._loaded_at < seconds
+
+    def invalidate(self):
+        self._rows = None
+
+    def __len__(self):
+        return len(self._rows) if self._rows is not None else 0
+
+
+class PlanetCatalog(CatalogCache):
+    """Catálogo de planetas indexado por planet_id y por nombre.
+
+    Los planetas disponibles para un jugador se calculan en memoria como la
+    diferencia entre todos los nombres y el conjunto de planetas conquistados.
+    """
+
+    def __init__(self, ttl: float):
+        super().__init__(key='planet_id', ttl=ttl)
+        self.by_name = {}
+
+    def load(self, rows: list) -> dict:
+        catalog = super().load(rows)
+        self.by_name = {row['name']: row for row in rows}
+        return catalog
+
+    def explorable(self, conquered, k: int):
+        """Hasta `k` planetas al azar cuyo nombre no está en `conquered`."""
+        available = sorted(self.by_name.keys() - set(conquered or ()))
+        if len(available) > k:
+            available = random.sample(available, k=k)
+        return [self.by_name[name] for name in available]
+
+
+class LRUCache:
+    """Caché LRU de tamaño fijo; si se indica `ttl`, cada entrada caduca a los `ttl` segundos."""
+
+    def __init__(self, maxsize: int, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # {clave: (valor, guardado_en)}
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        value, stored_at = entry
+        if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (value, time.monotonic())
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return entry[0] if entry is not None else default
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+
+_MISSING = object()
+
+
+class DailyMissionCache:
+    """Estado de las misiones diarias de cada usuario, válido solo para el día en curso.
+
+    Guarda por usuario las filas de 'user_missions' asignadas hoy (id, mission_id,
+    progress, is_completed). Al cambiar de día se vacía entera, igual que las
+    misiones se reasignan cada día. Las escrituras pasan primero por la base de
+    datos y después se reflejan aquí (write-through).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._day = None
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _rollover(self):
+        today = datetime.date.today()
+        if self._day != today:
+            self._entries.clear()
+            self._day = today
+
+    def get(self, user_id):
+        """Devuelve {id_fila: misión} del usuario para hoy, o None si no está en caché."""
+        with self._lock:
+            self._rollover()
+            missions = self._entries.get(str(user_id))
+            if missions is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return missions
+
+    def put(self, user_id, rows: list, day: datetime.date = None):
+        """Guarda las misiones de hoy del usuario y devuelve el diccionario almacenado."""
+        missions = {
+            row['id']: {k: row[k] for k in ('id', 'mission_id', 'progress', 'is_completed')}
+            for row in rows
+        }
+        with self._lock:
+            self._rollover()
+            # Una lectura que empezó antes de medianoche no debe llenar la caché del día nuevo.
+            if day is None or day == self._day:
+                self._entries[str(user_id)] = missions
+        return missions
+
+    def update(self, user_id, row_id, progress, is_completed):
+        with self._lock:
+            self._rollover()
+            mission = self._entries.get(str(user_id), {}).get(row_id)
+            if mission is not None:
+                mission['progress'] = progress
+                mission['is_completed'] = is_completed
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'users': len(self._entries)}
+
+    def __len__(self):
+        return len(self._entries)
@@ -4,11 +4,27 @@ import os
 import datetime
 import random
 import json
+from cache import CatalogCache, DailyMissionCache, LRUCache, PlanetCatalog
+from ranking import leaderboards
 
 # --- CONFIGURACIÓN E INICIALIZACIÓN ---
 url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
 supabase: Client = create_client(url, key)
+MISSION_CATALOG_TTL = float(os.environ.get("MISSION_CATALOG_TTL", 600))
+# Una misión que no está en un catálogo recién cargado se da por inexistente (p. ej.
+# se borró y user_missions todavía la apunta): no se recarga más de una vez por intervalo.
+MISSION_MISS_RELOAD_SECONDS = float(os.environ.get("MISSION_MISS_RELOAD_SECONDS", 60))
+SHOP_CATALOG_TTL = float(os.environ.get("SHOP_CATALOG_TTL", 300))
+INVITE_COUNT_TTL = float(os.environ.get("INVITE_COUNT_TTL", 600))
+PLANET_CATALOG_TTL = float(os.environ.get("PLANET_CATALOG_TTL", 3600))
+
+# --- CACHÉS COMPARTIDAS (también las usa database_async.py) ---
+mission_catalog = CatalogCache(key='mission_id', ttl=MISSION_CATALOG_TTL)
+daily_missions = DailyMissionCache()
+shop_catalog = CatalogCache(key='item_id', ttl=SHOP_CATALOG_TTL)
+invite_counts = LRUCache(maxsize=5000, ttl=INVITE_COUNT_TTL)  # {user_id: invitaciones}
+planet_catalog = PlanetCatalog(ttl=PLANET_CATALOG_TTL)
 
 # --- CONEXIÓN A LA BASE DE DATOS ---
 def init_db():
@@ -30,13 +46,45 @@ def get_user(user_id):
         return (str(user_id), 0, None)
 
 def update_lbucks(user_id, amount):
+    """Suma `amount` LBucks (negativo para restar) de forma atómica y devuelve el nuevo saldo."""
     try:
-        response = supabase.from_('users').select('lbucks').eq('user_id', str(user_id)).execute()
-        current_lbucks = response.data[0]['lbucks'] if response.data else 0
-        new_lbucks = current_lbucks + amount
-        supabase.from_('users').upsert({'user_id': str(user_id), 'lbucks': new_lbucks}).execute()
+        response = supabase.rpc('increment_lbucks', {'p_user_id': str(user_id), 'p_amount': amount}).execute()
+        leaderboards.update('lbucks', user_id, response.data)
+        return response.data
     except Exception as e:
         print(f"[DB ERROR] Error en update_lbucks: {e}")
+        return None
+
+def transfer_lbucks(from_user_id, to_user_id, amount):
+    """Transfiere LBucks de un usuario a otro en una sola transacción.
+    Devuelve {'status': 'ok', 'from_balance', 'to_balance'} o {'status': 'insufficient_funds'}
+    si el emisor no tenía fondos suficientes; None si hubo un error."""
+    try:
+        response = supabase.rpc('transfer_lbucks', {
+            'p_from': str(from_user_id),
+            'p_to': str(to_user_id),
+            'p_amount': amount
+        }).execute()
+        if not response.data:
+            return {'status': 'insufficient_funds'}
+        balances = response.data[0]
+        leaderboards.update('lbucks', from_user_id, balances['from_balance'])
+        leaderboards.update('lbucks', to_user_id, balances['to_balance'])
+        return {'status': 'ok', 'from_balance': balances['from_balance'], 'to_balance': balances['to_balance']}
+    except Exception as e:
+        print(f"[DB ERROR] Error en transfer_lbucks: {e}")
+        return None
+
+def reward_mission(user_id, reward):
+    """Paga la recompensa de una misión y suma una misión completada, en una sola operación."""
+    try:
+        response = supabase.rpc('reward_mission', {'p_user_id': str(user_id), 'p_reward': reward}).execute()
+        if response.data:
+            totals = response.data[0]
+            leaderboards.update('lbucks', user_id, totals['lbucks'])
+            leaderboards.update('missions', user_id, totals['missions_completed'])
+    except Exception as e:
+        print(f"[DB ERROR] Error en reward_mission: {e}")
 
 def get_balance(user_id):
     user = get_user(user_id)
@@ -50,49 +98,118 @@ def update_daily_claim(user_id):
         print(f"[DB ERROR] Error en update_daily_claim: {e}")
 
 # --- FUNCIONES PARA LA TABLA 'invites' ---
+INVITE_REWARD = 10  # LBucks por invitación
+
 def check_and_update_invite_reward(invite_code, inviter_id):
-    try:
-        response = supabase.from_('invites').select('*').eq('invite_code', invite_code).execute()
-        if not response.data:
-            supabase.from_('invites').insert({'invite_code': invite_code, 'inviter_id': str(inviter_id)}).execute()
-            return
+    """Registra el uso de una invitación en una sola transacción (función claim_invite_reward).
 
-        invite_data = response.data[0]
-        if not invite_data['reward_given']:
-            update_lbucks(inviter_id, 10) # Recompensa por invitación
-            supabase.from_('invites').update({'reward_given': True}).eq('invite_code', invite_code).execute()
+    La primera vez que se ve el código solo se registra; la siguiente se paga la
+    recompensa, una única vez. Devuelve 'registered', 'rewarded' o 'already_rewarded'
+    (None si hubo un error).
+    """
+    try:
+        rows = supabase.rpc('claim_invite_reward', {
+            'p_invite_code': invite_code, 'p_inviter_id': str(inviter_id), 'p_reward': INVITE_REWARD
+        }).execute().data
+        result = rows[0]
+        if result['status'] == 'registered':
+            invite_counts.set(str(inviter_id), result['invite_count'])
+            leaderboards.update('invites', inviter_id, result['invite_count'])
+        elif result['status'] == 'rewarded':
+            leaderboards.update('lbucks', inviter_id, result['balance'])
             print(f"Recompensa de invitación dada a {inviter_id}")
-
+        return result['status']
     except Exception as e:
         print(f"[DB ERROR] Error en check_and_update_invite_reward: {e}")
-        
+        return None
+
 def get_invite_count(inviter_id):
+    """Número de invitaciones del usuario (contador users.invite_count, con caché en memoria)."""
+    return get_invite_counts([inviter_id]).get(str(inviter_id), 0)
+
+def get_invite_counts(user_ids):
+    """Devuelve {user_id: invitaciones} para varios usuarios; solo consulta los que no están en caché."""
+    counts, missing = {}, []
+    for user_id in {str(user_id) for user_id in user_ids}:
+        count = invite_counts.get(user_id)
+        if count is None:
+            missing.append(user_id)
+        else:
+            counts[user_id] = count
+    if not missing:
+        return counts
     try:
-        response = supabase.from_('invites').select('inviter_id').eq('inviter_id', str(inviter_id)).execute()
-        return len(response.data)
+        response = supabase.from_('users').select('user_id, invite_count').in_('user_id', missing).execute()
+        found = {row['user_id']: row['invite_count'] or 0 for row in response.data}
+        for user_id in missing:
+            counts[user_id] = found.get(user_id, 0)
+            invite_counts.set(user_id, counts[user_id])
     except Exception as e:
-        print(f"[DB ERROR] Error en get_invite_count: {e}")
-        return 0
+        print(f"[DB ERROR] Error en get_invite_counts: {e}")
+        for user_id in missing:
+            counts[user_id] = 0
+    return counts
 
 # --- FUNCIONES PARA LA TABLA 'missions' ---
+def get_mission_catalog(refresh=False):
+    """Devuelve el catálogo de misiones {mission_id: misión}, cargándolo con una sola consulta si hace falta."""
+    catalog = None if refresh else mission_catalog.get()
+    if catalog is None:
+        catalog = mission_catalog.load(supabase.from_('missions').select('*').execute().data)
+    return catalog
+
+def invalidate_mission_catalog():
+    """Fuerza la recarga del catálogo de misiones (p. ej. tras editarlo en el panel)."""
+    mission_catalog.invalidate()
+
+def get_mission_details(mission_id):
+    """Busca una misión en el catálogo; si no está (misión nueva), recarga el catálogo,
+    como mucho una vez cada MISSION_MISS_RELOAD_SECONDS."""
+    catalog = get_mission_catalog()
+    if mission_id not in catalog and not mission_catalog.loaded_within(MISSION_MISS_RELOAD_SECONDS):
+        catalog = get_mission_catalog(refresh=True)
+    return catalog.get(mission_id)
+
+def mission_matches(mission_details, mission_type, command_name=None):
+    """Indica si un evento de tipo `mission_type` hace avanzar esta misión."""
+    if not mission_details or mission_details['mission_type'] != mission_type:
+        return False
+    # Si la misión requiere un comando específico, solo cuenta ese comando.
+    required_command = mission_details.get('trigger_value')
+    return not required_command or required_command == command_name
+
+def can_skip_mission_event(user_id, mission_type, command_name=None):
+    """True si, según las cachés, el evento no puede afectar a ninguna misión pendiente del usuario hoy."""
+    missions = daily_missions.get(user_id)
+    catalog = mission_catalog.get()
+    if missions is None or catalog is None:
+        return False
+    return not any(
+        not m['is_completed'] and mission_matches(catalog.get(m['mission_id']), mission_type, command_name)
+        for m in list(missions.values())
+    )
+
 def get_daily_missions(user_id):
     try:
-        today = datetime.date.today().isoformat()
+        today_date = datetime.date.today()
+        today = today_date.isoformat()
         response = supabase.from_('user_missions').select('id, progress, is_completed, mission_id').eq('user_id', str(user_id)).eq('assigned_date', today).execute()
         
         if response.data:
+            daily_missions.put(user_id, response.data, day=today_date)
             user_missions_data = []
             for m in response.data:
-                mission_details = supabase.from_('missions').select('*').eq('mission_id', m['mission_id']).execute().data[0]
-                user_missions_data.append({**m, **mission_details})
+                mission_details = get_mission_details(m['mission_id'])
+                if mission_details:
+                    user_missions_data.append({**m, **mission_details})
             return user_missions_data
         else:
             supabase.from_('user_missions').delete().eq('user_id', str(user_id)).execute()
-            all_missions = supabase.from_('missions').select('*').execute().data
+            all_missions = list(get_mission_catalog().values())
             if not all_missions:
                 return []
             
-            random_missions = random.sample(all_missions, k=4)
+            random_missions = random.sample(all_missions, k=min(4, len(all_missions)))
             
             missions_to_insert = []
             for m in random_missions:
@@ -112,57 +229,66 @@ def get_daily_missions(user_id):
         print(f"[DB ERROR] Error en get_daily_missions: {e}")
         return []
 
-# Reemplaza esta función completa en database.py
 def update_mission_progress(user_id, mission_type, progress_increase=1, command_name=None):
+    # Si la caché ya sabe que el evento no afecta a ninguna misión pendiente, no tocamos la base de datos.
+    if can_skip_mission_event(user_id, mission_type, command_name):
+        return
     try:
-        today = datetime.date.today().isoformat()
-        response = supabase.from_('user_missions').select('id, progress, mission_id, is_completed').eq('user_id', str(user_id)).eq('assigned_date', today).eq('is_completed', False).execute()
-        
-        for user_mission in response.data:
-            mission_details = supabase.from_('missions').select('*').eq('mission_id', user_mission['mission_id']).execute().data[0]
-            
-            if mission_details['mission_type'] == mission_type:
-                # --- LÓGICA MEJORADA ---
-                # 1. Obtenemos el comando específico que la misión requiere (si lo tiene)
-                required_command = mission_details.get('trigger_value')
-                
-                # 2. Si la misión requiere un comando específico, y no es el que se usó, la ignoramos.
-                if required_command and required_command != command_name:
-                    continue # Pasa a la siguiente misión del usuario
-
-                # --- FIN DE LA LÓGICA MEJORADA ---
-
-                new_progress = user_mission['progress'] + progress_increase
-                is_completed = new_progress >= mission_details['target_value']
-                
-                supabase.from_('user_missions').update({
-                    'progress': new_progress,
-                    'is_completed': is_completed
-                }).eq('id', user_mission['id']).execute()
-                
-                if is_completed:
-                    update_lbucks(user_id, mission_details['reward'])
-                    print(f"Misión '{mission_details['description']}' completada por {user_id}. Recompensa: {mission_details['reward']} LBucks.")
-                
+        today = datetime.date.today()
+        missions = daily_missions.get(user_id)
+        if missions is None:
+            response = supabase.from_('user_missions').select('id, progress, mission_id, is_completed').eq('user_id', str(user_id)).eq('assigned_date', today.isoformat()).execute()
+            missions = daily_missions.put(user_id, response.data, day=today)
+
+        for user_mission in list(missions.values()):
+            if user_mission['is_completed']:
+                continue
+            mission_details = get_mission_details(user_mission['mission_id'])
+            if not mission_matches(mission_details, mission_type, command_name):
+                continue
+
+            new_progress = user_mission['progress'] + progress_increase
+            is_completed = new_progress >= mission_details['target_value']
+
+            supabase.from_('user_missions').update({
+                'progress': new_progress,
+                'is_completed': is_completed
+            }).eq('id', user_mission['id']).execute()
+            daily_missions.update(user_id, user_mission['id'], new_progress, is_completed)
+
+            if is_completed:
+                reward_mission(user_id, mission_details['reward'])
+                print(f"Misión '{mission_details['description']}' completada por {user_id}. Recompensa: {mission_details['reward']} LBucks.")
+
     except Exception as e:
         print(f"[DB ERROR] Error en update_mission_progress: {e}")
 
 # --- FUNCIONES PARA LA TABLA 'shop' ---
 
+def get_shop_catalog(refresh=False):
+    """Devuelve la tienda como {item_id: ítem}, cargándola con una sola consulta si hace falta."""
+    catalog = None if refresh else shop_catalog.get()
+    if catalog is None:
+        response = supabase.from_('shop').select('item_id, price, stock, description, emoji').order('price').execute()
+        catalog = shop_catalog.load(response.data or [])
+    return catalog
+
 def get_shop_items():
     """Obtiene todos los datos de los ítems de la tienda como una lista de diccionarios."""
     try:
-        response = supabase.from_('shop').select('item_id, price, stock, description, emoji').order('price').execute()
-        return response.data if response.data else []
+        return sorted(get_shop_catalog().values(), key=lambda item: item.get('price') or 0)
     except Exception as e:
         print(f"[DB ERROR] Error en get_shop_items: {e}")
         return []
 
 def get_item(item_id):
-    """Obtiene los datos de un ítem específico como un único diccionario."""
+    """Obtiene los datos de un ítem específico como un único diccionario.
+    El stock puede no estar al día; el canjeo lo vuelve a comprobar en la base de datos."""
     try:
-        response = supabase.from_('shop').select('item_id, price, stock, description, emoji').eq('item_id', item_id).single().execute()
-        return response.data if response.data else None
+        catalog = get_shop_catalog()
+        if item_id not in catalog:
+            catalog = get_shop_catalog(refresh=True)
+        return catalog.get(item_id)
     except Exception as e:
         print(f"[DB ERROR] Error en get_item: {e}")
         return None
@@ -174,18 +300,22 @@ def update_stock(item_id, amount_change):
             current_stock = response.data[0]['stock']
             new_stock = current_stock + amount_change
             supabase.from_('shop').upsert({'item_id': item_id, 'stock': new_stock}).execute()
+            shop_catalog.update(item_id, stock=new_stock)
     except Exception as e:
         print(f"[DB ERROR] Error en update_stock: {e}")
 
 def set_price(item_id, new_price):
     try:
         supabase.from_('shop').upsert({'item_id': item_id, 'price': new_price}).execute()
+        # Un upsert puede crear un ítem nuevo, así que recargamos la tienda completa.
+        shop_catalog.invalidate()
     except Exception as e:
         print(f"[DB ERROR] Error en set_price: {e}")
 
 def set_shop_stock(item_id, quantity):
     try:
         supabase.from_('shop').upsert({'item_id': item_id, 'stock': quantity}).execute()
+        shop_catalog.invalidate()
     except Exception as e:
         print(f"[DB ERROR] Error en set_shop_stock: {e}")
 
@@ -201,6 +331,44 @@ def create_redemption(user_id, item_id, message_id):
     except Exception as e:
         print(f"[DB ERROR] Error en create_redemption: {e}")
 
+def redeem_item(user_id, item_id):
+    """Cobra el ítem, descuenta una unidad de stock y crea el canjeo pendiente en una sola transacción.
+    Devuelve un diccionario con 'status' ('ok', 'not_found', 'out_of_stock' o 'insufficient_funds'),
+    'redemption_id', 'balance', 'stock' y 'price'; o None si falló la llamada."""
+    try:
+        response = supabase.rpc('redeem_item', {'p_user_id': str(user_id), 'p_item_id': item_id}).execute()
+        result = response.data[0] if response.data else None
+        if result and result['status'] == 'ok':
+            leaderboards.update('lbucks', user_id, result['balance'])
+        if result and result['stock'] is not None:
+            shop_catalog.update(item_id, stock=result['stock'])
+        return result
+    except Exception as e:
+        print(f"[DB ERROR] Error en redeem_item: {e}")
+        return None
+
+def set_redemption_message(redemption_id, message_id):
+    """Asocia un canjeo con su mensaje en el canal de logs (donde están los botones de admin)."""
+    try:
+        supabase.from_('redemptions').update({'message_id': str(message_id)}).eq('redemption_id', redemption_id).execute()
+    except Exception as e:
+        print(f"[DB ERROR] Error en set_redemption_message: {e}")
+
+def refund_redemption(message_id, status='cancelled_by_admin'):
+    """Cancela un canjeo pendiente, devuelve los LBucks y repone el stock en una sola transacción.
+    Devuelve un diccionario con 'status' ('ok' o 'already_processed'), 'redemption_id',
+    'user_id', 'item_id' y 'price'; o None si falló la llamada."""
+    try:
+        response = supabase.rpc('refund_redemption', {'p_message_id': str(message_id), 'p_status': status}).execute()
+        result = response.data[0] if response.data else None
+        if result and result['status'] == 'ok':
+            shop_catalog.invalidate()
+            leaderboards.increment('lbucks', result['user_id'], result['price'] or 0)
+        return result
+    except Exception as e:
+        print(f"[DB ERROR] Error en refund_redemption: {e}")
+        return None
+
 def get_redemption_by_message(message_id):
     try:
         response = supabase.from_('redemptions').select('*').eq('message_id', str(message_id)).execute()
@@ -229,13 +397,65 @@ def get_lbucks_leaderboard(limit=10):
         print(f"[DB ERROR] Error en get_lbucks_leaderboard: {e}")
         return []
 
+# Tabla y columna de las que sale cada métrica de ranking.py.
+METRIC_SOURCES = {
+    'lbucks': ('users', 'lbucks'),
+    'invites': ('users', 'invite_count'),
+    'missions': ('users', 'missions_completed'),
+    'power_level': ('adventure_players', 'power_level'),
+}
+
+def _select_all(table, columns, order_by='user_id', page_size=1000):
+    """Lee todas las filas de una tabla, página a página (PostgREST limita las filas por respuesta).
+
+    Las páginas se ordenan por `order_by` (una clave única): sin orden, Postgres puede
+    devolver las filas en otro orden en cada consulta y una fila saltaría de página.
+    """
+    rows, start = [], 0
+    while True:
+        page = supabase.from_(table).select(columns).order(order_by).range(start, start + page_size - 1).execute().data or []
+        rows.extend(page)
+        if len(page) < page_size:
+            return rows
+        start += page_size
+
+def get_metric_values(metric):
+    """Devuelve {user_id: valor} de una métrica de ranking para todos los usuarios."""
+    try:
+        table, column = METRIC_SOURCES[metric]
+        return {row['user_id']: row[column] or 0 for row in _select_all(table, f'user_id, {column}')}
+    except Exception as e:
+        print(f"[DB ERROR] Error en get_metric_values: {e}")
+        return None
+
 # --- FUNCIONES PARA LA AVENTURA ESPACIAL ---
 
+def normalize_inventory(inventory):
+    """Devuelve el inventario como {nombre: cantidad}.
+
+    Acepta también el formato antiguo (lista de {'name', 'value'}, un elemento por
+    objeto) por si alguna fila todavía no se migró.
+    """
+    if not inventory:
+        return {}
+    if isinstance(inventory, dict):
+        return {name: int(count) for name, count in inventory.items() if count}
+    counts = {}
+    for item in inventory:
+        name = item.get('name') if isinstance(item, dict) else None
+        if name:
+            counts[name] = counts.get(name, 0) + 1
+    return counts
+
 def get_player_profile(user_id):
     """Obtiene el perfil de aventura de un jugador desde 'adventure_players'."""
     try:
         response = supabase.from_('adventure_players').select('*').eq('user_id', str(user_id)).execute()
-        return response.data[0] if response.data else None
+        if not response.data:
+            return None
+        player = response.data[0]
+        player['inventory'] = normalize_inventory(player.get('inventory'))
+        return player
     except Exception as e:
         print(f"[DB ERROR] Error en get_player_profile: {e}")
         return None
@@ -254,88 +474,114 @@ def update_player_profile(user_id, updates: dict):
     """
     try:
         supabase.from_('adventure_players').update(updates).eq('user_id', str(user_id)).execute()
+        if 'power_level' in updates:
+            leaderboards.update('power_level', user_id, updates['power_level'])
     except Exception as e:
         print(f"[DB ERROR] Error en update_player_profile: {e}")
 
+def get_planet_catalog(refresh=False):
+    """Devuelve los planetas como {planet_id: planeta}, cargándolos con una sola consulta si hace falta."""
+    catalog = None if refresh else planet_catalog.get()
+    if catalog is None:
+        catalog = planet_catalog.load(supabase.from_('adventure_planets').select('*').execute().data or [])
+    return catalog
+
 def get_planet_by_id(planet_id):
-    """Obtiene la información de un planeta por su ID."""
+    """Obtiene la información de un planeta por su ID (desde el catálogo en memoria)."""
     try:
-        response = supabase.from_('adventure_planets').select('*').eq('planet_id', planet_id).single().execute()
-        return response.data
+        catalog = get_planet_catalog()
+        if planet_id not in catalog:
+            catalog = get_planet_catalog(refresh=True)
+        return catalog.get(planet_id)
     except Exception as e:
         print(f"[DB ERROR] Error en get_planet_by_id: {e}")
         return None
 
-def get_explorable_planets(conquered_planet_names: list):
-    """Obtiene planetas que el usuario NO ha conquistado."""
+def get_explorable_planets(conquered_planet_names):
+    """Elige hasta 3 planetas al azar que el usuario NO ha conquistado, sin consultar la base de datos."""
     try:
-        query = supabase.from_('adventure_planets').select('*')
-
-        # --- LA LÍNEA CORREGIDA ESTÁ AQUÍ ---
-        # Si la lista de planetas conquistados no está vacía, los filtramos.
-        if conquered_planet_names:
-            # La sintaxis correcta para "not in" es .not_.in_()
-            query = query.not_.in_('name', conquered_planet_names)
-        # --- FIN DE LA CORRECCIÓN ---
-
-        response = query.execute()
-
-        # El resto del código para elegir 3 al azar sigue igual
-        available_planets = response.data
-        if len(available_planets) <= 3:
-            return available_planets
-        return random.sample(available_planets, k=3)
-
+        get_planet_catalog()
+        return planet_catalog.explorable(conquered_planet_names, k=3)
     except Exception as e:
         print(f"[DB ERROR] Error en get_explorable_planets: {e}")
         return []
 
+def apply_conquest(user_id, planet_name, loot_name, reward, power_reward):
+    """Aplica una victoria en una sola transacción (función apply_conquest).
+
+    Añade el planeta conquistado y una unidad de `loot_name`, y suma `reward` LBucks y
+    `power_reward` de poder. Devuelve un dict con 'status' ('ok', 'not_found' o
+    'already_conquered'), 'balance' y 'power_level'; None si hubo un error.
+    """
+    try:
+        result = supabase.rpc('apply_conquest', {
+            'p_user_id': str(user_id),
+            'p_planet_name': planet_name,
+            'p_loot_name': loot_name,
+            'p_reward': reward,
+            'p_power_reward': power_reward,
+        }).execute().data[0]
+        if result['status'] == 'ok':
+            leaderboards.update('lbucks', user_id, result['balance'])
+            leaderboards.update('power_level', user_id, result['power_level'])
+        return result
+    except Exception as e:
+        print(f"[DB ERROR] Error en apply_conquest: {e}")
+        return None
+
 def summarize_inventory(user_id):
-    """Cuenta los materiales en el inventario de un jugador y los devuelve en un diccionario."""
+    """Devuelve los materiales del inventario de un jugador como {nombre: cantidad}."""
     try:
         player = get_player_profile(user_id)
-        if not player or not player['inventory']:
-            return {}
-        
-        summary = {}
-        for item in player['inventory']:
-            name = item.get('name')
-            if name:
-                summary[name] = summary.get(name, 0) + 1
-        return summary
+        return player['inventory'] if player else {}
     except Exception as e:
         print(f"[DB ERROR] Error en summarize_inventory: {e}")
         return {}
 
+def adjust_inventory(user_id, changes: dict):
+    """Suma (o resta, con cantidades negativas) materiales de forma atómica.
 
-def remove_materials_from_inventory(user_id, materials_to_remove: dict):
-    """Elimina una cantidad específica de materiales del inventario de un jugador."""
+    Devuelve el inventario resultante, o None si el jugador no existe o no tiene
+    suficientes unidades de algún material (en ese caso no se modifica nada).
+    """
     try:
-        player = get_player_profile(user_id)
-        if not player:
-            return
+        inventory = supabase.rpc('adjust_inventory', {'p_user_id': str(user_id), 'p_changes': changes}).execute().data
+        return normalize_inventory(inventory) if inventory is not None else None
+    except Exception as e:
+        print(f"[DB ERROR] Error en adjust_inventory: {e}")
+        return None
 
-        current_inventory = player['inventory']
-        
-        # Copiamos el diccionario para poder iterar y eliminar de forma segura
-        temp_materials_to_remove = materials_to_remove.copy()
-
-        new_inventory = []
-        # Iteramos el inventario en orden inverso para poder eliminar sin afectar los índices
-        for item in reversed(current_inventory):
-            item_name = item.get('name')
-            if item_name in temp_materials_to_remove and temp_materials_to_remove[item_name] > 0:
-                # Si encontramos un material que necesitamos quitar, lo "gastamos" y no lo añadimos al nuevo inventario
-                temp_materials_to_remove[item_name] -= 1
-            else:
-                # Si no es un material a gastar, lo conservamos
-                new_inventory.append(item)
-        
-        # Volvemos a invertir la lista para que mantenga su orden original
-        new_inventory.reverse()
 
-        # Actualizamos la base de datos con el nuevo inventario
-        update_player_profile(user_id, {'inventory': new_inventory})
+def remove_materials_from_inventory(user_id, materials_to_remove: dict):
+    """Quita los materiales indicados del inventario solo si el jugador los tiene todos.
+
+    Devuelve el inventario resultante, o None si faltaba algún material.
+    """
+    return adjust_inventory(user_id, {name: -count for name, count in materials_to_remove.items()})
 
+def purchase_upgrade(user_id, upgrade_type, upgrade: dict):
+    """Compra la siguiente mejora de nave o estación en una sola transacción (función purchase_upgrade).
+
+    `upgrade` es la entrada de UPGRADE_CATALOG del nivel a comprar. Devuelve un dict con
+    'status' ('ok', 'not_found', 'already_upgraded', 'insufficient_lbucks' o
+    'insufficient_materials'), 'balance' y el perfil resultante (ship_level,
+    station_level, power_level, inventory). None si hubo un error.
+    """
+    try:
+        rows = supabase.rpc('purchase_upgrade', {
+            'p_user_id': str(user_id),
+            'p_upgrade_type': upgrade_type,
+            'p_level': upgrade['level'],
+            'p_cost_lbucks': upgrade['cost_lbucks'],
+            'p_cost_materials': upgrade['cost_materials'],
+            'p_power_increase': upgrade['power_increase'],
+        }).execute().data
+        result = rows[0]
+        result['inventory'] = normalize_inventory(result.get('inventory'))
+        if result['status'] == 'ok':
+            leaderboards.update('lbucks', user_id, result['balance'])
+            leaderboards.update('power_level', user_id, result['power_level'])
+        return result
     except Exception as e:
-        print(f"[DB ERROR] Error en remove_materials_from_inventory: {e}")
+        print(f"[DB ERROR] Error en purchase_upgrade: {e}")
+        return None
@@ -0,0 +1,719 @@
+# database_async.py
+# Versión asíncrona de la API de database.py. Usa el cliente async de Supabase
+# sobre un único httpx.AsyncClient compartido, con un pool de conexiones
+# limitado y keep-alive, para que los listeners esperen la E/S directamente
+# en lugar de ocupar un hilo del executor por cada llamada.
+from supabase import acreate_client, AsyncClient, AsyncClientOptions
+import httpx
+import asyncio
+import os
+import datetime
+import random
+import inspect
+import uuid
+import database as db
+import metrics
+from db_executor import async_db_gate, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE
+from ranking import leaderboards
+
+# --- CONFIGURACIÓN DEL POOL DE CONEXIONES ---
+url: str = os.environ.get("SUPABASE_URL")
+key: str = os.environ.get("SUPABASE_KEY")
+MAX_CONNECTIONS = int(os.environ.get("SUPABASE_MAX_CONNECTIONS", 20))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("SUPABASE_MAX_KEEPALIVE", 10))
+KEEPALIVE_EXPIRY = float(os.environ.get("SUPABASE_KEEPALIVE_EXPIRY", 30))
+REQUEST_TIMEOUT = float(os.environ.get("SUPABASE_TIMEOUT", 10))
+MESSAGE_PROGRESS_FLUSH_SECONDS = float(os.environ.get("MESSAGE_PROGRESS_FLUSH_SECONDS", 15))
+MESSAGE_PROGRESS_MAX_PENDING = int(os.environ.get("MESSAGE_PROGRESS_MAX_PENDING", 200))
+
+_http_client: httpx.AsyncClient = None
+_supabase: AsyncClient = None
+_client_lock = asyncio.Lock()
+_catalog_lock = asyncio.Lock()
+_shop_lock = asyncio.Lock()
+_planet_lock = asyncio.Lock()
+
+async def get_client() -> AsyncClient:
+    """Devuelve el cliente async compartido, creándolo la primera vez que se usa."""
+    global _http_client, _supabase
+    if _supabase is not None:
+        return _supabase
+    async with _client_lock:
+        if _supabase is None:
+            _http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=KEEPALIVE_EXPIRY),
+                timeout=REQUEST_TIMEOUT,
+                follow_redirects=True,
+                http2=True)
+            options = AsyncClientOptions(httpx_client=_http_client)
+            _supabase = await acreate_client(url, key, options=options)
+    return _supabase
+
+async def close():
+    """Cierra el pool de conexiones. Se llama al apagar el bot."""
+    global _http_client, _supabase
+    if _http_client is not None:
+        await _http_client.aclose()
+    _http_client = None
+    _supabase = None
+
+# --- FUNCIONES PARA LA TABLA 'users' ---
+async def get_user(user_id):
+    try:
+        supabase = await get_client()
+        response = await supabase.from_('users').select('*').eq('user_id', str(user_id)).execute()
+        if response.data:
+            user_data = response.data[0]
+            last_daily_dt = datetime.datetime.fromisoformat(user_data['last_daily']).replace(tzinfo=datetime.timezone.utc) if user_data.get('last_daily') else None
+            return (user_data['user_id'], user_data['lbucks'], last_daily_dt)
+        else:
+            await supabase.from_('users').insert({'user_id': str(user_id), 'lbucks': 0}).execute()
+            return (str(user_id), 0, None)
+    except Exception as e:
+        print(f"[DB ERROR] Error en get_user (async): {e}")
+        return (str(user_id), 0, None)
+
+async def update_lbucks(user_id, amount):
+    """Suma `amount` LBucks (negativo para restar) de forma atómica y devuelve el nuevo saldo."""
+    try:
+        supabase = await get_client()
+        response = await supabase.rpc('increment_lbucks', {'p_user_id': str(user_id), 'p_amount': amount}).execute()
+        leaderboards.update('lbucks', user_id, response.data)
+        return response.data
+    except Exception as e:
+        print(f"[DB ERROR] Error en update_lbucks (async): {e}")
+        return None
+
+async def transfer_lbucks(from_user_id, to_user_id, amount):
+    """Transfiere LBucks de un usuario a otro en una sola transacción.
+    Devuelve {'status': 'ok', 'from_balance', 'to_balance'} o {'status': 'insufficient_funds'}
+    si el emisor no tenía fondos suficientes; None si hubo un error."""
+    try:
+        supabase = await get_client()
+        response = await supabase.rpc('transfer_lbucks', {
+            'p_from': str(from_user_id),
+            'p_to': str(to_user_id),
+            'p_amount': amount
+        }).execute()
+        if not response.data:
+            return {'status': 'insufficient_funds'}
+        balances = response.data[0]
+        leaderboards.update('lbucks', from_user_id, balances['from_balance'])
+        leaderboards.update('lbucks', to_user_id, balances['to_balance'])
+        return {'status': 'ok', 'from_balance': balances['from_balance'], 'to_balance': balances['to_balance']}
+    except Exception as e:
+        print(f"[DB ERROR] Error en transfer_lbucks (async): {e}")
+        return None
+
+async def reward_mission(user_id, reward):
+    """Paga la recompensa de una misión y suma una misión completada, en una sola operación."""
+    try:
+        supabase = await get_client()
+        response = await supabase.rpc('reward_mission', {'p_user_id': str(user_id), 'p_reward': reward}).execute()
+        if response.data:
+            totals = response.data[0]
+            leaderboards.update('lbucks', user_id, totals['lbucks'])
+            leaderboards.update('missions', user_id, totals['missions_completed'])
+    except Exception as e:
+        print(f"[DB ERROR] Error en reward_mission (async): {e}")
+
+async def get_balance(user_id):
+    user = await get_user(user_id)
+    return user[1] if user else 0
+
+async def update_daily_claim(user_id):
+    now_utc = datetime.datetime.utcnow().isoformat()
+    try:
+        supabase = await get_client()
+        await supabase.from_('users').upsert({'user_id': str(user_id), 'last_daily': now_utc}).execute()
+    except Exception as e:
+        print(f"[DB ERROR] Error en update_daily_claim (async): {e}")
+
+# --- FUNCIONES PARA LA TABLA 'invites' ---
+async def check_and_update_invite_reward(invite_code, inviter_id):
+    """Registra el uso de una invitación en una sola transacción (función claim_invite_reward).
+
+    La primera vez que se ve el código solo se registra; la siguiente se paga la
+    recompensa, una única vez. Devuelve 'registered', 'rewarded' o 'already_rewarded'
+    (None si hubo un error).
+    """
+    try:
+        supabase = await get_client()
+        response = await supabase.rpc('claim_invite_reward', {
+            'p_invite_code': invite_code, 'p_inviter_id': str(inviter_id), 'p_reward': db.INVITE_REWARD
+        }).execute()
+        result = response.data[0]
+        if result['status'] == 'registered':
+            db.invite_counts.set(str(inviter_id), result['invite_count'])
+            leaderboards.update('invites', inviter_id, result['invite_count'])
+        elif result['status'] == 'rewarded':
+            leaderboards.update('lbucks', inviter_id, result['balance'])
+            print(f"Recompensa de invitación dada a {inviter_id}")
+        return result['status']
+    except Exception as e:
+        print(f"[DB ERROR] Error en check_and_update_invite_reward (async): {e}")
+        return None
+
+async def get_invite_count(inviter_id):
+    """Número de invitaciones del usuario (contador users.invite_count, con caché en memoria)."""
+    return (await get_invite_counts([inviter_id])).get(str(inviter_id), 0)
+
+async def get_invite_counts(user_ids):
+    """Devuelve {user_id: invitaciones} para varios usuarios; solo consulta los que no están en caché."""
+    counts, missing = {}, []
+    for user_id in {str(user_id) for user_id in user_ids}:
+        count = db.invite_counts.get(user_id)
+        if count is None:
+            missing.append(user_id)
+        else:
+            counts[user_id] = count
+    if not missing:
+        return counts
+    try:
+        supabase = await get_client()
+        response = await supabase.from_('users').select('user_id, invite_count').in_('user_id', missing).execute()
+        found = {row['user_id']: row['invite_count'] or 0 for row in response.data}
+        for user_id in missing:
+            counts[user_id] = found.get(user_id, 0)
+            db.invite_counts.set(user_id, counts[user_id])
+    except Exception as e:
+        print(f"[DB ERROR] Error en get_invite_counts (async): {e}")
+        for user_id in missing:
+            counts[user_id] = 0
+    return counts
+
+# --- FUNCIONES PARA LA TABLA 'missions' ---
+# El catálogo de misiones (db.mission_catalog) es el mismo para la API síncrona y la async.
+async def get_mission_catalog(refresh=False):
+    """Devuelve el catálogo de misiones {mission_id: misión}, cargándolo con una sola consulta si hace falta."""
+    catalog = None if refresh else db.mission_catalog.get()
+    if catalog is not None:
+        return catalog
+    async with _catalog_lock:
+        # Otra corrutina pudo haberlo cargado mientras esperábamos el lock.
+        catalog = None if refresh else db.mission_catalog.get()
+        if catalog is None:
+            supabase = await get_client()
+            response = await supabase.from_('missions').select('*').execute()
+            catalog = db.mission_catalog.load(response.data)
+    return catalog
+
+async def get_mission_details(mission_id):
+    """Busca una misión en el catálogo; si no está (misión nueva), recarga el catálogo,
+    como mucho una vez cada MISSION_MISS_RELOAD_SECONDS."""
+    catalog = await get_mission_catalog()
+    if mission_id not in catalog and not db.mission_catalog.loaded_within(db.MISSION_MISS_RELOAD_SECONDS):
+        catalog = await get_mission_catalog(refresh=True)
+    return catalog.get(mission_id)
+
+async def get_daily_missions(user_id):
+    try:
+        supabase = await get_client()
+        today_date = datetime.date.today()
+        today = today_date.isoformat()
+        response = await supabase.from_('user_missions').select('id, progress, is_completed, mission_id').eq('user_id', str(user_id)).eq('assigned_date', today).execute()
+
+        if response.data:
+            db.daily_missions.put(user_id, response.data, day=today_date)
+            user_missions_data = []
+            for m in response.data:
+                mission_details = await get_mission_details(m['mission_id'])
+                if mission_details:
+                    user_missions_data.append({**m, **mission_details})
+            return user_missions_data
+        else:
+            await supabase.from_('user_missions').delete().eq('user_id', str(user_id)).execute()
+            all_missions = list((await get_mission_catalog()).values())
+            if not all_missions:
+                return []
+
+            random_missions = random.sample(all_missions, k=min(4, len(all_missions)))
+
+            missions_to_insert = []
+            for m in random_missions:
+                missions_to_insert.append({
+                    'user_id': str(user_id),
+                    'mission_id': m['mission_id'],
+                    'progress': 0,
+                    'is_completed': False,
+                    'assigned_date': today
+                })
+
+            await supabase.from_('user_missions').insert(missions_to_insert).execute()
+
+            return await get_daily_missions(user_id)
+
+    except Exception as e:
+        print(f"[DB ERROR] Error en get_daily_missions (async): {e}")
+        return []
+
+async def update_mission_progress(user_id, mission_type, progress_increase=1, command_name=None):
+    # Si la caché ya sabe que el evento no afecta a ninguna misión pendiente, no tocamos la base de datos.
+    if db.can_skip_mission_event(user_id, mission_type, command_name):
+        return
+    try:
+        supabase = await get_client()
+        today = datetime.date.today()
+        missions = db.daily_missions.get(user_id)
+        if missions is None:
+            response = await supabase.from_('user_missions').select('id, progress, mission_id, is_completed').eq('user_id', str(user_id)).eq('assigned_date', today.isoformat()).execute()
+            missions = db.daily_missions.put(user_id, response.data, day=today)
+
+        for user_mission in list(missions.values()):
+            if user_mission['is_completed']:
+                continue
+            mission_details = await get_mission_details(user_mission['mission_id'])
+            if not db.mission_matches(mission_details, mission_type, command_name):
+                continue
+
+            new_progress = user_mission['progress'] + progress_increase
+            is_completed = new_progress >= mission_details['target_value']
+
+            await supabase.from_('user_missions').update({
+                'progress': new_progress,
+                'is_completed': is_completed
+            }).eq('id', user_mission['id']).execute()
+            db.daily_missions.update(user_id, user_mission['id'], new_progress, is_completed)
+
+            if is_completed:
+                await reward_mission(user_id, mission_details['reward'])
+                print(f"Misión '{mission_details['description']}' completada por {user_id}. Recompensa: {mission_details['reward']} LBucks.")
+
+    except Exception as e:
+        print(f"[DB ERROR] Error en update_mission_progress (async): {e}")
+
+async def apply_message_progress(counts: dict, day: datetime.date, batch_id: str):
+    """Aplica en una sola llamada el progreso de 'message_count' acumulado para varios usuarios.
+
+    `batch_id` identifica el lote: la función SQL lo registra y, si ya lo había
+    aplicado (un reintento tras un timeout con la escritura ya confirmada), no suma
+    nada. Devuelve las misiones que se completaron en este lote (la recompensa ya fue pagada)."""
+    supabase = await get_client()
+    batch = [{'user_id': user_id, 'count': count} for user_id, count in counts.items()]
+    response = await supabase.rpc('apply_message_progress', {
+        'p_batch': batch, 'p_date': day.isoformat(), 'p_batch_id': batch_id,
+    }).execute()
+    completed = []
+    for mission in response.data or []:
+        db.daily_missions.update(mission['user_id'], mission['id'], mission['progress'], mission['is_completed'])
+        if mission['is_completed']:
+            completed.append(mission)
+            leaderboards.increment('lbucks', mission['user_id'], mission['reward'])
+            leaderboards.increment('missions', mission['user_id'], 1)
+            print(f"Misión '{mission['description']}' completada por {mission['user_id']}. Recompensa: {mission['reward']} LBucks.")
+    return completed
+
+class MessageProgressBatcher:
+    """Acumula en memoria el progreso de 'message_count' por usuario y lo escribe en lotes.
+
+    Se vacía cada `flush_interval` segundos o en cuanto hay `max_pending` mensajes
+    pendientes, lo que ocurra antes. Los contadores se agrupan por día para que los
+    mensajes de antes de medianoche no cuenten para las misiones del día siguiente.
+    Un lote que falla se reintenta tal cual, con el mismo id, para que la base de
+    datos lo aplique una sola vez.
+    """
+
+    def __init__(self, flush_interval=MESSAGE_PROGRESS_FLUSH_SECONDS, max_pending=MESSAGE_PROGRESS_MAX_PENDING):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = {}  # {fecha: {user_id: mensajes}}
+        self._pending_total = 0
+        self._retry = []  # [(batch_id, fecha, {user_id: mensajes})] lotes fallidos
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self._closing = False
+
+    def add(self, user_id, amount=1):
+        # Usuarios cuyas misiones de mensajes ya están completas (o no tienen) no generan escrituras.
+        if db.can_skip_mission_event(user_id, 'message_count'):
+            return
+        today = datetime.date.today()
+        day_counts = self._pending.setdefault(today, {})
+        day_counts[str(user_id)] = day_counts.get(str(user_id), 0) + amount
+        self._pending_total += amount
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        if self._pending_total >= self.max_pending:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            # Primero los lotes que fallaron (sin mezclarlos con mensajes nuevos: su id
+            # tiene que seguir correspondiendo a los mismos contadores) y luego lo nuevo.
+            batches = self._retry + [(str(uuid.uuid4()), day, counts) for day, counts in self._pending.items()]
+            self._retry, self._pending, self._pending_total = [], {}, 0
+            for i, (batch_id, day, counts) in enumerate(batches):
+                try:
+                    await apply_message_progress(counts, day, batch_id)
+                except asyncio.CancelledError:
+                    # Cancelados a mitad de lote: lo que no llegó a confirmarse se reintenta.
+                    self._retry.extend(batches[i:])
+                    raise
+                except Exception as e:
+                    # Puede que la escritura se confirmara y solo se perdiera la respuesta;
+                    # el reintento con el mismo batch_id no la vuelve a sumar.
+                    print(f"[DB ERROR] Error en apply_message_progress: {e}")
+                    self._retry.append((batch_id, day, counts))
+
+    async def close(self):
+        """Detiene el vaciado periódico y escribe lo que quede pendiente.
+
+        No cancelamos la tarea: si está a mitad de un flush, esperamos a que termine.
+        """
+        self._closing = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+message_progress = MessageProgressBatcher()
+
+# --- FUNCIONES PARA LA TABLA 'shop' ---
+# La tienda en memoria (db.shop_catalog) es la misma para la API síncrona y la async.
+async def get_shop_catalog(refresh=False):
+    """Devuelve la tienda como {item_id: ítem}, cargándola con una sola consulta si hace falta."""
+    catalog = None if refresh else db.shop_catalog.get()
+    if catalog is not None:
+        return catalog
+    async with _shop_lock:
+        catalog = None if refresh else db.shop_catalog.get()
+        if catalog is None:
+            supabase = await get_client()
+            response = await supabase.from_('shop').select('item_id, price, stock, description, emoji').order('price').execute()
+            catalog = db.shop_catalog.load(response.data or [])
+    return catalog
+
+async def get_shop_items():
+    """Obtiene todos los datos de los ítems de la tienda como una lista de diccionarios."""
+    try:
+        return sorted((await get_shop_catalog()).values(), key=lambda item: item.get('price') or 0)
+    except Exception as e:
+        print(f"[DB ERROR] Error en get_shop_items (async): {e}")
+        return []
+
+async def get_item(item_id):
+    """Obtiene los datos de un ítem específico como un único diccionario.
+    El stock puede no estar al día; el canjeo lo vuelve a comprobar en la base de datos."""
+    try:
+        catalog = await get_shop_catalog()
+        if item_id not in catalog:
+            catalog = await get_shop_catalog(refresh=True)
+        return catalog.get(item_id)
+    except Exception as e:
+        print(f"[DB ERROR] Error en get_item (async): {e}")
+        return None
+
+async def update_stock(item_id, amount_change):
+    try:
+        supabase = await get_client()
+        response = await supabase.from_('shop').select('stock').eq('item_id', item_id).execute()
+        if response.data:
+            current_stock = response.data[0]['stock']
+            new_stock = current_stock + amount_change
+            await supabase.from_('shop').upsert({'item_id': item_id, 'stock': new_stock}).execute()
+            db.shop_catalog.update(item_id, stock=new_stock)
+    except Exception as e:
+        print(f"[DB ERROR] Error en update_stock (async): {e}")
+
+async def set_price(item_id, new_price):
+    try:
+        supabase = await get_client()
+        await supabase.from_('shop').upsert({'item_id': item_id, 'price': new_price}).execute()
+        db.shop_catalog.invalidate()
+    except Exception as e:
+        print(f"[DB ERROR] Error en set_price (async): {e}")
+
+async def set_shop_stock(item_id, quantity):
+    try:
+        supabase = await get_client()
+        await supabase.from_('shop').upsert({'item_id': item_id, 'stock': quantity}).execute()
+        db.shop_catalog.invalidate()
+    except Exception as e:
+        print(f"[DB ERROR] Error en set_shop_stock (async): {e}")
+
+# --- FUNCIONES PARA LA TABLA 'redemptions' ---
+async def create_redemption(user_id, item_id, message_id):
+    try:
+        supabase = await get_client()
+        await supabase.from_('redemptions').insert({
+            'user_id': str(user_id),
+            'item_id': item_id,
+            'message_id': str(message_id),
+            'status': 'pending'
+        }).execute()
+    except Exception as e:
+        print(f"[DB ERROR] Error en create_redemption (async): {e}")
+
+async def redeem_item(user_id, item_id):
+    """Cobra el ítem, descuenta una unidad de stock y crea el canjeo pendiente en una sola transacción.
+    Devuelve un diccionario con 'status' ('ok', 'not_found', 'out_of_stock' o 'insufficient_funds'),
+    'redemption_id', 'balance', 'stock' y 'price'; o None si falló la llamada."""
+    try:
+        supabase = await get_client()
+        response = await supabase.rpc('redeem_item', {'p_user_id': str(user_id), 'p_item_id': item_id}).execute()
+        result = response.data[0] if response.data else None
+        if result and result['status'] == 'ok':
+            leaderboards.update('lbucks', user_id, result['balance'])
+        if result and result['stock'] is not None:
+            db.shop_catalog.update(item_id, stock=result['stock'])
+        return result
+    except Exception as e:
+        print(f"[DB ERROR] Error en redeem_item (async): {e}")
+        return None
+
+async def set_redemption_message(redemption_id, message_id):
+    """Asocia un canjeo con su mensaje en el canal de logs (donde están los botones de admin)."""
+    try:
+        supabase = await get_client()
+        await supabase.from_('redemptions').update({'message_id': str(message_id)}).eq('redemption_id', redemption_id).execute()
+    except Exception as e:
+        print(f"[DB ERROR] Error en set_redemption_message (async): {e}")
+
+async def refund_redemption(message_id, status='cancelled_by_admin'):
+    """Cancela un canjeo pendiente, devuelve los LBucks y repone el stock en una sola transacción.
+    Devuelve un diccionario con 'status' ('ok' o 'already_processed'), 'redemption_id',
+    'user_id', 'item_id' y 'price'; o None si falló la llamada."""
+    try:
+        supabase = await get_client()
+        response = await supabase.rpc('refund_redemption', {'p_message_id': str(message_id), 'p_status': status}).execute()
+        result = response.data[0] if response.data else None
+        if result and result['status'] == 'ok':
+            db.shop_catalog.invalidate()
+            leaderboards.increment('lbucks', result['user_id'], result['price'] or 0)
+        return result
+    except Exception as e:
+        print(f"[DB ERROR] Error en refund_redemption (async): {e}")
+        return None
+
+async def get_redemption_by_message(message_id):
+    try:
+        supabase = await get_client()
+        response = await supabase.from_('redemptions').select('*').eq('message_id', str(message_id)).execute()
+        if response.data:
+            redemption = response.data[0]
+            return (redemption['redemption_id'], redemption['user_id'], redemption['item_id'], redemption['message_id'], redemption['status'])
+        return None
+    except Exception as e:
+        print(f"[DB ERROR] Error en get_redemption_by_message (async): {e}")
+        return None
+
+async def update_redemption_status(redemption_id, status):
+    try:
+        supabase = await get_client()
+        await supabase.from_('redemptions').upsert({'redemption_id': redemption_id, 'status': status}).execute()
+    except Exception as e:
+        print(f"[DB ERROR] Error en update_redemption_status (async): {e}")
+
+# --- FUNCIONES PARA EL LEADERBOARD ---
+async def get_lbucks_leaderboard(limit=10):
+    """Obtiene los usuarios con más LBucks desde la tabla 'users'."""
+    try:
+        supabase = await get_client()
+        response = await supabase.from_('users').select('user_id, lbucks').order('lbucks', desc=True).limit(limit).execute()
+        return [(user['user_id'], user['lbucks']) for user in response.data]
+    except Exception as e:
+        print(f"[DB ERROR] Error en get_lbucks_leaderboard (async): {e}")
+        return []
+
+async def _select_all(table, columns, order_by='user_id', page_size=1000):
+    """Lee todas las filas de una tabla, página a página (PostgREST limita las filas por respuesta).
+
+    Las páginas se ordenan por `order_by` (una clave única): sin orden, Postgres puede
+    devolver las filas en otro orden en cada consulta y una fila saltaría de página.
+    """
+    supabase = await get_client()
+    rows, start = [], 0
+    while True:
+        page = (await supabase.from_(table).select(columns).order(order_by).range(start, start + page_size - 1).execute()).data or []
+        rows.extend(page)
+        if len(page) < page_size:
+            return rows
+        start += page_size
+
+async def get_metric_values(metric):
+    """Devuelve {user_id: valor} de una métrica de ranking para todos los usuarios."""
+    try:
+        table, column = db.METRIC_SOURCES[metric]
+        return {row['user_id']: row[column] or 0 for row in await _select_all(table, f'user_id, {column}')}
+    except Exception as e:
+        print(f"[DB ERROR] Error en get_metric_values (async): {e}")
+        return None
+
+# --- FUNCIONES PARA LA AVENTURA ESPACIAL ---
+async def get_player_profile(user_id):
+    """Obtiene el perfil de aventura de un jugador desde 'adventure_players'."""
+    try:
+        supabase = await get_client()
+        response = await supabase.from_('adventure_players').select('*').eq('user_id', str(user_id)).execute()
+        if not response.data:
+            return None
+        player = response.data[0]
+        player['inventory'] = db.normalize_inventory(player.get('inventory'))
+        return player
+    except Exception as e:
+        print(f"[DB ERROR] Error en get_player_profile (async): {e}")
+        return None
+
+async def create_player_profile(user_id):
+    """Crea un nuevo perfil de aventura para un jugador."""
+    try:
+        supabase = await get_client()
+        await supabase.from_('adventure_players').insert({'user_id': str(user_id)}).execute()
+        print(f"Perfil de aventura creado para el usuario {user_id}")
+    except Exception as e:
+        print(f"[DB ERROR] Error en create_player_profile (async): {e}")
+
+async def update_player_profile(user_id, updates: dict):
+    """Actualiza campos específicos del perfil de un jugador."""
+    try:
+        supabase = await get_client()
+        await supabase.from_('adventure_players').update(updates).eq('user_id', str(user_id)).execute()
+        if 'power_level' in updates:
+            leaderboards.update('power_level', user_id, updates['power_level'])
+    except Exception as e:
+        print(f"[DB ERROR] Error en update_player_profile (async): {e}")
+
+async def get_planet_catalog(refresh=False):
+    """Devuelve los planetas como {planet_id: planeta}, cargándolos con una sola consulta si hace falta."""
+    catalog = None if refresh else db.planet_catalog.get()
+    if catalog is not None:
+        return catalog
+    async with _planet_lock:
+        catalog = None if refresh else db.planet_catalog.get()
+        if catalog is None:
+            supabase = await get_client()
+            response = await supabase.from_('adventure_planets').select('*').execute()
+            catalog = db.planet_catalog.load(response.data or [])
+    return catalog
+
+async def get_planet_by_id(planet_id):
+    """Obtiene la información de un planeta por su ID (desde el catálogo en memoria)."""
+    try:
+        catalog = await get_planet_catalog()
+        if planet_id not in catalog:
+            catalog = await get_planet_catalog(refresh=True)
+        return catalog.get(planet_id)
+    except Exception as e:
+        print(f"[DB ERROR] Error en get_planet_by_id (async): {e}")
+        return None
+
+async def get_explorable_planets(conquered_planet_names):
+    """Elige hasta 3 planetas al azar que el usuario NO ha conquistado, sin consultar la base de datos."""
+    try:
+        await get_planet_catalog()
+        return db.planet_catalog.explorable(conquered_planet_names, k=3)
+    except Exception as e:
+        print(f"[DB ERROR] Error en get_explorable_planets (async): {e}")
+        return []
+
+async def apply_conquest(user_id, planet_name, loot_name, reward, power_reward):
+    """Aplica una victoria en una sola transacción (función apply_conquest).
+
+    Añade el planeta conquistado y una unidad de `loot_name`, y suma `reward` LBucks y
+    `power_reward` de poder. Devuelve un dict con 'status' ('ok', 'not_found' o
+    'already_conquered'), 'balance' y 'power_level'; None si hubo un error.
+    """
+    try:
+        supabase = await get_client()
+        response = await supabase.rpc('apply_conquest', {
+            'p_user_id': str(user_id),
+            'p_planet_name': planet_name,
+            'p_loot_name': loot_name,
+            'p_reward': reward,
+            'p_power_reward': power_reward,
+        }).execute()
+        result = response.data[0]
+        if result['status'] == 'ok':
+            leaderboards.update('lbucks', user_id, result['balance'])
+            leaderboards.update('power_level', user_id, result['power_level'])
+        return result
+    except Exception as e:
+        print(f"[DB ERROR] Error en apply_conquest (async): {e}")
+        return None
+
+async def summarize_inventory(user_id):
+    """Devuelve los materiales del inventario de un jugador como {nombre: cantidad}."""
+    try:
+        player = await get_player_profile(user_id)
+        return player['inventory'] if player else {}
+    except Exception as e:
+        print(f"[DB ERROR] Error en summarize_inventory (async): {e}")
+        return {}
+
+async def adjust_inventory(user_id, changes: dict):
+    """Suma (o resta, con cantidades negativas) materiales de forma atómica.
+
+    Devuelve el inventario resultante, o None si el jugador no existe o no tiene
+    suficientes unidades de algún material (en ese caso no se modifica nada).
+    """
+    try:
+        supabase = await get_client()
+        response = await supabase.rpc('adjust_inventory', {'p_user_id': str(user_id), 'p_changes': changes}).execute()
+        return db.normalize_inventory(response.data) if response.data is not None else None
+    except Exception as e:
+        print(f"[DB ERROR] Error en adjust_inventory (async): {e}")
+        return None
+
+async def remove_materials_from_inventory(user_id, materials_to_remove: dict):
+    """Quita los materiales indicados del inventario solo si el jugador los tiene todos.
+
+    Devuelve el inventario resultante, o None si faltaba algún material.
+    """
+    return await adjust_inventory(user_id, {name: -count for name, count in materials_to_remove.items()})
+
+async def purchase_upgrade(user_id, upgrade_type, upgrade: dict):
+    """Compra la siguiente mejora de nave o estación en una sola transacción (función purchase_upgrade).
+
+    `upgrade` es la entrada de UPGRADE_CATALOG del nivel a comprar. Devuelve un dict con
+    'status' ('ok', 'not_found', 'already_upgraded', 'insufficient_lbucks' o
+    'insufficient_materials'), 'balance' y el perfil resultante (ship_level,
+    station_level, power_level, inventory). None si hubo un error.
+    """
+    try:
+        supabase = await get_client()
+        response = await supabase.rpc('purchase_upgrade', {
+            'p_user_id': str(user_id),
+            'p_upgrade_type': upgrade_type,
+            'p_level': upgrade['level'],
+            'p_cost_lbucks': upgrade['cost_lbucks'],
+            'p_cost_materials': upgrade['cost_materials'],
+            'p_power_increase': upgrade['power_increase'],
+        }).execute()
+        result = response.data[0]
+        result['inventory'] = db.normalize_inventory(result.get('inventory'))
+        if result['status'] == 'ok':
+            leaderboards.update('lbucks', user_id, result['balance'])
+            leaderboards.update('power_level', user_id, result['power_level'])
+        return result
+    except Exception as e:
+        print(f"[DB ERROR] Error en purchase_upgrade (async): {e}")
+        return None
+
+# --- MÉTRICAS Y COLA DE PRIORIDADES ---
+# Cada función pública de acceso a datos se envuelve para medir su latencia
+# (serie lbucks_db_call_duration_seconds, client="async") y para pasar por
+# async_db_gate, que limita las llamadas en vuelo. El trabajo de fondo (progreso de
+# misiones y recargas completas de clasificaciones) es lo primero que se descarta
+# si la base de datos va lenta y la cola crece.
+BACKGROUND_CALLS = {'update_mission_progress', 'apply_message_progress', 'get_metric_values'}
+
+for _name, _fn in list(globals().items()):
+    if (inspect.iscoroutinefunction(_fn) and _fn.__module__ == __name__
+            and not _name.startswith('_') and _name not in ('get_client', 'close')):
+        _priority = PRIORITY_BACKGROUND if _name in BACKGROUND_CALLS else PRIORITY_INTERACTIVE
+        globals()[_name] = async_db_gate.gate(_priority)(metrics.timed_db(_name, 'async')(_fn))
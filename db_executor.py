@@ -0,0 +1,275 @@
+# db_executor.py
+# Pool de hilos propio para las llamadas bloqueantes de database.py. A diferencia
+# de asyncio.to_thread (que comparte el executor por defecto y encola sin límite),
+# aquí la cola tiene prioridades y un tamaño máximo: los comandos interactivos pasan
+# delante del trabajo de fondo, y el trabajo de fondo se descarta si la cola crece.
+# AsyncDBGate aplica las mismas reglas a las llamadas de database_async, que no
+# usan hilos sino el pool de conexiones de httpx.
+import asyncio
+import contextvars
+import functools
+import heapq
+import itertools
+import os
+import threading
+import time
+import metrics
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_BACKGROUND: 'background'}
+
+DB_WORKERS = int(os.getenv("DB_WORKERS", "8"))
+DB_MAX_QUEUE = int(os.getenv("DB_MAX_QUEUE", "500"))
+# A partir de esta profundidad de cola se descarta el trabajo de fondo.
+DB_MAX_BACKGROUND_QUEUE = int(os.getenv("DB_MAX_BACKGROUND_QUEUE", "50"))
+# Llamadas async en vuelo a la vez; por defecto, las conexiones del pool de httpx.
+ASYNC_DB_CONCURRENCY = int(os.getenv("ASYNC_DB_CONCURRENCY", os.getenv("SUPABASE_MAX_CONNECTIONS", "20")))
+
+
+QUEUE_WAIT_SECONDS = metrics.Histogram(
+    'lbucks_db_queue_wait_seconds', "Tiempo en cola antes de que la llamada empiece a ejecutarse.", ('client', 'priority'))
+SHED_CALLS = metrics.Counter(
+    'lbucks_db_shed_calls_total', "Llamadas descartadas por tener la cola llena.", ('client', 'priority'))
+
+
+class DBOverloaded(Exception):
+    """La cola de la base de datos está llena y la llamada se descartó sin ejecutarse."""
+
+
+def _resolve(future, result, error):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class DBExecutor:
+    """Cola con prioridades atendida por `workers` hilos dedicados.
+
+    `await db_executor.run(db.funcion, *args, priority=...)` ejecuta la función en un
+    hilo del pool y devuelve su resultado. Si la cola está por encima del límite de
+    la prioridad pedida, lanza DBOverloaded sin encolar nada.
+    """
+
+    def __init__(self, workers=DB_WORKERS, max_queue=DB_MAX_QUEUE, max_background_queue=DB_MAX_BACKGROUND_QUEUE):
+        self.workers = workers
+        self.limits = {PRIORITY_INTERACTIVE: max_queue, PRIORITY_BACKGROUND: max_background_queue}
+        self._heap = []  # [(prioridad, orden, encolado_en, fn, args, kwargs, loop, future)]
+        self._cond = threading.Condition()
+        self._order = itertools.count()
+        self._threads = []
+        self._busy = 0
+        self._closed = False
+        self._stats = {
+            name: {'submitted': 0, 'completed': 0, 'failed': 0, 'shed': 0, 'cancelled': 0,
+                   'wait_seconds': 0.0, 'max_wait_seconds': 0.0, 'run_seconds': 0.0}
+            for name in PRIORITY_NAMES.values()
+        }
+
+    def _ensure_workers(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"db-worker-{len(self._threads)}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    async def run(self, fn, *args, priority=PRIORITY_INTERACTIVE, **kwargs):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        stats = self._stats[PRIORITY_NAMES[priority]]
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("El executor de la base de datos está cerrado.")
+            # Cuenta todo lo pendiente, también lo de mayor prioridad: es lo que tendrá que esperar.
+            if len(self._heap) >= self.limits[priority]:
+                stats['shed'] += 1
+                SHED_CALLS.inc(client='sync', priority=PRIORITY_NAMES[priority])
+                raise DBOverloaded(f"Cola de la base de datos llena ({len(self._heap)} pendientes); "
+                                   f"se descartó {getattr(fn, '__name__', fn)} ({PRIORITY_NAMES[priority]}).")
+            self._ensure_workers()
+            heapq.heappush(self._heap, (priority, next(self._order), time.monotonic(), fn, args, kwargs, loop, future))
+            stats['submitted'] += 1
+            self._cond.notify()
+        return await future
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._heap and not self._closed:
+                    self._cond.wait()
+                if not self._heap:
+                    return
+                priority, _, enqueued_at, fn, args, kwargs, loop, future = heapq.heappop(self._heap)
+                self._busy += 1
+            stats = self._stats[PRIORITY_NAMES[priority]]
+            started = time.monotonic()
+            result = error = None
+            # Si quien esperaba ya se rindió (p. ej. la tarea fue cancelada), no gastamos una conexión.
+            cancelled = future.cancelled()
+            if not cancelled:
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception as e:
+                    error = e
+            finished = time.monotonic()
+            QUEUE_WAIT_SECONDS.observe(started - enqueued_at, client='sync', priority=PRIORITY_NAMES[priority])
+            if not cancelled:
+                metrics.DB_CALL_SECONDS.observe(finished - started, function=getattr(fn, '__name__', str(fn)), client='sync')
+            with self._cond:
+                self._busy -= 1
+                wait = started - enqueued_at
+                stats['wait_seconds'] += wait
+                stats['max_wait_seconds'] = max(stats['max_wait_seconds'], wait)
+                if cancelled:
+                    stats['cancelled'] += 1
+                    continue
+                stats['run_seconds'] += finished - started
+                stats['failed' if error is not None else 'completed'] += 1
+            try:
+                loop.call_soon_threadsafe(_resolve, future, result, error)
+            except RuntimeError:
+                # El event loop ya se cerró (apagado del bot).
+                pass
+
+    def stats(self):
+        """Profundidad de la cola, hilos ocupados y contadores/tiempos de espera por prioridad."""
+        with self._cond:
+            depth = {name: 0 for name in PRIORITY_NAMES.values()}
+            for entry in self._heap:
+                depth[PRIORITY_NAMES[entry[0]]] += 1
+            return {
+                'workers': self.workers,
+                'busy': self._busy,
+                'depth': len(self._heap),
+                'depth_by_priority': depth,
+                'priorities': {name: dict(values) for name, values in self._stats.items()},
+            }
+
+    def close(self):
+        """Deja de aceptar trabajo; los hilos terminan cuando vacían la cola."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+db_executor = DBExecutor()
+
+
+# True dentro de una llamada que ya tiene hueco en AsyncDBGate: las funciones de
+# database_async que llaman a otras no vuelven a hacer cola (podrían bloquearse
+# esperando un hueco que ocupan ellas mismas).
+_gate_held = contextvars.ContextVar('_gate_held', default=False)
+
+
+class AsyncDBGate:
+    """Límite de llamadas concurrentes a database_async, con prioridades y descarte.
+
+    Como mucho `concurrency` llamadas en vuelo; el resto espera en una cola donde
+    las interactivas pasan delante de las de fondo. Si la cola está por encima del
+    límite de la prioridad pedida, la llamada lanza DBOverloaded sin ejecutarse.
+    `stats()` devuelve lo mismo que DBExecutor.stats() ('workers' son los huecos).
+    """
+
+    def __init__(self, concurrency=ASYNC_DB_CONCURRENCY, max_queue=DB_MAX_QUEUE, max_background_queue=DB_MAX_BACKGROUND_QUEUE):
+        self.concurrency = concurrency
+        self.limits = {PRIORITY_INTERACTIVE: max_queue, PRIORITY_BACKGROUND: max_background_queue}
+        self._waiters = []  # [(prioridad, orden, future)]
+        self._order = itertools.count()
+        self._in_flight = 0
+        self._stats = {
+            name: {'submitted': 0, 'completed': 0, 'failed': 0, 'shed': 0, 'cancelled': 0,
+                   'wait_seconds': 0.0, 'max_wait_seconds': 0.0, 'run_seconds': 0.0}
+            for name in PRIORITY_NAMES.values()
+        }
+
+    async def run(self, fn, *args, priority=PRIORITY_INTERACTIVE, **kwargs):
+        if _gate_held.get():
+            return await fn(*args, **kwargs)
+        name = PRIORITY_NAMES[priority]
+        stats = self._stats[name]
+        enqueued_at = time.monotonic()
+        if self._in_flight < self.concurrency and not self._waiters:
+            self._in_flight += 1
+        else:
+            if len(self._waiters) >= self.limits[priority]:
+                stats['shed'] += 1
+                SHED_CALLS.inc(client='async', priority=name)
+                raise DBOverloaded(f"Cola de la base de datos llena ({len(self._waiters)} pendientes); "
+                                   f"se descartó {getattr(fn, '__name__', fn)} ({name}).")
+            future = asyncio.get_running_loop().create_future()
+            entry = (priority, next(self._order), future)
+            heapq.heappush(self._waiters, entry)
+            try:
+                await future
+            except asyncio.CancelledError:
+                stats['cancelled'] += 1
+                stats['wait_seconds'] += time.monotonic() - enqueued_at
+                if future.cancelled():
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                else:
+                    # Ya nos habían cedido el hueco: pasa a la siguiente llamada.
+                    self._release()
+                raise
+
+        stats['submitted'] += 1
+        wait = time.monotonic() - enqueued_at
+        stats['wait_seconds'] += wait
+        stats['max_wait_seconds'] = max(stats['max_wait_seconds'], wait)
+        QUEUE_WAIT_SECONDS.observe(wait, client='async', priority=name)
+        token = _gate_held.set(True)
+        started = time.monotonic()
+        try:
+            result = await fn(*args, **kwargs)
+            stats['completed'] += 1
+            return result
+        except Exception:
+            stats['failed'] += 1
+            raise
+        finally:
+            _gate_held.reset(token)
+            stats['run_seconds'] += time.monotonic() - started
+            self._release()
+
+    def _release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # El hueco pasa directamente a la siguiente llamada en cola.
+                future.set_result(None)
+                return
+        self._in_flight -= 1
+
+    def gate(self, priority=PRIORITY_INTERACTIVE):
+        """Decorador: cada llamada a la función async pasa por la cola con `priority`."""
+        def decorator(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                return await self.run(fn, *args, priority=priority, **kwargs)
+            return wrapper
+        return decorator
+
+    def stats(self):
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for entry in self._waiters:
+            depth[PRIORITY_NAMES[entry[0]]] += 1
+        return {
+            'workers': self.concurrency,
+            'busy': self._in_flight,
+            'depth': len(self._waiters),
+            'depth_by_priority': depth,
+            'priorities': {name: dict(values) for name, values in self._stats.items()},
+        }
+
+
+async_db_gate = AsyncDBGate()
+
+DB_POOLS = {'sync': db_executor, 'async': async_db_gate}
+
+metrics.Gauge('lbucks_db_queue_depth', "Llamadas en cola para la base de datos.", ('client', 'priority'),
+              callback=lambda: {(client, name): depth for client, pool in DB_POOLS.items()
+                                for name, depth in pool.stats()['depth_by_priority'].items()})
+metrics.Gauge('lbucks_db_workers_busy', "Hilos del pool (sync) o llamadas en vuelo (async) ocupados.", ('client',),
+              callback=lambda: {(client,): pool.stats()['busy'] for client, pool in DB_POOLS.items()})
@@ -0,0 +1,108 @@
+# discord_cache.py
+# Resolución de usuarios y mensajes de Discord priorizando la caché del gateway,
+# para no gastar llamadas REST (y límites de velocidad) en datos que ya tenemos.
+import asyncio
+import discord
+from cache import LRUCache
+
+USER_CACHE_SIZE = 2000
+USER_CACHE_TTL = 3600
+MAX_CONCURRENT_USER_FETCHES = 4
+
+
+class UserResolver:
+    """Busca usuarios por ID: caché del gateway, luego un LRU de usuarios ya pedidos por REST.
+
+    Los fallos se piden a la API en paralelo, con un máximo de `max_concurrency`
+    peticiones simultáneas, y las peticiones repetidas por el mismo usuario se unen
+    en una sola.
+    """
+
+    def __init__(self, bot, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL, max_concurrency=MAX_CONCURRENT_USER_FETCHES):
+        self.bot = bot
+        self._fetched = LRUCache(maxsize, ttl)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._in_flight = {}
+
+    def get_cached(self, user_id: int):
+        """Devuelve el usuario si ya está en memoria (gateway o LRU), sin llamar a la API."""
+        user = self.bot.get_user(user_id)
+        if user is not None:
+            return user
+        for guild in self.bot.guilds:
+            member = guild.get_member(user_id)
+            if member is not None:
+                return member
+        return self._fetched.get(user_id)
+
+    async def fetch(self, user_id: int):
+        """Devuelve el usuario, pidiéndolo a la API solo si no está en caché. None si no existe."""
+        user = self.get_cached(user_id)
+        if user is not None:
+            return user
+        task = self._in_flight.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_remote(user_id))
+            self._in_flight[user_id] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(user_id, None))
+        return await asyncio.shield(task)
+
+    async def _fetch_remote(self, user_id: int):
+        async with self._semaphore:
+            try:
+                user = await self.bot.fetch_user(user_id)
+            except (discord.NotFound, discord.HTTPException):
+                return None
+        self._fetched.set(user_id, user)
+        return user
+
+    async def resolve_many(self, user_ids: list) -> dict:
+        """Resuelve varios usuarios a la vez. Devuelve {user_id: usuario o None}."""
+        unique_ids = list(dict.fromkeys(user_ids))
+        users = await asyncio.gather(*(self.fetch(user_id) for user_id in unique_ids))
+        return dict(zip(unique_ids, users))
+
+
+MESSAGE_AUTHOR_CACHE_SIZE = 50000
+
+
+class MessageAuthorIndex:
+    """Índice message_id -> (author_id, author_is_bot) para no pedir mensajes enteros a la API.
+
+    Se llena con cada mensaje que recibe el bot (`record`). En un fallo se mira la
+    caché de mensajes de la librería y, como último recurso, se pide el mensaje por
+    REST; las consultas simultáneas por el mismo mensaje comparten una sola petición.
+    """
+
+    def __init__(self, bot, maxsize=MESSAGE_AUTHOR_CACHE_SIZE):
+        self.bot = bot
+        self._authors = LRUCache(maxsize)
+        self._in_flight = {}
+
+    def record(self, message):
+        self._authors.set(message.id, (message.author.id, message.author.bot))
+
+    async def get(self, channel_id: int, message_id: int):
+        """Devuelve (author_id, author_is_bot), o None si el mensaje no existe o no es accesible."""
+        author = self._authors.get(message_id)
+        if author is not None:
+            return author
+        message = discord.utils.get(self.bot.cached_messages, id=message_id)
+        if message is not None:
+            self.record(message)
+            return self._authors.get(message_id)
+        task = self._in_flight.get(message_id)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_remote(channel_id, message_id))
+            self._in_flight[message_id] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(message_id, None))
+        return await asyncio.shield(task)
+
+    async def _fetch_remote(self, channel_id: int, message_id: int):
+        channel = self.bot.get_channel(channel_id) or self.bot.get_partial_messageable(channel_id)
+        try:
+            message = await channel.fetch_message(message_id)
+        except (discord.NotFound, discord.Forbidden):
+            return None
+        self.record(message)
+        return self._authors.get(message_id)
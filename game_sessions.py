@@ -0,0 +1,76 @@
+# game_sessions.py
+# Partidas activas por canal con caducidad exacta. Cada partida programa su propio
+# plazo con loop.call_later (el event loop guarda sus temporizadores en un heap),
+# así que no hace falta revisar todas las partidas periódicamente.
+import asyncio
+
+
+class GameSessions:
+    """Diccionario {channel_id: estado} cuyas entradas caducan solas.
+
+    Al crear una partida (`sessions[channel_id] = estado` o `start`) se programa su
+    plazo; al terminarla (`del sessions[channel_id]` o `end`) el temporizador se
+    cancela. Cuando una partida caduca se quita y se ejecuta `on_expire(channel_id, estado)`.
+    """
+
+    def __init__(self, timeout: float, on_expire):
+        self.timeout = timeout
+        self.on_expire = on_expire
+        self._sessions = {}
+        self._timers = {}
+        self._expiry_tasks = set()
+
+    def start(self, channel_id, state, timeout: float = None):
+        """Registra una partida que caduca en `timeout` segundos (por defecto, el de la clase)."""
+        self.end(channel_id)
+        loop = asyncio.get_running_loop()
+        delay = self.timeout if timeout is None else max(0.0, timeout)
+        self._sessions[channel_id] = state
+        self._timers[channel_id] = loop.call_later(delay, self._expire, channel_id, state)
+
+    def end(self, channel_id):
+        """Termina la partida (si existe) y cancela su temporizador. Devuelve su estado."""
+        timer = self._timers.pop(channel_id, None)
+        if timer is not None:
+            timer.cancel()
+        return self._sessions.pop(channel_id, None)
+
+    def remaining(self, channel_id):
+        """Segundos que le quedan a la partida, o None si no existe."""
+        timer = self._timers.get(channel_id)
+        if timer is None:
+            return None
+        return max(0.0, timer.when() - asyncio.get_running_loop().time())
+
+    def _expire(self, channel_id, state):
+        if self._sessions.get(channel_id) is not state:
+            return
+        del self._sessions[channel_id]
+        del self._timers[channel_id]
+        task = asyncio.ensure_future(self.on_expire(channel_id, state))
+        # Guardamos la tarea para que no la recoja el recolector de basura antes de terminar.
+        self._expiry_tasks.add(task)
+        task.add_done_callback(self._expiry_tasks.discard)
+
+    def __setitem__(self, channel_id, state):
+        self.start(channel_id, state)
+
+    def __getitem__(self, channel_id):
+        return self._sessions[channel_id]
+
+    def __delitem__(self, channel_id):
+        if channel_id not in self._sessions:
+            raise KeyError(channel_id)
+        self.end(channel_id)
+
+    def __contains__(self, channel_id):
+        return channel_id in self._sessions
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, channel_id, default=None):
+        return self._sessions.get(channel_id, default)
+
+    def items(self):
+        return self._sessions.items()
@@ -0,0 +1,78 @@
+# invite_tracker.py
+# Seguimiento de invitaciones por servidor para atribuir las entradas de miembros.
+# Los usos se guardan indexados por código y las entradas que llegan juntas (una
+# oleada de una promo o un raid) comparten una sola lectura de guild.invites().
+import asyncio
+import os
+import discord
+
+# Discord tarda unos segundos en reflejar el uso de una invitación; todas las entradas
+# de un servidor dentro de esta ventana se resuelven con la misma lectura.
+INVITE_FETCH_WINDOW = float(os.getenv("INVITE_FETCH_WINDOW", "5"))  # segundos
+
+
+def index_invites(invites):
+    """Convierte una lista de discord.Invite en {código: {'uses', 'inviter_id'}}."""
+    return {
+        invite.code: {'uses': invite.uses or 0, 'inviter_id': invite.inviter.id if invite.inviter else None}
+        for invite in invites
+    }
+
+
+class InviteTracker:
+    """Usos conocidos de las invitaciones de cada servidor y atribución por diferencias.
+
+    `cache` es {guild_id: {código: {'uses', 'inviter_id'}}} y se comparte con el
+    snapshot del estado del bot. Tras cada lectura, cada invitación cuyo contador
+    subió se notifica con `on_invite_used(código, inviter_id, usos_nuevos)`.
+    """
+
+    def __init__(self, cache: dict, on_invite_used, window: float = INVITE_FETCH_WINDOW):
+        self.cache = cache
+        self.on_invite_used = on_invite_used
+        self.window = window
+        self._pending = {}  # {guild_id: tarea de la lectura programada}
+
+    def member_joined(self, guild):
+        """Programa la lectura de invitaciones del servidor, salvo que ya haya una pendiente."""
+        if guild.id not in self._pending:
+            self._pending[guild.id] = asyncio.create_task(self._refresh_after_window(guild))
+
+    async def _refresh_after_window(self, guild):
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            # Una entrada que llegue durante la lectura programa la siguiente; si su uso
+            # ya sale en esta, la siguiente simplemente no verá diferencias.
+            self._pending.pop(guild.id, None)
+        try:
+            invites = index_invites(await guild.invites())
+        except discord.HTTPException as e:
+            print(f"Error al leer las invitaciones de {guild.name}: {e}")
+            return
+
+        known = self.cache.get(guild.id)
+        self.cache[guild.id] = invites
+        if known is None:
+            # Sin lectura anterior no hay con qué comparar: esta pasa a ser la referencia.
+            return
+        for code, invite in invites.items():
+            previous = known.get(code)
+            if previous is None or invite['inviter_id'] is None:
+                continue
+            new_uses = invite['uses'] - previous['uses']
+            if new_uses > 0:
+                try:
+                    await self.on_invite_used(code, invite['inviter_id'], new_uses)
+                except Exception as e:
+                    print(f"Error al procesar la invitación {code}: {e}")
+
+    def invite_created(self, invite):
+        invites = self.cache.get(invite.guild.id) if invite.guild else None
+        if invites is not None:
+            invites[invite.code] = {'uses': invite.uses or 0, 'inviter_id': invite.inviter.id if invite.inviter else None}
+
+    def invite_deleted(self, invite):
+        invites = self.cache.get(invite.guild.id) if invite.guild else None
+        if invites is not None:
+            invites.pop(invite.code, None)
@@ -0,0 +1,117 @@
+# loop_monitor.py
+# Vigilancia del event loop. Una tarea mide continuamente el retraso del loop (cuánto
+# tarda en despertar un sleep corto respecto a lo pedido) y un hilo aparte detecta
+# cuándo el loop lleva bloqueado más del umbral: en ese momento toma una muestra de
+# la pila del hilo del loop y anota qué comando o listener se estaba ejecutando.
+# Los resultados van a /metrics y al comando /admin estado_bucle.
+import asyncio
+import collections
+import os
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+import metrics
+
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.1"))   # segundos entre mediciones
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", "0.25"))   # bloqueo que se considera lento
+LOOP_STALL_HISTORY = int(os.getenv("LOOP_STALL_HISTORY", "20"))           # muestras lentas que se guardan
+STACK_SAMPLE_LIMIT = 25  # frames por muestra
+
+LOOP_LAG_SECONDS = metrics.Histogram(
+    'lbucks_event_loop_lag_seconds', "Retraso del event loop al despertar de un sleep.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+LOOP_STALLS = metrics.Counter(
+    'lbucks_event_loop_stalls_total', "Bloqueos del event loop por encima del umbral.", ('activity',))
+
+
+class LoopMonitor:
+    """Mide el retraso del event loop y captura una muestra de pila en cada bloqueo.
+
+    `start()` se llama desde dentro del loop. Cada bloqueo se guarda en `stalls`
+    como {'at', 'activity', 'duration', 'stack'}; `duration` se completa cuando el
+    loop vuelve a responder.
+    """
+
+    def __init__(self, interval=LOOP_MONITOR_INTERVAL, threshold=LOOP_STALL_THRESHOLD, history=LOOP_STALL_HISTORY):
+        self.interval = interval
+        self.threshold = threshold
+        self.stalls = collections.deque(maxlen=history)
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._lock = threading.Lock()
+        self._loop = None
+        self._loop_thread_id = None
+        self._heartbeat = time.monotonic()
+        self._current_stall = None
+        self._task = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = self._loop.create_task(self._measure(), name="loop-monitor")
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _measure(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - started - self.interval)
+            self._heartbeat = now
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            LOOP_LAG_SECONDS.observe(lag)
+            if self._current_stall is not None:
+                # El watchdog capturó este bloqueo; ya sabemos cuánto duró.
+                with self._lock:
+                    self._current_stall['duration'] = lag
+                    self._current_stall = None
+
+    def _watch(self):
+        # Revisamos dos veces por intervalo para no llegar tarde al umbral.
+        while not self._stopped.wait(self.interval / 2):
+            blocked = time.monotonic() - self._heartbeat - self.interval
+            if blocked < self.threshold or self._current_stall is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = traceback.format_stack(frame, limit=STACK_SAMPLE_LIMIT) if frame is not None else []
+            activity = self._current_activity()
+            stall = {'at': datetime.now(), 'activity': activity, 'duration': None, 'stack': ''.join(stack)}
+            with self._lock:
+                self._current_stall = stall
+                self.stalls.append(stall)
+            LOOP_STALLS.inc(activity=activity)
+            print(f"[LOOP] Event loop bloqueado más de {blocked:.2f}s en {activity}")
+
+    def _current_activity(self):
+        # Mientras el loop está bloqueado, la tarea "actual" es la que lo bloquea.
+        task = asyncio.current_task(self._loop)
+        if task is None:
+            return 'callback'
+        return metrics.task_activity(task) or task.get_name()
+
+    def recent_stalls(self, limit=None):
+        with self._lock:
+            stalls = [dict(stall) for stall in self.stalls]
+        return stalls[-limit:] if limit else stalls
+
+
+loop_monitor = LoopMonitor()
+
+metrics.Gauge('lbucks_event_loop_lag_max_seconds', "Mayor retraso del event loop desde el arranque.",
+              callback=lambda: loop_monitor.max_lag)
@@ -0,0 +1,247 @@
+# metrics.py
+# Métricas del bot en el formato de texto de Prometheus, sin dependencias externas.
+# Las series se registran al importar cada módulo y el endpoint /metrics del servidor
+# web devuelve `registry.render()`. Todo es seguro entre hilos: los hilos del pool de
+# la base de datos y el watchdog del event loop también las usan.
+import asyncio
+import functools
+import math
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isnan(value):
+            return 'NaN'
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            try:
+                for suffix, labels, value in metric.samples():
+                    lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+            except Exception as e:
+                # Una métrica con callback roto no debe tumbar todo el endpoint.
+                lines.append(f"# ERROR {metric.name}: {_escape(e)}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class _Metric:
+    type = 'untyped'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        registry.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key):
+        return list(zip(self.labelnames, key))
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield '_total' if not self.name.endswith('_total') else '', self._labels(key), value
+
+
+class Gauge(_Metric):
+    """Gauge con valor fijado (`set`) o calculado al leerlo (`callback`).
+
+    El callback devuelve un número, o {tupla_de_etiquetas: número} si hay etiquetas.
+    """
+    type = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), callback=None):
+        super().__init__(name, help, labelnames)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self):
+        if self.callback is not None:
+            result = self.callback()
+            items = result.items() if isinstance(result, dict) else [((), result)]
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        for key, value in items:
+            yield '', self._labels(key), float(value)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, **labels):
+        """Context manager que observa la duración del bloque."""
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        for key, (counts, total, count) in items:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield '_bucket', labels + [('le', _format_value(float(bound)))], cumulative
+            yield '_bucket', labels + [('le', '+Inf')], count
+            yield '_sum', labels, total
+            yield '_count', labels, count
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+# --- SERIES DEL BOT ---
+DB_CALL_SECONDS = Histogram(
+    'lbucks_db_call_duration_seconds', "Duración de las llamadas a la base de datos por función.", ('function', 'client'))
+COMMAND_SECONDS = Histogram(
+    'lbucks_command_duration_seconds', "Duración de los comandos slash.", ('command',))
+COMMAND_ERRORS = Counter(
+    'lbucks_command_errors_total', "Comandos slash que terminaron con error.", ('command',))
+LISTENER_SECONDS = Histogram(
+    'lbucks_listener_duration_seconds', "Duración de los listeners de eventos.", ('listener',))
+LISTENER_ERRORS = Counter(
+    'lbucks_listener_errors_total', "Listeners de eventos que terminaron con error.", ('listener',))
+
+
+# Qué comando o listener está ejecutando cada tarea; loop_monitor lo consulta desde
+# su hilo para saber a quién culpar cuando el event loop se bloquea.
+_task_activity = {}
+
+
+class activity:
+    """Context manager que asocia la tarea actual con un nombre (comando o listener)."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        try:
+            self.task = asyncio.current_task()
+        except RuntimeError:
+            self.task = None
+        if self.task is not None:
+            self.previous = _task_activity.get(self.task)
+            _task_activity[self.task] = self.name
+        return self
+
+    def __exit__(self, *exc):
+        if self.task is not None:
+            if self.previous is None:
+                _task_activity.pop(self.task, None)
+            else:
+                _task_activity[self.task] = self.previous
+        return False
+
+
+def task_activity(task):
+    return _task_activity.get(task)
+
+
+def timed_db(function_name, client):
+    """Decorador para funciones async de acceso a datos: mide su duración en DB_CALL_SECONDS."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with DB_CALL_SECONDS.time(function=function_name, client=client):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def track_listener(listener_name):
+    """Decorador para listeners de Discord: mide su duración y cuenta sus errores."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                with activity(listener_name):
+                    return await fn(*args, **kwargs)
+            except Exception:
+                LISTENER_ERRORS.inc(listener=listener_name)
+                raise
+            finally:
+                LISTENER_SECONDS.observe(time.perf_counter() - started, listener=listener_name)
+        return wrapper
+    return decorator
@@ -0,0 +1,242 @@
+# ranking.py
+# Clasificaciones en memoria por métrica (LBucks, poder, invitaciones, misiones).
+# Se cargan una vez desde la base de datos y después se actualizan de forma
+# incremental cada vez que database.py / database_async.py cambian un valor.
+import random
+import threading
+
+METRICS = {
+    'lbucks': "LBucks",
+    'power_level': "Poder de Combate",
+    'invites': "Invitaciones",
+    'missions': "Misiones Completadas",
+}
+
+
+class _Node:
+    __slots__ = ('key', 'priority', 'left', 'right', 'size')
+
+    def __init__(self, key):
+        self.key = key
+        self.priority = random.random()
+        self.left = None
+        self.right = None
+        self.size = 1
+
+
+def _size(node):
+    return node.size if node is not None else 0
+
+
+def _resize(node):
+    node.size = 1 + _size(node.left) + _size(node.right)
+
+
+def _split(node, key):
+    """Divide el árbol en (claves < key, claves >= key)."""
+    if node is None:
+        return None, None
+    if node.key < key:
+        left, right = _split(node.right, key)
+        node.right = left
+        _resize(node)
+        return node, right
+    left, right = _split(node.left, key)
+    node.left = right
+    _resize(node)
+    return left, node
+
+
+def _merge(left, right):
+    """Une dos árboles donde todas las claves de `left` son menores que las de `right`."""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        _resize(left)
+        return left
+    right.left = _merge(left, right.left)
+    _resize(right)
+    return right
+
+
+def _build(values):
+    """Treap completo para {user_id: valor}, construido de una vez.
+
+    Ordena las claves y arma el árbol con una pila sobre la rama derecha: O(n log n)
+    por la ordenación y O(n) el resto, sin los n inserts de uno en uno. No toca
+    ningún estado compartido, así que se puede llamar fuera del event loop.
+    """
+    values = {str(user_id): value or 0 for user_id, value in values.items()}
+    nodes = sorted((_Node((-value, user_id)) for user_id, value in values.items()), key=lambda n: n.key)
+    spine = []
+    for node in nodes:
+        last = None
+        while spine and spine[-1].priority < node.priority:
+            last = spine.pop()
+        node.left = last
+        if spine:
+            spine[-1].right = node
+        spine.append(node)
+    root = spine[0] if spine else None
+    # Tamaños de abajo arriba: el preorden invertido visita los hijos antes que el padre.
+    preorder, todo = [], [root] if root is not None else []
+    while todo:
+        node = todo.pop()
+        preorder.append(node)
+        todo.extend(child for child in (node.left, node.right) if child is not None)
+    for node in reversed(preorder):
+        _resize(node)
+    return root, values
+
+
+def _remove(node, key):
+    if node is None:
+        return None
+    if key == node.key:
+        return _merge(node.left, node.right)
+    if key < node.key:
+        node.left = _remove(node.left, key)
+    else:
+        node.right = _remove(node.right, key)
+    _resize(node)
+    return node
+
+
+class Leaderboard:
+    """Clasificación de una métrica sobre un treap con tamaños de subárbol.
+
+    Las claves son (-valor, user_id), así que el recorrido en orden va de mayor a
+    menor valor. Insertar, borrar y calcular el puesto de un usuario cuestan
+    O(log n) esperado; el top-K cuesta O(K + log n).
+
+    Una recarga desde la base de datos tarda varias consultas. Entre
+    `begin_reseed()` e `install()` los cambios se anotan en un diario y se vuelven a
+    aplicar sobre el árbol nuevo, para que los datos leídos antes no los pisen.
+    """
+
+    build = staticmethod(_build)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._root = None
+        self._values = {}
+        self._journal = None  # [(operación, user_id, valor)] durante una recarga
+        self.seeded = False
+
+    @property
+    def reseeding(self):
+        return self._journal is not None
+
+    def begin_reseed(self):
+        with self._lock:
+            self._journal = []
+
+    def cancel_reseed(self):
+        with self._lock:
+            self._journal = None
+
+    def install(self, built):
+        """Sustituye el árbol por uno de `build()` y reaplica los cambios anotados desde begin_reseed()."""
+        root, values = built
+        with self._lock:
+            self._root, self._values = root, values
+            for operation, user_id, value in self._journal or []:
+                if operation == 'set':
+                    self._set(user_id, value)
+                else:
+                    self._set(user_id, self._values.get(user_id, 0) + value)
+            self._journal = None
+            self.seeded = True
+
+    def seed(self, values: dict):
+        """Reemplaza el contenido completo con {user_id: valor}."""
+        self.install(_build(values))
+
+    def _set(self, user_id, value):
+        old = self._values.get(user_id)
+        if old is not None:
+            self._root = _remove(self._root, (-old, user_id))
+        self._values[user_id] = value
+        left, right = _split(self._root, (-value, user_id))
+        self._root = _merge(_merge(left, _Node((-value, user_id))), right)
+
+    def set(self, user_id, value):
+        if value is None:
+            return
+        with self._lock:
+            user_id = str(user_id)
+            if self._journal is not None:
+                self._journal.append(('set', user_id, value))
+            if self.seeded:
+                self._set(user_id, value)
+
+    def increment(self, user_id, delta):
+        with self._lock:
+            user_id = str(user_id)
+            if self._journal is not None:
+                self._journal.append(('increment', user_id, delta))
+            if self.seeded:
+                self._set(user_id, self._values.get(user_id, 0) + delta)
+
+    def get(self, user_id):
+        return self._values.get(str(user_id))
+
+    def rank(self, user_id):
+        """Puesto del usuario (1 = primero; los empates comparten puesto), o None si no figura."""
+        with self._lock:
+            value = self._values.get(str(user_id))
+            if value is None:
+                return None
+            # (-valor, '') es menor que cualquier clave con ese valor: contamos solo a los que tienen más.
+            key = (-value, '')
+            node, ahead = self._root, 0
+            while node is not None:
+                if node.key < key:
+                    ahead += _size(node.left) + 1
+                    node = node.right
+                else:
+                    node = node.left
+            return ahead + 1
+
+    def top(self, k):
+        """Los `k` primeros como [(user_id, valor)], de mayor a menor."""
+        with self._lock:
+            result, stack, node = [], [], self._root
+            while (stack or node is not None) and len(result) < k:
+                while node is not None:
+                    stack.append(node)
+                    node = node.left
+                node = stack.pop()
+                result.append((node.key[1], -node.key[0]))
+                node = node.right
+            return result
+
+    def __len__(self):
+        return len(self._values)
+
+
+class Leaderboards:
+    """Una Leaderboard por métrica. Las actualizaciones previas a la carga inicial se
+    ignoran, salvo las que llegan mientras esa carga está en curso."""
+
+    def __init__(self, metrics=METRICS):
+        self.boards = {metric: Leaderboard() for metric in metrics}
+
+    def __getitem__(self, metric):
+        return self.boards[metric]
+
+    def update(self, metric, user_id, value):
+        board = self.boards[metric]
+        if board.seeded or board.reseeding:
+            board.set(user_id, value)
+
+    def increment(self, metric, user_id, delta):
+        board = self.boards[metric]
+        if board.seeded or board.reseeding:
+            board.increment(user_id, delta)
+
+
+leaderboards = Leaderboards()
@@ -0,0 +1,78 @@
+# redemptions.py
+# Motor de canjeos de la tienda. Mientras la vista de confirmación está abierta, el
+# usuario tiene una unidad reservada; al confirmar, el cobro, el descuento de stock y
+# el registro del canjeo se hacen en una sola transacción (función redeem_item).
+import itertools
+import time
+import database_async as adb
+from db_executor import DBOverloaded
+
+# Un poco más que el timeout de ConfirmCancelView, por si on_timeout no llega a ejecutarse.
+RESERVATION_TTL = 90
+
+
+class RedemptionEngine:
+    """Reservas de stock en memoria y confirmación transaccional de canjeos.
+
+    Las reservas solo evitan ofrecer a otros usuarios unidades que alguien está a
+    punto de canjear; la comprobación definitiva del stock la hace la base de datos
+    al confirmar.
+    """
+
+    def __init__(self, ttl=RESERVATION_TTL):
+        self.ttl = ttl
+        self._reservations = {}  # {token: (item_id, user_id, caduca_en)}
+        self._tokens = itertools.count(1)
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        for token, (_, _, expires_at) in list(self._reservations.items()):
+            if expires_at <= now:
+                del self._reservations[token]
+
+    def reserved(self, item_id):
+        self._purge_expired()
+        return sum(1 for reserved_item, _, _ in self._reservations.values() if reserved_item == item_id)
+
+    def available(self, item_id, stock):
+        """Unidades que todavía se pueden ofrecer, descontando las reservadas."""
+        return stock - self.reserved(item_id)
+
+    def reserve(self, user_id, item_id, stock):
+        """Reserva una unidad del ítem. Devuelve el token de la reserva, o None si no quedan libres."""
+        # Si el usuario vuelve a abrir el mismo ítem, su reserva anterior deja de contar.
+        for token, (reserved_item, reserved_user, _) in list(self._reservations.items()):
+            if reserved_item == item_id and reserved_user == user_id:
+                del self._reservations[token]
+        if self.available(item_id, stock) <= 0:
+            return None
+        token = next(self._tokens)
+        self._reservations[token] = (item_id, user_id, time.monotonic() + self.ttl)
+        return token
+
+    def release(self, token):
+        """Libera una reserva. Es seguro llamarlo más de una vez."""
+        self._reservations.pop(token, None)
+
+    async def confirm(self, token, user_id, item_id):
+        """Consume la reserva y ejecuta el canjeo en la base de datos.
+
+        Devuelve el resultado de adb.redeem_item, {'status': 'reservation_expired'} si
+        la reserva ya no existe (caducó o ya se confirmó, p. ej. por un doble clic), o
+        {'status': 'overloaded'} si la base de datos descartó la llamada; en ese caso la
+        reserva se conserva para poder reintentar.
+        """
+        # Sacamos la reserva antes del primer await: un segundo confirm con el mismo
+        # token ya no la encuentra y no puede cobrar dos veces.
+        reservation = self._reservations.pop(token, None)
+        if reservation is None or reservation[2] <= time.monotonic():
+            return {'status': 'reservation_expired'}
+        try:
+            return await adb.redeem_item(user_id, item_id)
+        except DBOverloaded:
+            # La llamada no llegó a ejecutarse: nada se cobró y la reserva vuelve a su sitio.
+            self._reservations[token] = reservation
+            return {'status': 'overloaded'}
+
+
+redemption_engine = RedemptionEngine()
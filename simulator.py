@@ -0,0 +1,230 @@
+# simulator.py
+# Simulador Monte-Carlo del balance de la aventura espacial. Usa las mismas reglas
+# que el bot (adventure.py), evaluadas con NumPy sobre todos los jugadores a la vez,
+# para estimar tasas de victoria, LBucks que entran a la economía y materiales
+# acumulados por jugador y día, incluyendo la compra de mejoras (UPGRADE_CATALOG).
+#
+# numpy no es dependencia del bot; solo hace falta para el simulador:
+#     pip install numpy
+#     python simulator.py --players 1000000 --days 30 --explorations-per-day 5
+import argparse
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from adventure import (
+    CONQUEST_POWER_REWARD, DIFFICULTY_MULTIPLIER, LOOT_TABLE, UPGRADE_CATALOG,
+    draw_loot_index, draw_planet_power, win_chance,
+)
+
+DIFFICULTIES = list(DIFFICULTY_MULTIPLIER)
+MATERIALS = [item['name'] for difficulty in DIFFICULTIES for item in LOOT_TABLE[difficulty]]
+MATERIAL_INDEX = {name: i for i, name in enumerate(MATERIALS)}
+
+# Las recompensas reales están en adventure_planets.reward_lbucks; estos valores son
+# solo un punto de partida y se pueden cambiar con --rewards.
+DEFAULT_REWARDS = {'Fácil': 15, 'Intermedio': 30, 'Difícil': 60}
+# Los 30 nombres de PLANET_NAMES repartidos entre las tres dificultades.
+DEFAULT_PLANETS_PER_DIFFICULTY = 10
+STRATEGIES = ('random', 'easiest', 'hardest')
+
+
+def _as_int(values):
+    return values.astype(np.int64)
+
+
+def _pick_difficulty(rng, remaining, strategy):
+    """Dificultad elegida por cada jugador según los planetas que le quedan por conquistar.
+
+    'random' equivale a elegir uno de los planetas ofrecidos al azar (proporcional a
+    los que quedan de cada dificultad); 'easiest' y 'hardest' eligen el más fácil o el
+    más difícil de 3 planetas ofrecidos.
+    """
+    cumulative = remaining.cumsum(axis=1)
+    total = cumulative[:, -1]
+
+    def draw():
+        r = rng.random(len(remaining)) * total
+        return (r[:, None] >= cumulative).sum(axis=1)
+
+    if strategy == 'random':
+        return draw()
+    draws = np.stack([draw() for _ in range(3)])
+    return draws.min(axis=0) if strategy == 'easiest' else draws.max(axis=0)
+
+
+def _buy_upgrades(state, totals):
+    """Cada jugador compra todas las mejoras que puede pagar, en el orden del catálogo."""
+    for upgrade_type, catalog in UPGRADE_CATALOG.items():
+        levels = state['levels'][upgrade_type]
+        for upgrade in catalog['upgrades']:
+            can_buy = (levels == upgrade['level'] - 1) & (state['lbucks'] >= upgrade['cost_lbucks'])
+            for material, required in upgrade['cost_materials'].items():
+                can_buy &= state['materials'][:, MATERIAL_INDEX[material]] >= required
+            buyers = np.flatnonzero(can_buy)
+            if buyers.size == 0:
+                continue
+            state['lbucks'][buyers] -= upgrade['cost_lbucks']
+            for material, required in upgrade['cost_materials'].items():
+                state['materials'][buyers, MATERIAL_INDEX[material]] -= required
+                totals['materials_spent'][MATERIAL_INDEX[material]] += required * buyers.size
+            state['power'][buyers] += upgrade['power_increase']
+            levels[buyers] = upgrade['level']
+            totals['lbucks_spent'] += upgrade['cost_lbucks'] * buyers.size
+            key = f"{catalog['name']} nivel {upgrade['level']}"
+            totals['upgrades'][key] = totals['upgrades'].get(key, 0) + buyers.size
+
+
+def simulate_chunk(rng, players, args, rewards):
+    """Simula `players` jugadores durante args.days días. Devuelve (totales, poder final)."""
+    n_difficulties = len(DIFFICULTIES)
+    multiplier = np.array([DIFFICULTY_MULTIPLIER[d] for d in DIFFICULTIES])
+    reward = np.array([rewards[d] for d in DIFFICULTIES], dtype=np.int64)
+    loot_count = np.array([len(LOOT_TABLE[d]) for d in DIFFICULTIES])
+    loot_offset = np.concatenate(([0], np.cumsum(loot_count)[:-1]))
+
+    state = {
+        'power': np.full(players, args.start_power, dtype=np.float64),
+        'lbucks': np.zeros(players, dtype=np.int64),
+        'materials': np.zeros((players, len(MATERIALS)), dtype=np.int32),
+        'remaining': np.full((players, n_difficulties), args.planets_per_difficulty, dtype=np.int32),
+        'levels': {upgrade_type: np.ones(players, dtype=np.int8) for upgrade_type in UPGRADE_CATALOG},
+    }
+    totals = {
+        'attempts': np.zeros(n_difficulties, dtype=np.int64),
+        'wins': np.zeros(n_difficulties, dtype=np.int64),
+        'lbucks_earned': 0,
+        'lbucks_spent': 0,
+        'materials_earned': np.zeros(len(MATERIALS), dtype=np.int64),
+        'materials_spent': np.zeros(len(MATERIALS), dtype=np.int64),
+        'upgrades': {},
+    }
+
+    for _ in range(args.days):
+        state['lbucks'] += args.daily_income
+        totals['lbucks_earned'] += args.daily_income * players
+        for _ in range(args.explorations_per_day):
+            # Los jugadores que ya conquistaron toda la galaxia dejan de explorar.
+            active = np.flatnonzero(state['remaining'].sum(axis=1) > 0)
+            if active.size == 0:
+                break
+            difficulty = _pick_difficulty(rng, state['remaining'][active], args.strategy)
+            planet_power = draw_planet_power(rng, multiplier[difficulty], size=active.size, to_int=_as_int)
+            chance = win_chance(state['power'][active], planet_power, clip=np.minimum)
+            won = rng.random(active.size) < chance
+
+            winners, won_difficulty = active[won], difficulty[won]
+            loot = loot_offset[won_difficulty] + draw_loot_index(rng, loot_count[won_difficulty], size=winners.size, to_int=_as_int)
+            # Cada jugador aparece una sola vez en `winners`, así que la suma con índices es segura.
+            state['lbucks'][winners] += reward[won_difficulty]
+            state['materials'][winners, loot] += 1
+            state['power'][winners] += CONQUEST_POWER_REWARD
+            state['remaining'][winners, won_difficulty] -= 1
+
+            totals['attempts'] += np.bincount(difficulty, minlength=n_difficulties)
+            totals['wins'] += np.bincount(won_difficulty, minlength=n_difficulties)
+            totals['lbucks_earned'] += int(reward[won_difficulty].sum())
+            totals['materials_earned'] += np.bincount(loot, minlength=len(MATERIALS))
+            _buy_upgrades(state, totals)
+
+    totals['galaxy_completed'] = int((state['remaining'].sum(axis=1) == 0).sum())
+    totals['levels'] = {
+        UPGRADE_CATALOG[t]['name']: np.bincount(levels, minlength=len(UPGRADE_CATALOG[t]['upgrades']) + 2)[1:]
+        for t, levels in state['levels'].items()
+    }
+    return totals, state['power']
+
+
+def merge_totals(total, chunk):
+    if total is None:
+        return chunk
+    for key, value in chunk.items():
+        if key in ('upgrades',):
+            for name, count in value.items():
+                total[key][name] = total[key].get(name, 0) + count
+        elif key == 'levels':
+            for name, counts in value.items():
+                total[key][name] = total[key][name] + counts
+        else:
+            total[key] = total[key] + value
+    return total
+
+
+def print_report(totals, final_power, args, elapsed):
+    player_days = args.players * args.days
+    explorations = int(totals['attempts'].sum())
+    print(f"Simulación: {args.players:,} jugadores x {args.days} días, {args.explorations_per_day} exploraciones/día, "
+          f"estrategia '{args.strategy}' ({explorations:,} combates en {elapsed:.2f}s)\n")
+
+    print("Tasa de victoria")
+    overall = totals['wins'].sum() / explorations if explorations else 0.0
+    print(f"  {'Total':<12} {overall:7.2%}  ({explorations:,} combates)")
+    for i, difficulty in enumerate(DIFFICULTIES):
+        attempts = totals['attempts'][i]
+        rate = totals['wins'][i] / attempts if attempts else 0.0
+        print(f"  {difficulty:<12} {rate:7.2%}  ({attempts:,} combates)")
+
+    print("\nLBucks por jugador y día")
+    print(f"  Ganados:  {totals['lbucks_earned'] / player_days:10.2f}")
+    print(f"  Gastados: {totals['lbucks_spent'] / player_days:10.2f}  (mejoras)")
+
+    print("\nMateriales por jugador y día (obtenidos / gastados)")
+    for i, material in enumerate(MATERIALS):
+        print(f"  {material:<36} {totals['materials_earned'][i] / player_days:8.3f} / {totals['materials_spent'][i] / player_days:8.3f}")
+
+    print("\nMejoras compradas (% de jugadores)")
+    for name, count in sorted(totals['upgrades'].items()):
+        print(f"  {name:<20} {count / args.players:7.2%}")
+    for name, counts in totals['levels'].items():
+        distribution = ", ".join(f"nivel {level}: {count / args.players:.1%}" for level, count in enumerate(counts, start=1) if count)
+        print(f"  {name} al final: {distribution}")
+
+    p10, p50, p90 = np.percentile(final_power, [10, 50, 90])
+    print(f"\nPoder final: media {final_power.mean():.1f}, p10 {p10:.0f}, p50 {p50:.0f}, p90 {p90:.0f}")
+    print(f"Galaxia completa: {totals['galaxy_completed'] / args.players:.2%} de los jugadores")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Simulador Monte-Carlo del balance de la aventura espacial.")
+    parser.add_argument('--players', type=int, default=200_000, help="jugadores simulados")
+    parser.add_argument('--days', type=int, default=30, help="días simulados")
+    parser.add_argument('--explorations-per-day', type=int, default=5, help="combates por jugador y día")
+    parser.add_argument('--start-power', type=float, default=10, help="poder inicial (adventure_players.power_level por defecto)")
+    parser.add_argument('--daily-income', type=int, default=0, help="LBucks extra por día (p. ej. /daily), para modelar la compra de mejoras")
+    parser.add_argument('--rewards', default=",".join(str(DEFAULT_REWARDS[d]) for d in DIFFICULTIES),
+                        help=f"recompensa en LBucks por dificultad ({', '.join(DIFFICULTIES)})")
+    parser.add_argument('--planets-per-difficulty', type=int, default=DEFAULT_PLANETS_PER_DIFFICULTY)
+    parser.add_argument('--strategy', choices=STRATEGIES, default='random', help="cómo elige planeta el jugador")
+    parser.add_argument('--chunk', type=int, default=250_000, help="jugadores por bloque (limita la memoria)")
+    parser.add_argument('--seed', type=int, default=None)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    if np is None:
+        print("El simulador necesita numpy: pip install numpy", file=sys.stderr)
+        return 1
+    args = parse_args(argv)
+    values = [int(value) for value in args.rewards.split(',')]
+    if len(values) != len(DIFFICULTIES):
+        print(f"--rewards necesita {len(DIFFICULTIES)} valores separados por comas", file=sys.stderr)
+        return 1
+    rewards = dict(zip(DIFFICULTIES, values))
+
+    rng = np.random.default_rng(args.seed)
+    started = time.perf_counter()
+    totals, powers = None, []
+    for start in range(0, args.players, args.chunk):
+        chunk_totals, final_power = simulate_chunk(rng, min(args.chunk, args.players - start), args, rewards)
+        totals = merge_totals(totals, chunk_totals)
+        powers.append(final_power)
+    print_report(totals, np.concatenate(powers), args, time.perf_counter() - started)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+# state_snapshot.py
+# Persistencia local del estado en memoria del bot (partidas, sesiones de voz,
+# invitaciones) para que un reinicio no lo pierda. bot.py decide qué se guarda;
+# aquí solo se escribe y se lee el archivo.
+import json
+import os
+import time
+
+STATE_SNAPSHOT_PATH = os.getenv("STATE_SNAPSHOT_PATH", "runtime_state.json")
+STATE_SNAPSHOT_INTERVAL = int(os.getenv("STATE_SNAPSHOT_INTERVAL", "30"))  # segundos
+
+_last_written = None
+
+
+def write_snapshot(state: dict, path: str = STATE_SNAPSHOT_PATH) -> bool:
+    """Escribe el estado como JSON compacto. Es bloqueante: llamarlo con asyncio.to_thread.
+
+    Se escribe a un archivo temporal y se renombra encima del anterior, así que un
+    corte a mitad de escritura nunca deja un snapshot a medias. Si el contenido no
+    cambió desde la última escritura no se toca el disco. Devuelve True si escribió.
+    """
+    global _last_written
+    payload = json.dumps({'saved_at': time.time(), 'state': state}, separators=(',', ':'))
+    # saved_at cambia siempre; comparamos solo el estado.
+    body = payload[payload.index('"state":'):]
+    if body == _last_written:
+        return False
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+        _last_written = body
+        return True
+    except OSError as e:
+        print(f"[SNAPSHOT ERROR] Error al escribir {path}: {e}")
+        return False
+
+
+def read_snapshot(path: str = STATE_SNAPSHOT_PATH):
+    """Devuelve (estado, antigüedad_en_segundos), o (None, None) si no hay snapshot válido."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data['state'], max(0.0, time.time() - data['saved_at'])
+    except FileNotFoundError:
+        return None, None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"[SNAPSHOT ERROR] Snapshot inválido en {path}: {e}")
+        return None, None
@@ -0,0 +1,483 @@
+-- supabase_functions.sql
+-- Funciones de Postgres que el bot llama vía RPC (supabase.rpc(...)).
+-- Igual que las tablas, deben crearse desde el editor SQL del panel de Supabase.
+-- El archivo es idempotente: se puede volver a ejecutar completo tras cada cambio.
+
+-- --- CAMBIOS DE ESQUEMA ---
+-- Precio pagado en cada canjeo (para reembolsar lo mismo aunque el precio cambie)
+-- y message_id opcional: el canjeo se crea antes de enviar el mensaje al canal de logs.
+alter table redemptions add column if not exists price bigint;
+alter table redemptions alter column message_id drop not null;
+-- Contador de misiones completadas por usuario (para la clasificación de misiones).
+alter table users add column if not exists missions_completed integer not null default 0;
+-- Contador de invitaciones por usuario, mantenido por claim_invite_reward. La
+-- sentencia siguiente lo sincroniza con la tabla 'invites' (sirve de carga inicial).
+alter table users add column if not exists invite_count integer not null default 0;
+insert into users (user_id, lbucks, invite_count)
+select i.inviter_id, 0, count(*)
+  from invites i
+ group by i.inviter_id
+on conflict (user_id) do update set invite_count = excluded.invite_count
+ where users.invite_count <> excluded.invite_count;
+
+-- Inventario de aventura como {"nombre": cantidad} en vez de una lista con un
+-- elemento por objeto. inventory_counts convierte el formato antiguo.
+create or replace function inventory_counts(p_inventory jsonb)
+returns jsonb
+language sql
+immutable
+as $$
+    select case jsonb_typeof(p_inventory)
+        when 'object' then p_inventory
+        when 'array' then coalesce((
+            select jsonb_object_agg(counts.name, counts.n)
+              from (select item->>'name' as name, count(*) as n
+                      from jsonb_array_elements(p_inventory) as item
+                     where item->>'name' is not null
+                     group by item->>'name') counts
+        ), '{}'::jsonb)
+        else '{}'::jsonb
+    end;
+$$;
+
+update adventure_players
+   set inventory = inventory_counts(inventory)
+ where inventory is null or jsonb_typeof(inventory) <> 'object';
+alter table adventure_players alter column inventory set default '{}'::jsonb;
+-- debit_lbucks ya no se usa: donaciones, canjeos y mejoras cobran dentro de su propia función.
+drop function if exists debit_lbucks(text, bigint);
+
+-- --- MISIONES: PROGRESO DE MENSAJES EN LOTE ---
+-- Lotes ya aplicados, para que un reintento (p. ej. tras perder la respuesta por un
+-- timeout) no sume dos veces los mismos mensajes. Se conservan dos días.
+create table if not exists message_progress_batches (
+    batch_id uuid primary key,
+    applied_at timestamptz not null default now()
+);
+
+-- Recibe [{"user_id": "...", "count": n}, ...] y aplica todo el lote en una sola
+-- transacción, salvo que p_batch_id ya esté registrado (entonces no hace nada y no
+-- devuelve filas). La condición is_completed = false hace que cada misión pase a
+-- completada (y pague su recompensa) una única vez.
+-- Devuelve todas las filas actualizadas para que el bot refresque su caché.
+drop function if exists apply_message_progress(jsonb, date);
+create or replace function apply_message_progress(p_batch jsonb, p_date date, p_batch_id uuid)
+returns table (id bigint, user_id text, progress integer, is_completed boolean, description text, reward integer)
+language sql
+as $$
+    with expired as (
+        delete from message_progress_batches
+         where applied_at < now() - interval '2 days'
+    ),
+    claimed as (
+        -- Si otro intento con el mismo id ya se confirmó, no se inserta nada y el lote se ignora.
+        insert into message_progress_batches (batch_id)
+        values (p_batch_id)
+        on conflict (batch_id) do nothing
+        returning batch_id
+    ),
+    batch as (
+        select b.user_id, sum(b.count)::integer as count
+        from jsonb_to_recordset(p_batch) as b(user_id text, count integer)
+        where exists (select 1 from claimed)
+        group by b.user_id
+    ),
+    updated as (
+        update user_missions um
+           set progress = um.progress + batch.count,
+               is_completed = um.progress + batch.count >= m.target_value
+          from batch, missions m
+         where um.user_id = batch.user_id
+           and um.assigned_date = p_date
+           and um.is_completed = false
+           and m.mission_id = um.mission_id
+           and m.mission_type = 'message_count'
+           and coalesce(m.trigger_value, '') = ''
+        returning um.id, um.user_id, um.progress, um.is_completed, m.description, m.reward
+    ),
+    paid as (
+        insert into users (user_id, lbucks, missions_completed)
+        select u.user_id, sum(u.reward), count(*)
+          from updated u
+         where u.is_completed
+         group by u.user_id
+        on conflict (user_id) do update
+            set lbucks = users.lbucks + excluded.lbucks,
+                missions_completed = users.missions_completed + excluded.missions_completed
+    )
+    select u.id::bigint, u.user_id::text, u.progress::integer, u.is_completed,
+           u.description::text, u.reward::integer
+      from updated u;
+$$;
+
+-- --- USUARIOS: MOVIMIENTOS DE SALDO ATÓMICOS ---
+-- Suma (o resta, con un monto negativo) LBucks en una sola sentencia y devuelve el
+-- saldo resultante. Crea la fila del usuario si todavía no existe.
+create or replace function increment_lbucks(p_user_id text, p_amount bigint)
+returns bigint
+language sql
+as $$
+    insert into users (user_id, lbucks)
+    values (p_user_id, p_amount)
+    on conflict (user_id) do update set lbucks = users.lbucks + excluded.lbucks
+    returning lbucks::bigint;
+$$;
+
+-- Paga la recompensa de una misión y suma una misión completada al usuario.
+create or replace function reward_mission(p_user_id text, p_reward bigint)
+returns table (lbucks bigint, missions_completed integer)
+language sql
+as $$
+    insert into users (user_id, lbucks, missions_completed)
+    values (p_user_id, p_reward, 1)
+    on conflict (user_id) do update
+        set lbucks = users.lbucks + excluded.lbucks,
+            missions_completed = users.missions_completed + 1
+    returning lbucks::bigint, missions_completed::integer;
+$$;
+
+-- Transfiere LBucks entre dos usuarios en una sola transacción. Devuelve una fila
+-- con los saldos resultantes de ambos, o ninguna si el emisor no tenía fondos.
+create or replace function transfer_lbucks(p_from text, p_to text, p_amount bigint)
+returns table (from_balance bigint, to_balance bigint)
+language plpgsql
+as $$
+declare
+    v_from bigint;
+    v_to bigint;
+begin
+    if p_amount <= 0 or p_from = p_to then
+        return;
+    end if;
+
+    update users
+       set lbucks = lbucks - p_amount
+     where user_id = p_from
+       and lbucks >= p_amount
+    returning lbucks into v_from;
+    if not found then
+        return;
+    end if;
+
+    insert into users (user_id, lbucks)
+    values (p_to, p_amount)
+    on conflict (user_id) do update set lbucks = users.lbucks + excluded.lbucks
+    returning lbucks into v_to;
+
+    return query select v_from, v_to;
+end;
+$$;
+
+-- --- AVENTURA: INVENTARIO ---
+-- Aplica {"nombre": delta, ...} al inventario de un jugador en una sola sentencia
+-- bloqueada por fila. Devuelve el inventario resultante, o null si el jugador no
+-- existe o algún material quedaría en negativo (en ese caso no se modifica nada).
+create or replace function adjust_inventory(p_user_id text, p_changes jsonb)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_inventory jsonb;
+    v_name text;
+    v_delta integer;
+    v_count integer;
+begin
+    select inventory_counts(p.inventory) into v_inventory
+      from adventure_players p
+     where p.user_id = p_user_id
+       for update;
+    if not found then
+        return null;
+    end if;
+
+    for v_name, v_delta in select c.key, c.value::integer from jsonb_each_text(p_changes) as c loop
+        v_count := coalesce((v_inventory->>v_name)::integer, 0) + v_delta;
+        if v_count < 0 then
+            return null;
+        elsif v_count = 0 then
+            v_inventory := v_inventory - v_name;
+        else
+            v_inventory := jsonb_set(v_inventory, array[v_name], to_jsonb(v_count));
+        end if;
+    end loop;
+
+    update adventure_players p
+       set inventory = v_inventory
+     where p.user_id = p_user_id;
+    return v_inventory;
+end;
+$$;
+
+-- Compra una mejora de nave o estación en una sola transacción: comprueba que el
+-- nivel actual sea p_level - 1 (un doble clic no paga dos veces), descuenta los
+-- LBucks y los materiales y sube nivel y poder. status es 'ok', 'not_found',
+-- 'already_upgraded', 'insufficient_lbucks' o 'insufficient_materials'; si no es
+-- 'ok' no se modifica nada. Devuelve el perfil resultante.
+create or replace function purchase_upgrade(
+    p_user_id text, p_upgrade_type text, p_level integer,
+    p_cost_lbucks bigint, p_cost_materials jsonb, p_power_increase integer
+)
+returns table (status text, balance bigint, ship_level integer, station_level integer,
+               power_level integer, inventory jsonb)
+language plpgsql
+as $$
+#variable_conflict use_column
+declare
+    v_player adventure_players%rowtype;
+    v_current_level integer;
+    v_inventory jsonb;
+    v_name text;
+    v_required integer;
+    v_count integer;
+    v_balance bigint;
+begin
+    if p_upgrade_type not in ('ship', 'station') then
+        return query select 'not_found'::text, null::bigint, null::integer, null::integer, null::integer, null::jsonb;
+        return;
+    end if;
+
+    select * into v_player
+      from adventure_players p
+     where p.user_id = p_user_id
+       for update;
+    if not found then
+        return query select 'not_found'::text, null::bigint, null::integer, null::integer, null::integer, null::jsonb;
+        return;
+    end if;
+
+    v_current_level := case p_upgrade_type when 'ship' then v_player.ship_level else v_player.station_level end;
+    if v_current_level <> p_level - 1 then
+        return query select 'already_upgraded'::text, null::bigint, v_player.ship_level::integer, v_player.station_level::integer,
+                            v_player.power_level::integer, inventory_counts(v_player.inventory);
+        return;
+    end if;
+
+    v_inventory := inventory_counts(v_player.inventory);
+    for v_name, v_required in select c.key, c.value::integer from jsonb_each_text(p_cost_materials) as c loop
+        v_count := coalesce((v_inventory->>v_name)::integer, 0) - v_required;
+        if v_count < 0 then
+            return query select 'insufficient_materials'::text, null::bigint, v_player.ship_level::integer, v_player.station_level::integer,
+                                v_player.power_level::integer, inventory_counts(v_player.inventory);
+            return;
+        elsif v_count = 0 then
+            v_inventory := v_inventory - v_name;
+        else
+            v_inventory := jsonb_set(v_inventory, array[v_name], to_jsonb(v_count));
+        end if;
+    end loop;
+
+    update users u
+       set lbucks = u.lbucks - p_cost_lbucks
+     where u.user_id = p_user_id
+       and u.lbucks >= p_cost_lbucks
+    returning u.lbucks into v_balance;
+    if not found then
+        return query select 'insufficient_lbucks'::text, null::bigint, v_player.ship_level::integer, v_player.station_level::integer,
+                            v_player.power_level::integer, inventory_counts(v_player.inventory);
+        return;
+    end if;
+
+    update adventure_players p
+       set ship_level = case when p_upgrade_type = 'ship' then p_level else p.ship_level end,
+           station_level = case when p_upgrade_type = 'station' then p_level else p.station_level end,
+           power_level = p.power_level + p_power_increase,
+           inventory = v_inventory
+     where p.user_id = p_user_id
+    returning p.* into v_player;
+
+    return query select 'ok'::text, v_balance, v_player.ship_level::integer, v_player.station_level::integer,
+                        v_player.power_level::integer, v_player.inventory;
+end;
+$$;
+
+-- Aplica una conquista en una sola transacción: añade el planeta a
+-- conquered_planets (jsonb), suma una unidad del material obtenido, el poder ganado
+-- y la recompensa en LBucks. status es 'ok', 'not_found' o 'already_conquered'
+-- (p. ej. doble clic); si no es 'ok' no se modifica nada.
+create or replace function apply_conquest(
+    p_user_id text, p_planet_name text, p_loot_name text, p_reward bigint, p_power_reward integer
+)
+returns table (status text, balance bigint, power_level integer)
+language plpgsql
+as $$
+#variable_conflict use_column
+declare
+    v_conquered jsonb;
+    v_inventory jsonb;
+    v_power integer;
+    v_balance bigint;
+begin
+    select coalesce(p.conquered_planets, '[]'::jsonb), inventory_counts(p.inventory)
+      into v_conquered, v_inventory
+      from adventure_players p
+     where p.user_id = p_user_id
+       for update;
+    if not found then
+        return query select 'not_found'::text, null::bigint, null::integer;
+        return;
+    end if;
+    if v_conquered ? p_planet_name then
+        return query select 'already_conquered'::text, null::bigint, null::integer;
+        return;
+    end if;
+
+    update adventure_players p
+       set conquered_planets = v_conquered || to_jsonb(p_planet_name),
+           inventory = jsonb_set(v_inventory, array[p_loot_name],
+                                 to_jsonb(coalesce((v_inventory->>p_loot_name)::integer, 0) + 1)),
+           power_level = p.power_level + p_power_reward
+     where p.user_id = p_user_id
+    returning p.power_level into v_power;
+
+    insert into users (user_id, lbucks)
+    values (p_user_id, p_reward)
+    on conflict (user_id) do update set lbucks = users.lbucks + excluded.lbucks
+    returning lbucks into v_balance;
+
+    return query select 'ok'::text, v_balance, v_power;
+end;
+$$;
+
+-- --- INVITACIONES: RECOMPENSA ATÓMICA ---
+-- Registra el uso de una invitación. La primera vez que se ve el código solo se
+-- inserta; la siguiente se paga p_reward al invitador y se marca reward_given, una
+-- única vez. status es 'registered', 'rewarded' o 'already_rewarded'; al registrar
+-- se suma uno a users.invite_count y se devuelve el nuevo total.
+drop function if exists claim_invite_reward(text, text, bigint);
+create or replace function claim_invite_reward(p_invite_code text, p_inviter_id text, p_reward bigint)
+returns table (status text, balance bigint, invite_count integer)
+language plpgsql
+as $$
+#variable_conflict use_column
+declare
+    v_reward_given boolean;
+    v_balance bigint;
+    v_invite_count integer;
+begin
+    -- Serializa las llamadas para el mismo código (varias entradas casi simultáneas).
+    perform pg_advisory_xact_lock(hashtext('invite:' || p_invite_code));
+
+    select i.reward_given into v_reward_given
+      from invites i
+     where i.invite_code = p_invite_code
+       for update;
+    if not found then
+        insert into invites (invite_code, inviter_id)
+        values (p_invite_code, p_inviter_id);
+        insert into users (user_id, lbucks, invite_count)
+        values (p_inviter_id, 0, 1)
+        on conflict (user_id) do update set invite_count = users.invite_count + 1
+        returning invite_count into v_invite_count;
+        return query select 'registered'::text, null::bigint, v_invite_count;
+        return;
+    end if;
+    if v_reward_given then
+        return query select 'already_rewarded'::text, null::bigint, null::integer;
+        return;
+    end if;
+
+    update invites i
+       set reward_given = true
+     where i.invite_code = p_invite_code;
+
+    insert into users (user_id, lbucks)
+    values (p_inviter_id, p_reward)
+    on conflict (user_id) do update set lbucks = users.lbucks + excluded.lbucks
+    returning lbucks into v_balance;
+
+    return query select 'rewarded'::text, v_balance, null::integer;
+end;
+$$;
+
+-- --- TIENDA: CANJEOS TRANSACCIONALES ---
+-- Cobra el ítem, descuenta una unidad de stock y registra el canjeo pendiente en
+-- una sola transacción. status es 'ok', 'not_found', 'out_of_stock' o
+-- 'insufficient_funds'; si no es 'ok' no se modifica nada.
+create or replace function redeem_item(p_user_id text, p_item_id text)
+returns table (status text, redemption_id bigint, balance bigint, stock integer, price bigint)
+language plpgsql
+as $$
+#variable_conflict use_column
+declare
+    v_price bigint;
+    v_stock integer;
+    v_balance bigint;
+    v_redemption_id bigint;
+begin
+    select s.price, s.stock into v_price, v_stock
+      from shop s
+     where s.item_id = p_item_id
+       for update;
+    if not found then
+        return query select 'not_found'::text, null::bigint, null::bigint, null::integer, null::bigint;
+        return;
+    end if;
+    if v_stock <= 0 then
+        return query select 'out_of_stock'::text, null::bigint, null::bigint, v_stock, v_price;
+        return;
+    end if;
+
+    update users u
+       set lbucks = u.lbucks - v_price
+     where u.user_id = p_user_id
+       and u.lbucks >= v_price
+    returning u.lbucks into v_balance;
+    if not found then
+        return query select 'insufficient_funds'::text, null::bigint, null::bigint, v_stock, v_price;
+        return;
+    end if;
+
+    update shop s
+       set stock = s.stock - 1
+     where s.item_id = p_item_id
+    returning s.stock into v_stock;
+
+    insert into redemptions (user_id, item_id, status, price)
+    values (p_user_id, p_item_id, 'pending', v_price)
+    returning redemptions.redemption_id into v_redemption_id;
+
+    return query select 'ok'::text, v_redemption_id, v_balance, v_stock, v_price;
+end;
+$$;
+
+-- Transacción compensatoria de redeem_item: marca el canjeo pendiente con p_status,
+-- devuelve los LBucks pagados y repone la unidad de stock. status es 'ok' o
+-- 'already_processed' si el canjeo no existe o ya no estaba pendiente.
+create or replace function refund_redemption(p_message_id text, p_status text)
+returns table (status text, redemption_id bigint, user_id text, item_id text, price bigint)
+language plpgsql
+as $$
+#variable_conflict use_column
+declare
+    v_redemption_id bigint;
+    v_user_id text;
+    v_item_id text;
+    v_price bigint;
+begin
+    update redemptions r
+       set status = p_status
+     where r.message_id = p_message_id
+       and r.status = 'pending'
+    returning r.redemption_id, r.user_id, r.item_id, r.price
+         into v_redemption_id, v_user_id, v_item_id, v_price;
+    if not found then
+        return query select 'already_processed'::text, null::bigint, null::text, null::text, null::bigint;
+        return;
+    end if;
+
+    -- Los canjeos anteriores a la columna price se reembolsan al precio actual.
+    if v_price is null then
+        select s.price into v_price from shop s where s.item_id = v_item_id;
+    end if;
+
+    insert into users (user_id, lbucks)
+    values (v_user_id, coalesce(v_price, 0))
+    on conflict (user_id) do update set lbucks = users.lbucks + excluded.lbucks;
+
+    update shop s
+       set stock = s.stock + 1
+     where s.item_id = v_item_id;
+
+    return query select 'ok'::text, v_redemption_id, v_user_id, v_item_id, v_price;
+end;
+$$;